@@ -127,7 +127,24 @@ with DAG(
         """.strip(),
     )
 
-    # 8) Generate LLM responses (limit configurable)
+    # 7b) Warm-up Ollama dès le début du DAG: modèle chargé (keep_alive) pendant le RAG,
+    # préfixe prompt système + consignes déjà en cache quand 09 démarre; best effort
+    warm_llm = BashOperator(
+        task_id="09_llm_warmup",
+        bash_command=f"""
+        set -uo pipefail
+        cd "{PROJECT_DIR}"
+        source "{VENV_ACTIVATE}"
+        python src/09_rag_generate_responses.py --warmup || true
+        """.strip(),
+        env={
+            "OLLAMA_HOST": "http://localhost:11434",
+            "OLLAMA_MODEL": "qwen2.5:7b-instruct-q4_K_M",
+            # "OLLAMA_KEEP_ALIVE": "30m",
+        },
+    )
+
+    # 8) Generate LLM responses (limit configurable), warm-up déjà fait par 09_llm_warmup
     # Lancement: "Trigger DAG w/ config" -> {"limit": 10}
     generate_llm = BashOperator(
         task_id="09_rag_generate_responses",
@@ -135,17 +152,19 @@ with DAG(
         set -euo pipefail
         cd "{PROJECT_DIR}"
         source "{VENV_ACTIVATE}"
-        python src/09_rag_generate_responses.py --limit {{{{ dag_run.conf.get('limit', 10) }}}}
+        python src/09_rag_generate_responses.py --limit {{{{ dag_run.conf.get('limit', 10) }}}} --no-warmup
         """.strip(),
         # Optionnel: variables d'env utiles
         env={
             "OLLAMA_HOST": "http://localhost:11434",
             "OLLAMA_MODEL": "qwen2.5:7b-instruct-q4_K_M",
             # tu peux aussi régler WORKERS/TEMP ici
-            # "WORKERS": "2",
+            # "WORKERS": "2",  # concurrence de départ, ajustée (AIMD) jusqu'à LLM_MAX_CONCURRENCY
             # "TEMPERATURE": "0.1",
             # "TOP_P": "0.2",
             # "NUM_PREDICT": "220",
+            # "OLLAMA_KEEP_ALIVE": "30m",  # modèle gardé chargé entre deux runs
+            # "OLLAMA_HOSTS": "http://gpu1:11434=2,http://gpu2:11434",  # répartition pondérée + bascule
         },
     )
 
@@ -153,3 +172,4 @@ with DAG(
     prep_dirs >> clean_messages >> detect_lang >> rules_baseline >> rules_audit
     rules_audit >> make_docs_policy >> make_docs_p2p3 >> make_docs_cases
     make_docs_cases >> build_rag_index >> rag_retrieve >> generate_llm
+    prep_dirs >> warm_llm >> generate_llm
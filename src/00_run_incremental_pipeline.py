@@ -78,60 +78,73 @@ def main():
         print("✅ Nothing new. Exiting.")
         return
 
-    # --- Step 0: save "processed" input for the next scripts
-    # Here we keep it simple: just rename text -> text_clean if your next scripts expect text_clean later,
-    # but your notebook produces messages_processed.csv. For demo: we create minimal processed schema.
-    # If your rules script expects text_clean, we create it.
-    new_rows["text_clean"] = new_rows["text"]
-    new_rows.to_csv(tmp_processed, index=False, encoding="utf-8")
-    print("✅ tmp processed:", tmp_processed)
-
-    # --- Step 1: run rules baseline on tmp_processed
-    # We run your existing script but it reads/writes fixed paths.
-    # So we temporarily swap cleanData/messages_processed.csv with our tmp batch.
-    # (Safe for demo; for prod we can add --input/--output args later.)
-    backup_processed = None
-    if processed_path.exists():
-        backup_processed = tmp_dir / "_backup_messages_processed.csv"
-        shutil.copy2(processed_path, backup_processed)
-
-    shutil.copy2(tmp_processed, processed_path)
-    run(["python", str(base / "src" / "03_rules_baseline.py")])
-
-    # after run, rules output should exist:
-    if not rules_path.exists():
-        raise SystemExit("❌ rules output not found: cleanData/messages_rules.csv")
-    shutil.copy2(rules_path, tmp_rules)
-
-    # restore original processed
-    if backup_processed:
-        shutil.copy2(backup_processed, processed_path)
-
-    # --- Step 2: RAG retrieve (reads messages_rules.csv -> writes messages_with_context.csv)
-    # Swap in tmp_rules as current messages_rules.csv
-    backup_rules = None
-    if rules_path.exists():
-        backup_rules = tmp_dir / "_backup_messages_rules.csv"
-        shutil.copy2(rules_path, backup_rules)
-
-    shutil.copy2(tmp_rules, rules_path)
-    run(["python", str(base / "src" / "07_rag_retrieve_for_messages.py")])
-
-    if not with_ctx_path.exists():
-        raise SystemExit("❌ rag context output not found: cleanData/messages_with_context.csv")
-    shutil.copy2(with_ctx_path, tmp_with_ctx)
-
-    if backup_rules:
-        shutil.copy2(backup_rules, rules_path)
-
-    # --- Step 3: LLM generation (reads messages_with_context.csv -> writes messages_final.csv)
-    backup_with = None
-    if with_ctx_path.exists():
-        backup_with = tmp_dir / "_backup_messages_with_context.csv"
-        shutil.copy2(with_ctx_path, backup_with)
-
-    shutil.copy2(tmp_with_ctx, with_ctx_path)
-    run(["python", str(base / "src" / "09_rag_generate_responses.py"), "--limit", str(args.limit)])
+    # Warm-up Ollama en arrière-plan pendant rules + RAG (modèle chargé, préfixe en cache)
+    warmup = subprocess.Popen(["python", str(base / "src" / "09_rag_generate_responses.py"), "--warmup"])
+
+    try:
+        # --- Step 0: save "processed" input for the next scripts
+        # Here we keep it simple: just rename text -> text_clean if your next scripts expect text_clean later,
+        # but your notebook produces messages_processed.csv. For demo: we create minimal processed schema.
+        # If your rules script expects text_clean, we create it.
+        new_rows["text_clean"] = new_rows["text"]
+        new_rows.to_csv(tmp_processed, index=False, encoding="utf-8")
+        print("✅ tmp processed:", tmp_processed)
+
+        # --- Step 1: run rules baseline on tmp_processed
+        # We run your existing script but it reads/writes fixed paths.
+        # So we temporarily swap cleanData/messages_processed.csv with our tmp batch.
+        # (Safe for demo; for prod we can add --input/--output args later.)
+        backup_processed = None
+        if processed_path.exists():
+            backup_processed = tmp_dir / "_backup_messages_processed.csv"
+            shutil.copy2(processed_path, backup_processed)
+
+        shutil.copy2(tmp_processed, processed_path)
+        run(["python", str(base / "src" / "03_rules_baseline.py")])
+
+        # after run, rules output should exist:
+        if not rules_path.exists():
+            raise SystemExit("❌ rules output not found: cleanData/messages_rules.csv")
+        shutil.copy2(rules_path, tmp_rules)
+
+        # restore original processed
+        if backup_processed:
+            shutil.copy2(backup_processed, processed_path)
+
+        # --- Step 2: RAG retrieve (reads messages_rules.csv -> writes messages_with_context.csv)
+        # Swap in tmp_rules as current messages_rules.csv
+        backup_rules = None
+        if rules_path.exists():
+            backup_rules = tmp_dir / "_backup_messages_rules.csv"
+            shutil.copy2(rules_path, backup_rules)
+
+        shutil.copy2(tmp_rules, rules_path)
+        # 07 passe par le serveur chaud (07_rag_server.py) s'il tourne: pas de rechargement modèle/index
+        run(["python", str(base / "src" / "07_rag_retrieve_for_messages.py")])
+
+        if not with_ctx_path.exists():
+            raise SystemExit("❌ rag context output not found: cleanData/messages_with_context.csv")
+        shutil.copy2(with_ctx_path, tmp_with_ctx)
+
+        if backup_rules:
+            shutil.copy2(backup_rules, rules_path)
+
+        # --- Step 3: LLM generation (reads messages_with_context.csv -> writes messages_final.csv)
+        backup_with = None
+        if with_ctx_path.exists():
+            backup_with = tmp_dir / "_backup_messages_with_context.csv"
+            shutil.copy2(with_ctx_path, backup_with)
+
+        shutil.copy2(tmp_with_ctx, with_ctx_path)
+        # warm-up déjà fait (modèle chargé, préfixe en cache): 09 ne le refait pas
+        warmed = warmup.wait() == 0
+        run(["python", str(base / "src" / "09_rag_generate_responses.py"), "--limit", str(args.limit)]
+            + (["--no-warmup"] if warmed else []))
+    finally:
+        # étape en échec (ou Ctrl-C) avant 09: pas de warm-up orphelin
+        if warmup.poll() is None:
+            warmup.terminate()
+        warmup.wait()
 
     if not final_path.exists():
         raise SystemExit("❌ final output not found: cleanData/messages_final.csv")
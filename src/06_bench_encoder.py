@@ -0,0 +1,154 @@
+# src/06_bench_encoder.py
+"""
+Benchmark des backends d'encodage (torch vs onnx int8) + contrôle de parité.
+
+Chaque backend tourne dans un sous-process (mémoire et temps de démarrage réels, imports inclus):
+- startup: import + chargement du modèle (export ONNX exclu s'il existe déjà)
+- throughput: textes/s sur les passages du chunk store + requêtes 07
+- RSS max du process
+Parité: similarité cosinus torch vs onnx par texte (les deux sont normalisés)
+et accord du top-k retrieval requêtes -> passages.
+
+    python src/06_bench_encoder.py                 # torch + onnx
+    python src/06_bench_encoder.py --export        # force un nouvel export ONNX int8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from embeddings import embedding_profile
+
+MODEL_NAME = embedding_profile()["model"]
+PARITY_MIN_MEAN_COS = 0.98
+
+
+def load_texts(base_dir: Path, nb_queries: int) -> tuple[list[str], list[str]]:
+    import pandas as pd
+
+    import rag_store
+    from rag_retrieval import row_fields, rewrite_query_from_row
+
+    store = rag_store.ChunkStore(base_dir / "cleanData" / "rag")
+    passages = [f"passage: {store.text(i)}" for i in store.ids()]
+
+    df = pd.read_csv(base_dir / "cleanData" / "messages_rules.csv").head(nb_queries)
+    queries = [q for q in (rewrite_query_from_row(*row_fields(r)) for _, r in df.iterrows()) if q]
+    return passages, queries
+
+
+def run_worker(backend: str, texts_path: Path, out_npy: Path, batch_size: int) -> dict:
+    """Exécuté dans le sous-process: aucun autre backend chargé."""
+    t0 = time.time()
+    import encoder_backends
+
+    base_dir = Path(__file__).resolve().parent.parent
+    model = encoder_backends.load_backend(backend, MODEL_NAME, base_dir)
+    startup_s = time.time() - t0
+
+    texts = json.loads(texts_path.read_text(encoding="utf-8"))
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+
+    t1 = time.time()
+    emb = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    encode_s = time.time() - t1
+    np.save(out_npy, np.asarray(emb, dtype=np.float32))
+
+    return {
+        "backend": backend,
+        "startup_s": round(startup_s, 3),
+        "encode_s": round(encode_s, 3),
+        "texts_per_s": round(len(texts) / max(encode_s, 1e-9), 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def topk_agreement(pa: np.ndarray, qa: np.ndarray, pb: np.ndarray, qb: np.ndarray, k: int = 5) -> dict:
+    ta = np.argsort(-(qa @ pa.T), axis=1)[:, :k]
+    tb = np.argsort(-(qb @ pb.T), axis=1)[:, :k]
+    top1 = float(np.mean(ta[:, 0] == tb[:, 0]))
+    overlap = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ta, tb)]))
+    return {"top1_agreement": round(top1, 4), f"top{k}_overlap": round(overlap, 4)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="torch,onnx")
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--export", action="store_true", help="Ré-exporte le modèle ONNX int8 avant le benchmark")
+    ap.add_argument("--out", default="cleanData/bench/encoder_bench.json")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    ap.add_argument("--texts", help=argparse.SUPPRESS)
+    ap.add_argument("--npy", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, Path(args.texts), Path(args.npy), args.batch_size)))
+        return
+
+    base_dir = Path(__file__).resolve().parent.parent
+    if args.export:
+        import encoder_backends
+
+        encoder_backends.export_onnx(MODEL_NAME, encoder_backends.default_onnx_dir(base_dir, MODEL_NAME))
+
+    passages, queries = load_texts(base_dir, args.queries)
+    texts = passages + queries
+    print(f"Textes: {len(texts)} (passages={len(passages)}, requêtes={len(queries)})\n")
+
+    results, vectors = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = Path(tmp) / "texts.json"
+        texts_path.write_text(json.dumps(texts, ensure_ascii=False), encoding="utf-8")
+
+        for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            npy = Path(tmp) / f"{backend}.npy"
+            cmd = [sys.executable, __file__, "--worker", backend, "--texts", str(texts_path),
+                   "--npy", str(npy), "--batch-size", str(args.batch_size)]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            res = json.loads(out.strip().splitlines()[-1])
+            results.append(res)
+            vectors[backend] = np.load(npy)
+            print(
+                f"{backend:<6} startup={res['startup_s']:.2f}s  encode={res['texts_per_s']:.1f} textes/s  "
+                f"max_rss={res['max_rss_mb']:.0f}MB"
+            )
+
+    report = {"nb_texts": len(texts), "batch_size": args.batch_size, "backends": results}
+
+    if "torch" in vectors and "onnx" in vectors:
+        a, b = vectors["torch"], vectors["onnx"]
+        cos = np.sum(a * b, axis=1)
+        n_p = len(passages)
+        parity = {
+            "cos_mean": round(float(cos.mean()), 5),
+            "cos_p01": round(float(np.percentile(cos, 1)), 5),
+            "cos_min": round(float(cos.min()), 5),
+            **topk_agreement(a[:n_p], a[n_p:], b[:n_p], b[n_p:]),
+        }
+        parity["ok"] = parity["cos_mean"] >= PARITY_MIN_MEAN_COS
+        report["parity"] = parity
+        flag = "✅" if parity["ok"] else "❌"
+        print(
+            f"\n{flag} Parité torch/onnx: cos moyen={parity['cos_mean']:.4f} p01={parity['cos_p01']:.4f} "
+            f"min={parity['cos_min']:.4f} | top1 identique={100 * parity['top1_agreement']:.1f}% "
+            f"| overlap top5={100 * parity['top5_overlap']:.1f}%"
+        )
+
+    out_path = base_dir / args.out
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n✅ Résultats: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# src/06_bench_index.py
+"""
+Benchmark des types d'index FAISS (flat / hnsw / ivf_flat / ivf_pq) sur le corpus courant.
+
+Pour chaque config (+ balayage efSearch / nprobe):
+- recall@k par rapport à l'index exact (Flat)
+- latence de recherche p50/p99 (1 requête à la fois, comme 07) + QPS en batch
+- taille mémoire de l'index (sérialisé)
+
+--scale N ajoute N vecteurs synthétiques (perturbations des vrais chunks)
+pour simuler un corpus plus gros et choisir les réglages par taille de corpus.
+
+Dédup (manifest["dedup"]): recall@k de l'index dédupliqué vs recherche exacte
+sur tous les chunks, un résultat comptant pour son chunk canonique.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import rag_store
+from embeddings import embedding_profile, load_encoder
+from rag_retrieval import row_fields, rewrite_query_from_row
+
+# modèle du profil d'embedding (EMB_PROFILE / EMB_MODEL), doit être celui du build
+MODEL_NAME = embedding_profile()["model"]
+
+# (config de build, valeurs de knob à balayer)
+SWEEPS = {
+    "flat": [({}, [None])],
+    "hnsw": [({"hnsw_m": 16}, [16, 32, 64, 128]), ({"hnsw_m": 32}, [32, 64, 128])],
+    "ivf_flat": [({}, [1, 4, 8, 16, 32])],
+    "ivf_pq": [({}, [1, 4, 8, 16, 32])],
+}
+
+
+def synthetic_vectors(base: np.ndarray, n: int, noise: float = 0.35, seed: int = 42) -> np.ndarray:
+    """Mélange de 2 vrais chunks + bruit gaussien, normalisé (distribution proche du corpus)."""
+    rng = np.random.default_rng(seed)
+    a = base[rng.integers(0, len(base), n)]
+    b = base[rng.integers(0, len(base), n)]
+    w = rng.random((n, 1), dtype=np.float32)
+    x = w * a + (1 - w) * b + noise * rng.standard_normal((n, base.shape[1]), dtype=np.float32) / np.sqrt(base.shape[1])
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
+    return x.astype(np.float32)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = 0
+    for f, t in zip(found, truth):
+        hits += len(set(f[f >= 0].tolist()) & set(t[t >= 0].tolist()))
+    return hits / max(1, truth.size)
+
+
+def dedup_recall(x_all: np.ndarray, all_ids: np.ndarray, keep: np.ndarray, duplicate_of: dict,
+                 xq: np.ndarray, k: int) -> dict:
+    """Top-k exact avant/après dédup; la vérité est ramenée aux ids canoniques."""
+    full = rag_store.build_index(rag_store.resolve_index_params({"type": "flat"}, len(x_all), x_all.shape[1]),
+                                 x_all, all_ids)
+    dedup = rag_store.build_index(rag_store.resolve_index_params({"type": "flat"}, int(keep.sum()), x_all.shape[1]),
+                                  x_all[keep], all_ids[keep])
+    _, truth = full.search(xq, k)
+    _, found = dedup.search(xq, k)
+    hits = total = 0
+    distinct_full = []
+    for t, f in zip(truth, found):
+        canon = {duplicate_of.get(int(i), int(i)) for i in t if i >= 0}
+        hits += len(canon & set(f.tolist()))
+        total += len(canon)
+        distinct_full.append(len(canon))
+    return {
+        "nb_chunks": int(len(all_ids)),
+        "nb_indexed": int(keep.sum()),
+        "shrink_pct": round(100 * (1 - keep.sum() / max(1, len(all_ids))), 2),
+        f"recall@{k}": round(hits / max(1, total), 4),
+        "distinct_in_full_topk": round(float(np.mean(distinct_full)), 3),
+        "memory_mb_full": round(rag_store.index_memory_bytes(full) / 1e6, 3),
+        "memory_mb_dedup": round(rag_store.index_memory_bytes(dedup) / 1e6, 3),
+    }
+
+
+def time_search(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, list[float], float]:
+    lat = []
+    ids = np.zeros((len(queries), k), dtype=np.int64)
+    for j in range(len(queries)):
+        t0 = time.perf_counter()
+        _, idx = index.search(queries[j:j + 1], k)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        ids[j] = idx[0]
+
+    t0 = time.perf_counter()
+    index.search(queries, k)
+    batch_qps = len(queries) / max(time.perf_counter() - t0, 1e-9)
+    return ids, lat, batch_qps
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=300, help="Nb de messages (messages_rules.csv) utilisés comme requêtes")
+    ap.add_argument("--scale", type=int, default=0, help="Vecteurs synthétiques ajoutés au corpus")
+    ap.add_argument("--types", default=",".join(rag_store.INDEX_TYPES))
+    ap.add_argument("--out", default="cleanData/bench/index_bench.json")
+    args = ap.parse_args()
+
+    base_dir = Path(__file__).resolve().parent.parent
+    rag_dir = base_dir / "cleanData" / "rag"
+    # corpus: vrais chunks (cache d'embeddings -> pas de forward si l'index a déjà été construit)
+    encoder = load_encoder(MODEL_NAME, base_dir)
+    _, store = rag_store.load_store(rag_dir, model_id=encoder.model_id)
+    duplicate_of = rag_store.duplicate_map(rag_store.load_manifest(rag_dir))
+    all_ids = store.ids().astype(np.int64)
+    x_all = encoder.encode([f"passage: {store.text(i)}" for i in all_ids])
+    keep = np.asarray([int(i) not in duplicate_of for i in all_ids], dtype=bool)
+    # sweeps sur le corpus réellement indexé (chunks canoniques)
+    chunk_ids = all_ids[keep]
+    xb = x_all[keep]
+    ids = chunk_ids.copy()
+    if args.scale > 0:
+        xb = np.vstack([xb, synthetic_vectors(xb, args.scale)])
+        ids = np.concatenate([ids, np.arange(args.scale, dtype=np.int64) + int(chunk_ids.max()) + 1])
+
+    # requêtes: même rewrite que 07
+    df = pd.read_csv(base_dir / "cleanData" / "messages_rules.csv")
+    df = df.sample(n=min(args.queries, len(df)), random_state=42) if len(df) > args.queries else df
+    queries = [rewrite_query_from_row(*row_fields(row)) for _, row in df.iterrows()]
+    xq = encoder.encode([q for q in queries if q])
+    encoder.flush()
+
+    k = min(args.k, len(xb))
+    base_cfg = rag_store.index_config_from_env()
+    # vérité terrain: recherche exacte fp32 sans projection (les sweeps gardent projection/stockage du profil)
+    exact = rag_store.build_index(rag_store.resolve_index_params({"type": "flat"}, len(xb), xb.shape[1]), xb, ids)
+    _, truth = exact.search(xq, k)
+
+    print(f"Corpus: {len(xb)} vecteurs (dim={xb.shape[1]}) | requêtes: {len(xq)} | k={k}\n")
+
+    dedup = None
+    if duplicate_of:
+        dedup = dedup_recall(x_all, all_ids, keep, duplicate_of, xq, k)
+        print(
+            f"Dédup: {dedup['nb_indexed']}/{dedup['nb_chunks']} chunks indexés (-{dedup['shrink_pct']:.1f}%) "
+            f"| recall@{k} (canonique) = {dedup[f'recall@{k}']:.3f} "
+            f"| chunks distincts dans le top-{k} sans dédup = {dedup['distinct_in_full_topk']:.2f}\n"
+        )
+    results = []
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip()]:
+        for overrides, knobs in SWEEPS[index_type]:
+            cfg = {**base_cfg, **overrides, "type": index_type}
+            params = rag_store.resolve_index_params(cfg, len(xb), xb.shape[1])
+            t0 = time.perf_counter()
+            index = rag_store.build_index(params, xb, ids)
+            build_s = time.perf_counter() - t0
+            mem = rag_store.index_memory_bytes(index)
+
+            for knob in knobs:
+                if index_type == "hnsw":
+                    rag_store.apply_search_params(index, params, ef_search=knob)
+                elif index_type.startswith("ivf"):
+                    if knob > params["nlist"]:
+                        continue
+                    rag_store.apply_search_params(index, params, nprobe=knob)
+
+                found, lat, qps = time_search(index, xq, k)
+                res = {
+                    "spec": rag_store.index_spec(params),
+                    "type": index_type,
+                    "knob": ("efSearch" if index_type == "hnsw" else "nprobe" if knob else None),
+                    "knob_value": knob,
+                    f"recall@{k}": round(recall_at_k(found, truth), 4),
+                    "p50_ms": round(float(np.percentile(lat, 50)), 4),
+                    "p99_ms": round(float(np.percentile(lat, 99)), 4),
+                    "batch_qps": round(qps, 1),
+                    "memory_mb": round(mem / 1e6, 3),
+                    "build_s": round(build_s, 3),
+                    "params": params,
+                }
+                results.append(res)
+                print(
+                    f"{res['spec']:<28} {str(res['knob'] or ''):>9}={str(knob or ''):<4} "
+                    f"recall@{k}={res[f'recall@{k}']:.3f}  p50={res['p50_ms']:.3f}ms  p99={res['p99_ms']:.3f}ms  "
+                    f"qps(batch)={res['batch_qps']:.0f}  mem={res['memory_mb']:.2f}MB"
+                )
+
+    out_path = base_dir / args.out
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(
+        json.dumps({"corpus_size": len(xb), "dim": int(xb.shape[1]), "k": k, "nb_queries": len(xq),
+                    "dedup": dedup, "results": results},
+                   ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    print(f"\n✅ Résultats: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# src/06_bench_profiles.py
+"""
+Comparaison des profils d'embedding (modèle, projection PCA/troncature, stockage fp16/uint8):
+qualité sur un jeu de requêtes labellisées vs coût (encodage, taille d'index, recherche).
+
+Jeu labellisé = messages_rules.csv: les docs attendus d'un message sont ceux que 07
+force (procédure du niveau + doc de la catégorie, cf. rag_retrieval).
+- recall@k    : part des docs attendus présents dans le top-k brut (avant forçage)
+- level_hit@k : procédure du niveau présente dans le top-k brut
+- forced_hit  : procédure du niveau présente après forçage (check has_expected_proc de 08)
+- encode      : ms par requête (1 message à la fois, comme 07) et passages/s, sans cache
+- index       : taille sérialisée, latence de recherche p50
+
+Recommandation: profil le moins cher (taille d'index, puis latence d'encodage) dont
+level_hit@k reste à --tolerance du profil de référence (le 1er de --profiles).
+
+    python src/06_bench_profiles.py
+    python src/06_bench_profiles.py --profiles e5-base,e5-small-fp16 --k 5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import rag_store
+from embeddings import EMB_PROFILES, CachedEncoder, embedding_profile, load_encoder
+from rag_retrieval import (
+    FORCED_DOC_BY_CATEGORY,
+    FORCED_DOC_BY_LEVEL,
+    RagMetadata,
+    force_docs_in_results,
+    row_fields,
+    rewrite_query_from_row,
+)
+
+
+def load_queries(base_dir: Path, nb_queries: int) -> tuple[list[str], list[tuple[str | None, str | None]]]:
+    """Requêtes (même rewrite que 07) + docs attendus (niveau, catégorie)."""
+    df = pd.read_csv(base_dir / "cleanData" / "messages_rules.csv")
+    if len(df) > nb_queries:
+        df = df.sample(n=nb_queries, random_state=42)
+    queries, labels = [], []
+    for _, row in df.iterrows():
+        text, urgency, category = row_fields(row)
+        q = rewrite_query_from_row(text, urgency_level=urgency, category=category)
+        if not q:
+            continue
+        queries.append(q)
+        labels.append((FORCED_DOC_BY_LEVEL.get(urgency), FORCED_DOC_BY_CATEGORY.get(category)))
+    return queries, labels
+
+
+def time_encoder(profile: dict, base_dir: Path, backend: str, queries: list[str], passages: list[str]) -> dict:
+    """Latence d'encodage sans cache (modèle chargé hors chrono)."""
+    raw = CachedEncoder(profile["model"], cache=None, backend=backend, base_dir=base_dir)
+    raw.encode(queries[:1])  # chargement + warm-up
+
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        raw.encode([q])
+        lat.append((time.perf_counter() - t0) * 1000.0)
+
+    t0 = time.perf_counter()
+    raw.encode(passages)
+    passages_s = len(passages) / max(time.perf_counter() - t0, 1e-9)
+    return {
+        "query_ms_p50": round(float(np.percentile(lat, 50)), 3),
+        "query_ms_p99": round(float(np.percentile(lat, 99)), 3),
+        "passages_per_s": round(passages_s, 1),
+        "load_s": round(raw.load_seconds, 2),
+    }
+
+
+def evaluate(index, xq: np.ndarray, labels, k: int, store, meta: RagMetadata) -> dict:
+    _, found = index.search(xq, k)
+
+    lat = []
+    for j in range(min(len(xq), 200)):
+        t0 = time.perf_counter()
+        index.search(xq[j:j + 1], k)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+
+    def docs_of(i: int) -> set[str]:
+        # un chunk canonique représente aussi les docs de ses quasi-doublons
+        return {store.doc(d) for d in [i, *meta.merged.get(i, [])]}
+
+    recall = level_hit = forced_hit = nb_expected = 0
+    for ids, (level_doc, category_doc) in zip(found, labels):
+        picked = [int(i) for i in ids if i >= 0]
+        docs = set().union(*(docs_of(i) for i in picked)) if picked else set()
+        expected = [d for d in (level_doc, category_doc) if d]
+        nb_expected += len(expected)
+        recall += sum(d in docs for d in expected)
+        level_hit += int(bool(level_doc) and level_doc in docs)
+
+        forced_ids, _ = force_docs_in_results(
+            picked, [0.0] * len(picked),
+            forced=[(level_doc, 1.2), (category_doc, 1.3)],
+            store=store, pick_chunk=meta.first_chunk,
+        )
+        forced_hit += int(bool(level_doc) and any(store.doc(i) == level_doc for i in forced_ids))
+
+    n = max(1, len(labels))
+    return {
+        f"recall@{k}": round(recall / max(1, nb_expected), 4),
+        f"level_hit@{k}": round(level_hit / n, 4),
+        "forced_hit": round(forced_hit / n, 4),
+        "search_ms_p50": round(float(np.percentile(lat, 50)), 4) if lat else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--profiles", default=",".join(EMB_PROFILES), help="Le 1er sert de référence")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--time-queries", type=int, default=50, help="Requêtes chronométrées sans cache")
+    ap.add_argument("--time-passages", type=int, default=128, help="Passages chronométrés sans cache")
+    ap.add_argument("--tolerance", type=float, default=0.01, help="Perte de level_hit@k acceptée vs référence")
+    ap.add_argument("--out", default="cleanData/bench/profile_bench.json")
+    args = ap.parse_args()
+
+    base_dir = Path(__file__).resolve().parent.parent
+    rag_dir = base_dir / "cleanData" / "rag"
+
+    # chunks du build courant (le chunking ne dépend pas du profil)
+    manifest = rag_store.load_manifest(rag_dir)
+    if manifest is None:
+        raise SystemExit("Store RAG absent. Lance d'abord 06_build_rag_index.py")
+    store = rag_store.ChunkStore(rag_dir)
+    meta = RagMetadata(manifest)
+    ids = np.asarray(rag_store.indexed_chunk_ids(manifest), dtype=np.int64)
+    passages = [f"passage: {store.text(i)}" for i in ids]
+    queries, labels = load_queries(base_dir, args.queries)
+    k = min(args.k, len(ids))
+    print(f"Corpus: {len(ids)} chunks | requêtes labellisées: {len(queries)} | k={k}\n")
+
+    results = []
+    for name in [p.strip() for p in args.profiles.split(",") if p.strip()]:
+        profile = embedding_profile(name)
+        encoder = load_encoder(profile["model"], base_dir)
+        xb = encoder.encode(passages, show_progress_bar=True)
+        xq = encoder.encode(queries)
+        encoder.flush()
+
+        cfg = rag_store.index_config_from_env(profile)
+        params = rag_store.resolve_index_params(cfg, len(xb), xb.shape[1])
+        t0 = time.perf_counter()
+        index = rag_store.build_index(params, xb, ids)
+        build_s = time.perf_counter() - t0
+
+        res = {
+            "profile": name,
+            **profile,
+            "spec": rag_store.index_spec(params),
+            "dim": int(xb.shape[1]),
+            "index_dim": int(params["index_dim"]),
+            "index_mb": round(rag_store.index_memory_bytes(index) / 1e6, 3),
+            "build_s": round(build_s, 3),
+            **evaluate(index, xq, labels, k, store, meta),
+            **time_encoder(profile, base_dir, encoder.backend, queries[:args.time_queries],
+                           passages[:args.time_passages]),
+        }
+        results.append(res)
+        print(
+            f"{name:<22} {res['spec']:<26} recall@{k}={res[f'recall@{k}']:.3f} "
+            f"level_hit@{k}={res[f'level_hit@{k}']:.3f} forced_hit={res['forced_hit']:.3f} | "
+            f"index={res['index_mb']:.2f}MB search p50={res['search_ms_p50']:.3f}ms | "
+            f"encode {res['query_ms_p50']:.1f}ms/requête {res['passages_per_s']:.0f} passages/s"
+        )
+
+    recommended = None
+    if results:
+        ref = results[0]
+        ok = [
+            r for r in results
+            if r[f"level_hit@{k}"] >= ref[f"level_hit@{k}"] - args.tolerance and r["forced_hit"] >= ref["forced_hit"]
+        ]
+        if ok:
+            recommended = min(ok, key=lambda r: (r["index_mb"], r["query_ms_p50"]))["profile"]
+            print(f"\n✅ Profil recommandé: {recommended} (EMB_PROFILE={recommended})")
+        else:
+            print("\n⚠️ Aucun profil ne tient la tolérance sur level_hit")
+
+    out_path = base_dir / args.out
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(
+        json.dumps({"k": k, "nb_queries": len(queries), "nb_chunks": len(ids), "tolerance": args.tolerance,
+                    "recommended": recommended, "results": results}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    print(f"✅ Résultats: {out_path}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 # src/06_build_rag_index.py
 from pathlib import Path
+import argparse
+import os
 import re
+import time
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
 
+import rag_dedup
+import rag_store
+from embeddings import embedding_profile, load_encoder, physical_cores
+
+
+# profil d'embedding (EMB_PROFILE): modèle + projection/stockage portés par l'index
+EMB_PROFILE = embedding_profile()
+MODEL_NAME = EMB_PROFILE["model"]
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 120
+# workers d'encodage (1 modèle par process); 0 = nb de coeurs physiques
+EMB_WORKERS = int(os.getenv("EMB_WORKERS", "1"))
 
 HEADER_RE = re.compile(r"^(#{1,4})\s+(.+)$", re.MULTILINE)
 
@@ -49,7 +62,63 @@ def chunk_text(text: str, chunk_size=800, overlap=120):
     return chunks
 
 
+def chunk_document(rel: str, text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
+    """Retourne la liste des ChunkRecord d'un document."""
+    out = []
+
+    # 1) split par sections markdown
+    sections = split_markdown_sections(text)
+
+    # 2) sous-chunking
+    for sec_title, sec_text in sections:
+        sub_chunks = chunk_text(sec_text, chunk_size=chunk_size, overlap=overlap)
+        for j, ch in enumerate(sub_chunks):
+            # on enrichit un peu le chunk pour retrieval
+            enriched = f"SOURCE: {rel}\nSECTION: {sec_title}\n\n{ch}".strip()
+            out.append(rag_store.ChunkRecord(text=enriched, doc=rel, section=sec_title, chunk_no=j))
+    return out
+
+
+def load_previous_store(out_dir: Path, full: bool, index_cfg: dict, model_id: str):
+    """
+    Charge manifest + index + chunk store existants si réutilisables.
+    Sinon (absent, autre modèle/chunking, ancien format) -> rebuild complet.
+    """
+    manifest = rag_store.load_manifest(out_dir)
+    if full or manifest is None:
+        return None, None, None
+    if (
+        manifest.get("model") != model_id
+        or manifest.get("chunk_size") != CHUNK_SIZE
+        or manifest.get("overlap") != CHUNK_OVERLAP
+        or manifest.get("index", {}).get("config") != rag_store.build_config(index_cfg)
+    ):
+        print("ℹ️ Modèle/chunking/type d'index modifié -> rebuild complet")
+        return None, None, None
+    try:
+        store = rag_store.ChunkStore(out_dir)
+        index = rag_store.load_index(out_dir)
+    except Exception as e:
+        print(f"ℹ️ Store existant illisible ({e}) -> rebuild complet")
+        return None, None, None
+    if (
+        rag_store.id_map(index) is None
+        or store.build_id != manifest.get("build_id")
+        or index.ntotal != len(rag_store.indexed_chunk_ids(manifest))
+    ):
+        print("ℹ️ Index non ID-mappé ou désaligné -> rebuild complet")
+        return None, None, None
+    return manifest, index, store
+
+
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--full", action="store_true", help="Ignore le manifest et ré-encode tous les docs")
+    ap.add_argument("--workers", type=int, default=EMB_WORKERS, help="Process d'encodage (0 = coeurs physiques)")
+    args = ap.parse_args()
+    workers = args.workers or physical_cores()
+
+    t0 = time.time()
     base_dir = Path(__file__).resolve().parent.parent
     docs_dir = base_dir / "data" / "docs"
     out_dir = base_dir / "cleanData" / "rag"
@@ -59,44 +128,134 @@ def main():
     if not doc_files:
         raise SystemExit(f"Aucun doc trouvé dans {docs_dir}. Lance d'abord 06_make_docs_from_policy.py")
 
-    chunks = []
-    sources = []
+    # modèle chargé seulement au 1er miss du cache; model_id = modèle + backend (torch / onnx-int8)
+    encoder = load_encoder(MODEL_NAME, base_dir)
+
+    index_cfg = rag_store.index_config_from_env(EMB_PROFILE)
+    manifest, index, old_store = load_previous_store(
+        out_dir, full=args.full, index_cfg=index_cfg, model_id=encoder.model_id
+    )
+    if manifest is None:
+        manifest = rag_store.empty_manifest(encoder.model_id, CHUNK_SIZE, CHUNK_OVERLAP)
+    # ids actuellement dans l'index (canoniques du build précédent)
+    prev_indexed = set(rag_store.indexed_chunk_ids(manifest)) if index is not None else set()
+
+    old_docs = manifest["docs"]
+    new_docs = {}
+    to_embed = []  # (doc_rel, text, sha256)
+    nb_unchanged = 0
 
     for fp in doc_files:
         text = fp.read_text(encoding="utf-8", errors="ignore")
         rel = str(fp.relative_to(base_dir))
+        digest = rag_store.sha256_text(text)
+
+        prev = old_docs.get(rel)
+        if prev and prev["sha256"] == digest and all(i in old_store for i in prev["chunk_ids"]):
+            new_docs[rel] = prev
+            nb_unchanged += 1
+        else:
+            to_embed.append((rel, text, digest))
+
+    # docs disparus (leurs ids sortent de l'index via le diff prev_indexed / indexed_ids)
+    current_rels = {str(fp.relative_to(base_dir)) for fp in doc_files}
+    nb_removed = len(set(old_docs) - current_rels)
+
+    # Chunking + ids pour les docs ajoutés/modifiés
+    next_id = int(manifest["next_id"])
+    new_records: dict[int, rag_store.ChunkRecord] = {}
+    for rel, text, digest in to_embed:
+        ids = []
+        for rec in chunk_document(rel, text):
+            new_records[next_id] = rec
+            ids.append(next_id)
+            next_id += 1
+        new_docs[rel] = {"sha256": digest, "chunk_ids": ids}
+
+    manifest["docs"] = new_docs
+    manifest["next_id"] = next_id
+    all_ids = rag_store.manifest_chunk_ids(manifest)
+    if not all_ids:
+        raise SystemExit("Aucun chunk à indexer (docs vides ?)")
+
+    def record_of(i: int) -> rag_store.ChunkRecord:
+        # chunks inchangés relus depuis l'ancien store (mmap), nouveaux depuis new_records
+        return new_records[i] if i in new_records else old_store.record(i)
+
+    # Dédup MinHash/LSH sur tout le corpus (les ids anciens restent canoniques)
+    if rag_dedup.DEDUP_ENABLED:
+        duplicate_of = rag_dedup.find_near_duplicates([(i, record_of(i).text) for i in all_ids])
+    else:
+        duplicate_of = {}
+    manifest["dedup"] = {
+        "config": rag_dedup.dedup_config(),
+        "duplicate_of": {str(k): v for k, v in sorted(duplicate_of.items())},
+    }
+    indexed_ids = [i for i in all_ids if i not in duplicate_of]
+    to_remove = sorted(prev_indexed - set(indexed_ids))  # docs modifiés/supprimés + nouveaux doublons
+    to_add = [i for i in indexed_ids if i not in prev_indexed]
+
+    # Reconstruction complète de l'index si: 1er build, HNSW avec suppressions
+    # (pas de remove_ids), ou corpus > 4x celui de l'entraînement (IVF / PCA / SQ8).
+    params = manifest.get("index", {}).get("params", {})
+    rebuild_index = (
+        index is None
+        or (to_remove and not rag_store.supports_remove(params))
+        or (rag_store.needs_training(params) and len(indexed_ids) > 4 * params.get("trained_on", 0))
+    )
+
+    # Embeddings (E5): chunks ajoutés à l'index seulement, sauf reconstruction (cache -> pas de forward).
+    # Shards ajoutés à l'index au fil de l'eau (pas de matrice de tout le corpus).
+    if rebuild_index:
+        passages = [f"passage: {record_of(i).text}" for i in indexed_ids]
+        ids_arr = np.asarray(indexed_ids, dtype=np.int64)
+        builder = rag_store.StreamingIndexBuilder(index_cfg, len(indexed_ids))
+        for pos, emb in encoder.encode_stream(passages, workers=workers, show_progress_bar=True):
+            builder.add(ids_arr[pos], emb)
+        index, params = builder.finish()
+        manifest["index"] = {"config": rag_store.build_config(index_cfg), "params": params}
+    else:
+        # efSearch/nprobe par défaut: modifiables sans reconstruire l'index
+        params["ef_search"] = index_cfg["ef_search"]
+        params["nprobe"] = max(1, min(index_cfg["nprobe"], params.get("nlist", 1)))
+        rag_store.apply_search_params(index, params)
+        if to_remove:
+            index.remove_ids(np.asarray(to_remove, dtype=np.int64))
+        if to_add:
+            ids_arr = np.asarray(to_add, dtype=np.int64)
+            passages = [f"passage: {record_of(i).text}" for i in to_add]
+            for pos, emb in encoder.encode_stream(passages, workers=workers, show_progress_bar=True):
+                index.add_with_ids(emb, ids_arr[pos])
+    encoder.flush()
+
+    records = ((i, record_of(i)) for i in all_ids)
+    # nouvelle version publiée d'un coup (CURRENT); les lecteurs basculent à leur prochain refresh
+    # (manifest identique à CURRENT -> version courante gardée, rien n'est publié)
+    prev_version = rag_store.current_version(out_dir)
+    version_path = rag_store.write_store(out_dir, index, manifest, records)
+    if old_store is not None:
+        old_store.close()
 
-        # 1) split par sections markdown
-        sections = split_markdown_sections(text)
-
-        # 2) sous-chunking
-        for sec_title, sec_text in sections:
-            sub_chunks = chunk_text(sec_text, chunk_size=800, overlap=120)
-            for j, ch in enumerate(sub_chunks):
-                # on enrichit un peu le chunk pour retrieval
-                enriched = f"SOURCE: {rel}\nSECTION: {sec_title}\n\n{ch}".strip()
-                chunks.append(enriched)
-                sources.append(f"{rel} | {sec_title} | chunk={j}")
-
-    # Embeddings (E5)
-    model_name = "intfloat/multilingual-e5-base"
-    model = SentenceTransformer(model_name)
-
-    passages = [f"passage: {c}" for c in chunks]
-    emb = model.encode(passages, show_progress_bar=True, normalize_embeddings=True)
-    emb = np.asarray(emb, dtype=np.float32)
-
-    dim = emb.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(emb)
-
-    faiss.write_index(index, str(out_dir / "faiss.index"))
-    (out_dir / "chunks.txt").write_text("\n---\n".join(chunks), encoding="utf-8")
-    (out_dir / "sources.txt").write_text("\n".join(sources), encoding="utf-8")
-
-    print("✅ Index FAISS créé:", out_dir / "faiss.index")
-    print("✅ Nb chunks:", len(chunks))
-    print("✅ Modèle embeddings:", model_name)
+    published = "inchangée" if manifest["build_id"] == prev_version else "publiée"
+    print("✅ Index FAISS:", version_path / rag_store.INDEX_NAME, f"(version {manifest['build_id']} {published})")
+    print(
+        f"✅ Docs: {len(new_docs)} | inchangés={nb_unchanged} | ré-encodés={len(to_embed)} "
+        f"| supprimés={nb_removed}"
+    )
+    print(f"✅ Nb chunks: {len(all_ids)} | nouveaux chunks: {len(new_records)}")
+    shrink = 100 * len(duplicate_of) / len(all_ids)
+    print(
+        f"✅ Dédup: {len(duplicate_of)} quasi-doublons fusionnés -> index {index.ntotal}/{len(all_ids)} "
+        f"vecteurs (-{shrink:.1f}%)"
+    )
+    print(f"✅ Index: {rag_store.index_spec(manifest['index']['params'])} | reconstruit={bool(rebuild_index)}")
+    print(f"✅ Modèle embeddings: {encoder.model_id} (profil {EMB_PROFILE['name']})")
+    print("📦", encoder.stats_line())
+    if encoder.nb_encoded:
+        rate = encoder.nb_encoded / max(encoder.encode_seconds, 1e-9)
+        print(f"⚡ Encodage: {encoder.nb_encoded} passages en {encoder.encode_seconds:.1f}s "
+              f"({rate:.1f} passages/s, workers={workers})")
+    print(f"⏱️ {time.time() - t0:.1f}s")
 
 
 if __name__ == "__main__":
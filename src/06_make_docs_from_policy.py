@@ -2,6 +2,8 @@
 import json
 from pathlib import Path
 
+from docs_io import write_if_changed
+
 def main():
     base_dir = Path(__file__).resolve().parent.parent
     policy_path = base_dir / "policy" / "policy_config.json"
@@ -41,7 +43,7 @@ def main():
         "- Escalader immédiatement vers prestataire/sécurité selon catégorie.",
         "",
     ]
-    (docs_dir / "procedures_p0.md").write_text("\n".join(p0_lines), encoding="utf-8")
+    write_if_changed(docs_dir / "procedures_p0.md", "\n".join(p0_lines))
 
     # --- Doc P1 ---
     p1 = policy.get("guardrails", {}).get("patterns", {}).get("P1", [])
@@ -73,7 +75,7 @@ def main():
         "- Prévenir prestataire (selon catégorie).",
         "",
     ]
-    (docs_dir / "procedures_p1.md").write_text("\n".join(p1_lines), encoding="utf-8")
+    write_if_changed(docs_dir / "procedures_p1.md", "\n".join(p1_lines))
 
     # --- Doc Keywords (P1/P2/P3) ---
     levels = policy.get("levels", {})
@@ -88,7 +90,7 @@ def main():
         kw_lines.append(f"## {lvl}")
         kw_lines.append(", ".join(kw) if kw else "(aucun)")
         kw_lines.append("")
-    (docs_dir / "keywords_levels.md").write_text("\n".join(kw_lines), encoding="utf-8")
+    write_if_changed(docs_dir / "keywords_levels.md", "\n".join(kw_lines))
 
     # --- Mini FAQ admin (template) ---
     faq = [
@@ -104,7 +106,7 @@ def main():
         "- Informations à demander: période, type de charges, justificatif souhaité.",
         "",
     ]
-    (docs_dir / "admin_faq.md").write_text("\n".join(faq), encoding="utf-8")
+    write_if_changed(docs_dir / "admin_faq.md", "\n".join(faq))
 
     print("✅ Docs générés dans:", docs_dir)
     for fp in sorted(docs_dir.glob("*.md")):
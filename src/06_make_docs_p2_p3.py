@@ -1,6 +1,8 @@
 # src/06_make_docs_p2_p3.py
 from pathlib import Path
 
+from docs_io import write_if_changed
+
 P2_MD = """# Procédures - Non urgent (P2)
 
 Ces cas ne sont pas urgents mais nécessitent une intervention planifiée (souvent < 24h).
@@ -43,12 +45,14 @@ def main():
     p2_path = docs_dir / "procedures_p2.md"
     p3_path = docs_dir / "procedures_p3.md"
 
-    p2_path.write_text(P2_MD, encoding="utf-8")
-    p3_path.write_text(P3_MD, encoding="utf-8")
+    changed = {
+        p2_path: write_if_changed(p2_path, P2_MD),
+        p3_path: write_if_changed(p3_path, P3_MD),
+    }
 
     print("✅ Docs créés :")
-    print(" -", p2_path)
-    print(" -", p3_path)
+    for p, was_written in changed.items():
+        print(" -", p, "" if was_written else "(inchangé)")
 
 if __name__ == "__main__":
     main()
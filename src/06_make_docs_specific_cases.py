@@ -1,5 +1,7 @@
 from pathlib import Path
 
+from docs_io import write_if_changed
+
 DOCS = {
 "reservation_salle_polyvalente.md": """# Réservation de la salle polyvalente
 
@@ -217,8 +219,10 @@ def main():
 
     for name, content in DOCS.items():
         p = docs_dir / name
-        p.write_text(content.strip() + "\n", encoding="utf-8")
-        print("✅ écrit:", p)
+        if write_if_changed(p, content.strip() + "\n"):
+            print("✅ écrit:", p)
+        else:
+            print("➖ inchangé:", p)
 
 if __name__ == "__main__":
     main()
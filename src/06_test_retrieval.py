@@ -1,61 +1,305 @@
 # src/06_test_retrieval.py
+"""
+Test du retrieval avec le chemin exact de 07 (rewrite_query_from_row, recherche,
+docs forcés, construction du contexte).
+
+- sans option : une requête de démonstration, résultats affichés
+- --bench     : jeu de requêtes labellisées (cleanData/bench/retrieval_labels.jsonl,
+                amorcé depuis messages_with_context.csv: toutes les catégories,
+                fr / darija / mixed), chaque requête passée par rag_retrieval.retrieve_batch
+                comme en production (routage, rerank, cache de résultats) ->
+                recall@k et MRR (classement avant forçage) par catégorie et par langue,
+                docs forcés présents dans le contexte final, latences encode / search /
+                rerank / lexical / total (p50/p95/p99), pic mémoire; JSON dans cleanData/bench/
+                pour comparer types d'index, backends d'encodeur et réglages de chunking.
+  --rerank off|conditional|always : cross-encoder jamais / si top-k ambigu (07, RAG_RERANK=1) / toujours
+  --routing dense|hybrid          : RAG_ROUTING par défaut (labels amorcés avec rule_match / category_match)
+  --qcache                        : cache de résultats (RAG_QCACHE); 2e passe mesurée sur le cache chaud
+
+    python src/06_test_retrieval.py
+    python src/06_test_retrieval.py --bench --tag hnsw_onnx
+    python src/06_test_retrieval.py --bench --reseed --per-cell 10
+    python src/06_test_retrieval.py --bench --rerank conditional --tag flat_rerank
+    python src/06_test_retrieval.py --bench --routing hybrid --qcache --tag hybrid_cache
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from collections import Counter
 from pathlib import Path
+
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
+import pandas as pd
 
+import rag_store
+from embeddings import CachedEncoder, embedding_profile, load_encoder
+from rag_context import CONTEXT_MODE, CTX_TOKEN_BUDGET
+from rag_rerank import RERANK_ENABLED, Reranker, rerank_config
+from rag_retrieval import (
+    FORCED_DOC_BY_CATEGORY,
+    FORCED_DOC_BY_LEVEL,
+    QueryResultCache,
+    RagMetadata,
+    forced_docs,
+    lexical_index,
+    pick_row,
+    retrieve_batch,
+    rewrite_query_from_row,
+    row_fields,
+    safe_top_k,
+    serialize_row,
+)
+from rag_service import FORCED_CHUNK_MODE, QCACHE_ENABLED, QCACHE_MAX_ENTRIES, RESIDENCE_FILTER, ROUTING
 
-def safe_top_k(requested_k: int, nb_chunks: int) -> int:
-    """Empêche k > nb_chunks (sinon FAISS renvoie des résultats invalides)."""
-    if nb_chunks <= 0:
-        return 0
-    return max(1, min(int(requested_k), int(nb_chunks)))
+REQUESTED_TOP_K = 5
+STAGES = ("encode", "search", "rerank", "lexical")
+# colonnes de 03 utilisées par le routage hybride (route_row)
+ROUTING_FIELDS = ("category_match", "rule_match", "secondary_category")
 
+LABELS_PATH = Path("cleanData") / "bench" / "retrieval_labels.jsonl"
+# docs pertinents en plus des docs forcés (amorçage des labels, à compléter à la main)
+EXTRA_DOCS_BY_CATEGORY = {
+    "admin": ["data/docs/admin_faq.md"],
+}
+LANGUAGES = ("fr", "darija", "mixed")
 
-def rewrite_query(raw_query: str, urgency_level: str | None = None, category: str | None = None) -> str:
+
+# =========================
+# Jeu labellisé
+# =========================
+def seed_labels(base_dir: Path, per_cell: int) -> list[dict]:
     """
-    Query rewrite simple:
-    - préfixe selon niveau/catégorie
-    - format E5 recommandé: 'query: ...'
+    Amorce depuis messages_with_context.csv: jusqu'à per_cell messages par
+    (catégorie, langue), docs pertinents = procédure du niveau + doc(s) de la catégorie.
     """
-    q = (raw_query or "").strip()
-    if not q:
-        return q
+    df = pd.read_csv(base_dir / "cleanData" / "messages_with_context.csv")
+    df["language"] = df.get("language", pd.Series("fr", index=df.index)).fillna("fr")
+    df = df[df["text_clean"].fillna("").str.strip() != ""]
 
-    prefix = []
-    if urgency_level == "P0":
-        prefix.append("urgence critique P0")
-    elif urgency_level == "P1":
-        prefix.append("urgence P1")
-    elif urgency_level == "P2":
-        prefix.append("non urgent P2")
-    elif urgency_level == "P3":
-        prefix.append("administratif P3")
+    labels = []
+    for (category, language), cell in df.groupby([df["category"].fillna("other"), "language"], sort=True):
+        for _, row in cell.drop_duplicates("text_clean").head(per_cell).iterrows():
+            text, urgency, category = row_fields(row)
+            relevant = [FORCED_DOC_BY_LEVEL.get(urgency), FORCED_DOC_BY_CATEGORY.get(category),
+                        *EXTRA_DOCS_BY_CATEGORY.get(category, [])]
+            labels.append({
+                "message_id": str(row.get("message_id", "")),
+                "text_clean": text,
+                "language": str(language),
+                "urgency_level": urgency,
+                "category": category,
+                "residence_id": str(row.get("residence_id", "") or ""),
+                **{f: "" if pd.isna(row.get(f)) else str(row.get(f)) for f in ROUTING_FIELDS},
+                "relevant_docs": [d for d in relevant if d],
+            })
+    return labels
 
-    if category:
-        prefix.append(f"categorie {category}")
 
-    return "query: " + " ".join(prefix + [q])
+def load_labels(base_dir: Path, reseed: bool, per_cell: int) -> list[dict]:
+    path = base_dir / LABELS_PATH
+    if reseed or not path.exists():
+        labels = seed_labels(base_dir, per_cell)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in labels), encoding="utf-8")
+        print(f"ℹ️ Jeu labellisé amorcé: {path} ({len(labels)} requêtes)")
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
 
 
-def main():
-    base_dir = Path(__file__).resolve().parent.parent
+# =========================
+# Métriques
+# =========================
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    return {f"p{p}": round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)  # Linux: Ko
+    except (ImportError, AttributeError):
+        return 0.0
+
+
+def ranked_docs(ids, store, meta: RagMetadata) -> list[set[str]]:
+    """Docs représentés à chaque rang (un chunk canonique représente aussi ses quasi-doublons)."""
+    return [{store.doc(d) for d in [int(i), *meta.merged.get(int(i), [])]} for i in ids if i >= 0 and i in store]
+
+
+def aggregate(rows: list[dict], key: str, k: int) -> dict:
+    out = {}
+    for value in sorted({r[key] for r in rows}):
+        group = [r for r in rows if r[key] == value]
+        out[value] = {
+            "n": len(group),
+            f"recall@{k}": round(float(np.mean([r["recall"] for r in group])), 4),
+            "mrr": round(float(np.mean([r["rr"] for r in group])), 4),
+            "context_hit": round(float(np.mean([r["context_hit"] for r in group])), 4),
+        }
+    return out
+
+
+def run_bench(args, base_dir: Path) -> None:
     rag_dir = base_dir / "cleanData" / "rag"
+    labels = load_labels(base_dir, args.reseed, args.per_cell)
+    if args.routing == "hybrid" and not all("rule_match" in lab for lab in labels):
+        print("⚠️ Labels sans rule_match / category_match: tout part en dense. Relance avec --reseed")
+    rss_start = peak_rss_mb()
 
-    index = faiss.read_index(str(rag_dir / "faiss.index"))
-    chunks = (rag_dir / "chunks.txt").read_text(encoding="utf-8").split("\n---\n")
-    sources = (rag_dir / "sources.txt").read_text(encoding="utf-8").splitlines()
+    cached = load_encoder(embedding_profile()["model"], base_dir)
+    encoder = cached if args.cache else CachedEncoder(
+        cached.model_name, cache=None, backend=cached.backend, base_dir=base_dir
+    )
+    encoder.warm_up()  # chargement du modèle hors chrono
+    knobs = rag_store.search_knobs_from_env()
+    index, store = rag_store.load_store(rag_dir, model_id=cached.model_id, **knobs)
+    manifest = rag_store.load_manifest(rag_dir)
+    meta = RagMetadata(manifest)
+    k = safe_top_k(args.k, index.ntotal)
+    reranker = Reranker(always=args.rerank == "always") if args.rerank != "off" else None
+    if reranker is not None:
+        reranker.rerank(["warm-up"], [[int(store.ids()[0])]], store, 1)  # chargement hors chrono
+        reranker.reset_stats()
+    lexical = lexical_index(manifest, store) if args.routing == "hybrid" else None
+    qcache = QueryResultCache(QCACHE_MAX_ENTRIES) if args.qcache else None
+    route_counts: Counter = Counter()
+    opts = {
+        "forced_chunk": FORCED_CHUNK_MODE, "residence_filter": RESIDENCE_FILTER, "cache": qcache,
+        "lexical": lexical, "route_counts": route_counts, "reranker": reranker,
+    }
 
-    assert len(chunks) == len(sources), "chunks.txt et sources.txt n'ont pas la même taille"
+    # --- chemin de 07 (retrieve_batch), une requête par appel comme le serveur, chronométré par étape
+    rows, lat_total, lat_cached = [], [], []
+    lat_stage: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    ranked_by_query: dict[tuple, list[int]] = {}
+    for lab in labels:
+        trace: dict = {}
+        t0 = time.perf_counter()
+        _, _, context, _ = retrieve_batch([lab], encoder, index, store, meta, k, trace=trace, **opts)[0]
+        lat_total.append((time.perf_counter() - t0) * 1000.0)
+        for stage in STAGES:
+            lat_stage[stage].append(trace["seconds"][stage] * 1000.0)
 
-    model = SentenceTransformer("intfloat/multilingual-e5-base")
+        text, urgency, category = row_fields(lab)
+        query_key = (text, urgency, category, lab.get("residence_id", ""))
+        if 0 in trace["ranked"]:
+            ranked_by_query[query_key] = trace["ranked"][0]
+        relevant = set(lab["relevant_docs"])
+        ranks = ranked_docs(ranked_by_query.get(query_key, []), store, meta)
+        found = set().union(*ranks) if ranks else set()
+        first = next((r for r, docs in enumerate(ranks, 1) if docs & relevant), None)
+        keep = [d for d, _ in forced_docs(urgency, category) if d]
+        rows.append({
+            "category": lab["category"],
+            "language": lab.get("language", "fr"),
+            "recall": len(found & relevant) / max(1, len(relevant)),
+            "rr": 1.0 / first if first else 0.0,
+            # docs forcés présents dans le contexte final (en-tête [doc > section] ou SOURCE:)
+            "context_hit": float(all(Path(d).name in context for d in keep)),
+        })
+
+    if qcache is not None:
+        # 2e passe: messages déjà vus -> ni encodage ni recherche
+        for lab in labels:
+            t0 = time.perf_counter()
+            retrieve_batch([lab], encoder, index, store, meta, k, **{**opts, "route_counts": None})
+            lat_cached.append((time.perf_counter() - t0) * 1000.0)
+
+    n = max(1, len(rows))
+    overall = {
+        "n": len(rows),
+        f"recall@{k}": round(sum(r["recall"] for r in rows) / n, 4),
+        "mrr": round(sum(r["rr"] for r in rows) / n, 4),
+        "context_hit": round(sum(r["context_hit"] for r in rows) / n, 4),
+    }
+    result = {
+        "tag": args.tag,
+        "k": k,
+        "config": {
+            "model": cached.model_id,
+            "backend": cached.backend,
+            "profile": embedding_profile()["name"],
+            "index": rag_store.index_spec(manifest["index"]["params"]),
+            "ef_search": knobs["ef_search"],
+            "nprobe": knobs["nprobe"],
+            "chunk_size": manifest.get("chunk_size"),
+            "overlap": manifest.get("overlap"),
+            "dedup": bool(manifest.get("dedup")),
+            "forced_chunk": FORCED_CHUNK_MODE,
+            "residence_filter": RESIDENCE_FILTER,
+            "context_mode": CONTEXT_MODE,
+            "context_tokens": CTX_TOKEN_BUDGET,
+            "embedding_cache": args.cache,
+            "rerank": args.rerank,
+            **({"rerank_" + key: v for key, v in rerank_config().items()} if reranker is not None else {}),
+            "routing": args.routing,
+            "query_cache": args.qcache,
+            "ntotal": int(index.ntotal),
+        },
+        "overall": overall,
+        "by_category": aggregate(rows, "category", k),
+        "by_language": aggregate(rows, "language", k),
+        "latency_ms": {**{stage: percentiles(lat_stage[stage]) for stage in STAGES},
+                       "total": percentiles(lat_total), "total_cached": percentiles(lat_cached)},
+        "routes": dict(route_counts),
+        "rerank_fired": round(reranker.nb_fired / max(1, reranker.nb_seen), 4) if reranker is not None else 0.0,
+        "memory_mb": {"peak_rss": peak_rss_mb(), "peak_rss_before_load": rss_start,
+                      "index": round(rag_store.index_memory_bytes(index) / 1e6, 3)},
+    }
+
+    print(f"\n{result['config']['index']} | {cached.model_id} | k={k} | {len(rows)} requêtes labellisées")
+    print(f"{'catégorie':<16}{'n':>4}{f'recall@{k}':>11}{'MRR':>8}{'ctx':>7}")
+    for cat, m in [*result["by_category"].items(), ("TOTAL", overall)]:
+        print(f"{cat:<16}{m['n']:>4}{m[f'recall@{k}']:>11.3f}{m['mrr']:>8.3f}{m['context_hit']:>7.2f}")
+    print("langues: " + " | ".join(
+        f"{lang}: n={m['n']} recall={m[f'recall@{k}']:.3f} MRR={m['mrr']:.3f}" for lang, m in result["by_language"].items()
+    ))
+    missing = [lang for lang in LANGUAGES if lang not in result["by_language"]]
+    if missing:
+        print(f"⚠️ Langues absentes du jeu: {', '.join(missing)}")
+    lat = result["latency_ms"]
+    print(
+        f"⚡ encode p50={lat['encode']['p50']:.2f}ms p95={lat['encode']['p95']:.2f}ms | "
+        f"search p50={lat['search']['p50']:.3f}ms p95={lat['search']['p95']:.3f}ms | "
+        f"rerank p50={lat['rerank']['p50']:.2f}ms p95={lat['rerank']['p95']:.2f}ms | "
+        f"lexical p50={lat['lexical']['p50']:.3f}ms | "
+        f"total p50={lat['total']['p50']:.2f}ms p99={lat['total']['p99']:.2f}ms | "
+        f"pic RSS={result['memory_mb']['peak_rss']:.0f}MB"
+    )
+    print(f"routage {args.routing}: " + " ".join(f"{r}={n}" for r, n in sorted(route_counts.items())))
+    if reranker is not None:
+        print("📦", reranker.stats_line())
+    if qcache is not None:
+        print(f"⚡ cache chaud: total p50={lat['total_cached']['p50']:.3f}ms p99={lat['total_cached']['p99']:.3f}ms")
+        print("📦", qcache.stats_line())
+
+    out_path = base_dir / "cleanData" / "bench" / f"retrieval_labelled_{args.tag}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✅ Résultats: {out_path}")
+    encoder.flush()
+    store.close()
+
+
+def run_demo(base_dir: Path) -> None:
+    rag_dir = base_dir / "cleanData" / "rag"
+
+    encoder = load_encoder(embedding_profile()["model"], base_dir)
+    index, store = rag_store.load_store(rag_dir, model_id=encoder.model_id, **rag_store.search_knobs_from_env())
+    meta = RagMetadata(rag_store.load_manifest(rag_dir))
 
     raw_query = "ascenseur bloqué personne à l'intérieur procédure"
-    query = rewrite_query(raw_query, urgency_level="P0", category="elevator")
+    urgency, category = "P0", "elevator"
+    query = rewrite_query_from_row(raw_query, urgency_level=urgency, category=category)
 
-    q_emb = model.encode([query], normalize_embeddings=True).astype(np.float32)
+    q_emb = encoder.encode([query])
+    encoder.flush()
 
-    k = safe_top_k(5, index.ntotal)
+    k = safe_top_k(REQUESTED_TOP_K, index.ntotal)
     scores, idxs = index.search(q_emb, k)
 
     print("\nRAW QUERY:", raw_query)
@@ -64,12 +308,42 @@ def main():
     print("\nTop résultats:\n")
 
     for rank, (score, i) in enumerate(zip(scores[0], idxs[0]), 1):
-        if i < 0 or i >= len(chunks):
+        if i < 0 or i not in store:
             continue
-        print(f"[{rank}] score={float(score):.4f} source={sources[i]}")
-        print(chunks[i][:350].replace("\n", " "))
+        print(f"[{rank}] score={float(score):.4f} source={store.source(i)}")
+        print(store.text(i)[:350].replace("\n", " "))
         print("-" * 80)
 
+    ids, sc = pick_row(q_emb, scores[0], idxs[0], urgency, category, index, store, meta, FORCED_CHUNK_MODE)
+    _, _, context, _ = serialize_row(ids, sc, store, meta, keep_docs=[d for d, _ in forced_docs(urgency, category) if d])
+    print("\nCONTEXTE (comme 07):\n")
+    print(context)
+
+    print("\n📦", encoder.stats_line())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bench", action="store_true", help="Benchmark sur le jeu labellisé")
+    ap.add_argument("--tag", default="current", help="Suffixe du JSON (ex: hnsw_onnx, chunk600)")
+    ap.add_argument("--k", type=int, default=REQUESTED_TOP_K)
+    ap.add_argument("--reseed", action="store_true", help="Réamorce le jeu depuis messages_with_context.csv")
+    ap.add_argument("--per-cell", type=int, default=8, help="Requêtes max par (catégorie, langue) à l'amorçage")
+    ap.add_argument("--cache", action="store_true", help="Utilise le cache d'embeddings (sinon forward à chaque fois)")
+    ap.add_argument("--rerank", choices=("off", "conditional", "always"),
+                    default="conditional" if RERANK_ENABLED else "off")
+    ap.add_argument("--routing", choices=("dense", "hybrid"), default=ROUTING if ROUTING == "hybrid" else "dense")
+    ap.add_argument("--qcache", action="store_true", default=QCACHE_ENABLED,
+                    help="Cache de résultats (défaut: RAG_QCACHE), 2e passe sur le cache chaud")
+    ap.add_argument("--no-qcache", dest="qcache", action="store_false")
+    args = ap.parse_args()
+
+    base_dir = Path(__file__).resolve().parent.parent
+    if args.bench:
+        run_bench(args, base_dir)
+    else:
+        run_demo(base_dir)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+# src/07_bench_retrieval.py
+"""
+Benchmark de 07: retrieval message par message (1 encode + 1 search par ligne, historique)
+vs batché (encodage groupé + 1 index.search(Q, k) par batch) vs hybride (routage règles /
+dense + BM25, RAG_ROUTING=hybrid), sur messages_rules.csv.
+
+- rows/s de chaque mode (cache d'embeddings désactivé par défaut: on mesure le modèle)
+- contrôle des sorties: sources identiques, écart max des scores (arrondis flottants
+  possibles entre forward unitaire et batché)
+- hybride: part des messages par chemin, gain de débit vs batché, doc de procédure
+  attendu présent, sources identiques au batché dense
+
+    python src/07_bench_retrieval.py
+    python src/07_bench_retrieval.py --rows 1000 --batch-rows 512 --query-batch 128
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+import rag_store
+from embeddings import CachedEncoder, embedding_profile, load_encoder
+from rag_retrieval import (
+    FORCED_DOC_BY_LEVEL,
+    RagMetadata,
+    lexical_index,
+    retrieve_batch,
+    retrieve_row,
+    row_fields,
+    safe_top_k,
+)
+
+MODEL_NAME = embedding_profile()["model"]
+REQUESTED_TOP_K = 5
+FORCED_CHUNK_MODE = os.getenv("RAG_FORCED_CHUNK", "first").strip().lower()
+RESIDENCE_FILTER = os.getenv("RAG_RESIDENCE_FILTER", "0").strip() == "1"
+
+
+def run(mode: str, rows: list, encoder, index, store, meta, top_k: int, batch_rows: int,
+        lexical=None, route_counts: Counter | None = None) -> tuple[list, float]:
+    opts = {"forced_chunk": FORCED_CHUNK_MODE, "residence_filter": RESIDENCE_FILTER}
+    t0 = time.perf_counter()
+    if mode == "per_row":
+        out = [retrieve_row(row, encoder, index, store, meta, top_k, **opts) for row in rows]
+    else:
+        if mode == "hybrid":
+            opts.update(lexical=lexical, route_counts=route_counts)
+        out = []
+        for b in range(0, len(rows), batch_rows):
+            out.extend(retrieve_batch(rows[b:b + batch_rows], encoder, index, store, meta, top_k, **opts))
+    return out, time.perf_counter() - t0
+
+
+def proc_hit(rows: list, out: list) -> float:
+    """Part des messages dont le doc de procédure du niveau est dans les sources (check de 08)."""
+    hits = 0
+    for row, (sources, *_) in zip(rows, out):
+        _, urgency, _ = row_fields(row)
+        expected = FORCED_DOC_BY_LEVEL.get(urgency, FORCED_DOC_BY_LEVEL["P3"])
+        hits += any(s.startswith(expected) for s in json.loads(sources))
+    return round(hits / max(1, len(rows)), 4)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=0, help="0 = tout messages_rules.csv")
+    ap.add_argument("--batch-rows", type=int, default=256)
+    ap.add_argument("--query-batch", type=int, default=64)
+    ap.add_argument("--cache", action="store_true", help="Utilise le cache d'embeddings (sinon forward à chaque fois)")
+    ap.add_argument("--out", default="cleanData/bench/retrieval_batch_bench.json")
+    args = ap.parse_args()
+
+    base_dir = Path(__file__).resolve().parent.parent
+    df = pd.read_csv(base_dir / "cleanData" / "messages_rules.csv")
+    if args.rows:
+        df = df.head(args.rows)
+    rows = [row for _, row in df.iterrows()]
+
+    cached = load_encoder(MODEL_NAME, base_dir, batch_size=args.query_batch)
+    index, store = rag_store.load_store(
+        base_dir / "cleanData" / "rag", model_id=cached.model_id, **rag_store.search_knobs_from_env()
+    )
+    meta = RagMetadata(rag_store.load_manifest(base_dir / "cleanData" / "rag"))
+    top_k = safe_top_k(REQUESTED_TOP_K, index.ntotal)
+
+    def encoder():
+        if args.cache:
+            return cached
+        enc = CachedEncoder(MODEL_NAME, cache=None, batch_size=args.query_batch, backend=cached.backend,
+                            base_dir=base_dir)
+        enc.encode(["query: warm-up"])  # chargement du modèle hors chrono
+        return enc
+
+    # BM25 construit hors chrono (une fois par version d'index côté service)
+    t0 = time.perf_counter()
+    lexical = lexical_index(rag_store.load_manifest(base_dir / "cleanData" / "rag"), store)
+    bm25_build_s = time.perf_counter() - t0
+    route_counts: Counter = Counter()
+
+    results, outputs = {}, {}
+    for mode in ("per_row", "batched", "hybrid"):
+        out, seconds = run(mode, rows, encoder(), index, store, meta, top_k, args.batch_rows,
+                           lexical=lexical, route_counts=route_counts)
+        outputs[mode] = out
+        results[mode] = {"seconds": round(seconds, 3), "rows_per_s": round(len(rows) / max(seconds, 1e-9), 1),
+                         "proc_hit": proc_hit(rows, out)}
+        print(f"{mode:<8} {len(rows)} lignes en {seconds:.2f}s -> {results[mode]['rows_per_s']:.1f} lignes/s")
+
+    same_sources = sum(a[0] == b[0] for a, b in zip(outputs["per_row"], outputs["batched"]))
+    max_score_diff = max(
+        (abs(x - y) for a, b in zip(outputs["per_row"], outputs["batched"])
+         for x, y in zip(json.loads(a[1]), json.loads(b[1]))),
+        default=0.0,
+    )
+    speedup = results["batched"]["rows_per_s"] / max(results["per_row"]["rows_per_s"], 1e-9)
+    print(
+        f"\n⚡ x{speedup:.1f} | sources identiques: {same_sources}/{len(rows)} "
+        f"| écart max des scores: {max_score_diff:.2e}"
+    )
+
+    nb_routed = max(1, sum(route_counts.values()))
+    route_fraction = {route: round(n / nb_routed, 4) for route, n in sorted(route_counts.items())}
+    hybrid_speedup = results["hybrid"]["rows_per_s"] / max(results["batched"]["rows_per_s"], 1e-9)
+    hybrid_same = sum(a[0] == b[0] for a, b in zip(outputs["batched"], outputs["hybrid"]))
+    print(
+        f"⚡ hybride x{hybrid_speedup:.1f} vs batché | chemins: "
+        + " ".join(f"{r}={100 * f:.1f}%" for r, f in route_fraction.items())
+        + f" | doc procédure: {results['hybrid']['proc_hit']:.3f} (dense {results['batched']['proc_hit']:.3f})"
+        f" | sources identiques au dense: {hybrid_same}/{len(rows)} | BM25 construit en {bm25_build_s:.2f}s"
+    )
+
+    out_path = base_dir / args.out
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(
+        json.dumps({"nb_rows": len(rows), "batch_rows": args.batch_rows, "query_batch": args.query_batch,
+                    "cache": args.cache, "results": results, "speedup": round(speedup, 2),
+                    "same_sources": same_sources, "max_score_diff": max_score_diff,
+                    "hybrid": {"speedup_vs_batched": round(hybrid_speedup, 2), "route_fraction": route_fraction,
+                               "same_sources_as_dense": hybrid_same, "bm25_build_s": round(bm25_build_s, 3)}},
+                   ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    print(f"✅ Résultats: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
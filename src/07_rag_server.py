@@ -0,0 +1,109 @@
+# src/07_rag_server.py
+"""
+Serveur de retrieval chaud: modèle d'embedding, index FAISS (mmap) et chunk store
+chargés une fois, puis réutilisés par 07 (client) et le pipeline incrémental.
+
+- POST /retrieve  {"rows": [{text_clean, urgency_level, priority_rules, category, residence_id}]}
+                  -> {"results": [[rag_sources, rag_scores, rag_context, rag_score_kind], ...], "info": {...}}
+- GET  /health    -> version de l'index, ntotal, top_k, stats du regroupement
+
+Les requêtes concurrentes sont regroupées (RAG_COALESCE_MS) en un seul batch:
+1 encodage + 1 index.search, dans un thread unique. Un nouveau build publié par 06
+est pris en compte avant le batch suivant (CURRENT), sans redémarrage.
+Le modèle est chargé au démarrage (forward hors cache) et le cache d'embeddings
+est écrit sur disque tous les RAG_FLUSH_BATCHES batches / RAG_FLUSH_SEC secondes.
+
+    python src/07_rag_server.py
+    python src/07_rag_server.py --host 0.0.0.0 --port 8765 --coalesce-ms 10
+    RAG_SERVER_URL=http://127.0.0.1:8765 python src/07_rag_retrieve_for_messages.py
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import signal
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import rag_service
+
+
+def make_handler(service: rag_service.RetrievalService, coalescer: rag_service.Coalescer):
+    def info() -> dict:
+        return {**service.info(), "stats": coalescer.stats()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload: dict) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, {"error": "not found"})
+            self._send(200, info())
+
+        def do_POST(self):
+            if self.path != "/retrieve":
+                return self._send(404, {"error": "not found"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                rows = payload["rows"]
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": f"requête invalide: {e}"})
+            try:
+                results = coalescer.submit(rows) if rows else []
+            except Exception as e:
+                return self._send(500, {"error": str(e)})
+            self._send(200, {"results": results, "info": info()})
+
+        def log_message(self, fmt, *args):  # pas de log par requête
+            pass
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--coalesce-ms", type=float, default=rag_service.COALESCE_MS,
+                    help="Fenêtre de regroupement des requêtes concurrentes")
+    args = ap.parse_args()
+
+    base_dir = Path(__file__).resolve().parent.parent
+    t0 = time.perf_counter()
+    service = rag_service.RetrievalService(base_dir)
+    # chargement du modèle hors requêtes (forward direct: le cache d'embeddings ne le chargerait pas)
+    warm_sec = service.encoder.warm_up()
+    # cache d'embeddings écrit sur disque périodiquement (batches / timer), pas seulement à l'arrêt
+    coalescer = rag_service.Coalescer(
+        service.retrieve, max_wait_ms=args.coalesce_ms, idle_fn=service.maybe_flush,
+    )
+    info = service.info()
+    print(
+        f"✅ Retrieval prêt en {time.perf_counter() - t0:.1f}s (modèle {warm_sec:.1f}s) | version={info['version']} "
+        f"| ntotal={info['ntotal']} | top_k={info['top_k']}"
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service, coalescer))
+    print(f"ℹ️ Écoute sur http://{args.host}:{args.port} (POST /retrieve, GET /health)")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # arrêt propre: cache de résultats sauvegardé
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for line in service.stats_lines():
+            print("📦", line)
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
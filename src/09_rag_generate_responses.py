@@ -4,12 +4,18 @@ import os
 import sys
 import json
 import time
+import asyncio
+from collections import Counter, defaultdict
 from pathlib import Path
 from typing import Any, Dict, Optional, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import aiohttp
 import pandas as pd
-import requests
+
+from rag_context import token_counter, truncate_context
+from llm_cache import LLM_CACHE_DIR, LLM_CACHE_ENABLED, LLMResponseCache, response_key, stable_hash
+from llm_engine import LLM_CONCURRENCY, LLM_MAX_CONCURRENCY, LLMEngine, backoff_delay, parse_hosts, queue_wait
+from template_lane import TemplateLane
 
 # =========================
 # CONFIG
@@ -19,6 +25,9 @@ ASSIGNED_TO_TABLE = {"P0": "PRESTATAIRE", "P1": "PRESTATAIRE", "P2": "SYNDIC", "
 DEFAULT_STATUS = "TO_VALIDATE"
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434").rstrip("/")
+# plusieurs hôtes (répartition de charge + bascule): "http://gpu1:11434=3,http://cpu1:11434=1"
+# (=poids, 1 par défaut); vide -> OLLAMA_HOST seul
+OLLAMA_HOSTS = parse_hosts(os.getenv("OLLAMA_HOSTS", "") or OLLAMA_HOST)
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct-q4_K_M").strip()
 
 MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "1500"))
@@ -29,14 +38,27 @@ TEMPERATURE = float(os.getenv("TEMPERATURE", "0.1"))
 TOP_P = float(os.getenv("TOP_P", "0.2"))
 NUM_PREDICT = int(os.getenv("NUM_PREDICT", "220"))
 
+# 1 = /api/chat en streaming, requête fermée dès que l'objet JSON est complet
+LLM_STREAM = os.getenv("LLM_STREAM", "1").strip() == "1"
+
+# "prefix" = consignes fixes d'abord, champs du message ensuite (préfixe réutilisé par le
+# cache KV d'Ollama); "legacy" = ancien ordre (champs du message avant les consignes)
+PROMPT_LAYOUT = os.getenv("LLM_PROMPT_LAYOUT", "prefix").strip().lower()
+# modèle gardé en mémoire entre deux runs espacés du DAG
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+# warm-up en début de run; --no-warmup (00 / DAG) quand l'étape --warmup l'a déjà fait
+LLM_WARMUP = os.getenv("LLM_WARMUP", "1").strip() == "1"
+
+# sortie contrainte par Ollama: "schema" = JSON schema complet (RESPONSE_SCHEMA),
+# "json" = JSON quelconque (grammaire), "none" = texte libre (ancien comportement).
+# Si le serveur refuse le mode demandé (HTTP 400), on descend d'un cran pour le reste du run.
+LLM_FORMAT = os.getenv("LLM_FORMAT", "schema").strip().lower()
+FORMAT_MODES = ["schema", "json", "none"]
+
+# pause entre retries: backoff à jitter (llm_engine, base SLEEP_BETWEEN_RETRIES)
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "1"))
-SLEEP_BETWEEN_RETRIES = float(os.getenv("SLEEP_BETWEEN_RETRIES", "0.6"))
-TIMEOUT_SEC = int(os.getenv("TIMEOUT_SEC", "90"))
 
 LOG_EVERY = int(os.getenv("LOG_EVERY", "1"))
-WORKERS = int(os.getenv("WORKERS", "2"))
-
-SESSION = requests.Session()
 
 # =========================
 # PROMPTS (FR ONLY)
@@ -72,6 +94,24 @@ def build_system_prompt() -> str:
     )
 
 
+# consignes identiques pour tous les messages: début du prompt utilisateur (layout "prefix")
+USER_PROMPT_STATIC = """
+TÂCHE:
+1) Rédige une réponse AU RÉSIDENT en français, courte et actionnable, dans response_draft.
+2) Si CONTEXTE RAG est VIDE ou insuffisant -> required_info liste les infos à demander (max 3).
+3) Si P0/P1 -> ajouter consignes sécurité + escalade.
+4) Si secondary_category est renseigné, mentionne le sujet secondaire en 1 phrase ("Nous traiterons aussi ... après sécurisation").
+5) Retourne UNIQUEMENT un JSON strict.
+
+JSON attendu (forme exacte):
+{
+  "response_draft": "string",
+  "required_info": [],
+  "secondary_category": "string (recopie secondary_category de l'entrée)"
+}
+""".strip()
+
+
 def build_user_prompt(
     message_text: str,
     urgency_level: str,
@@ -80,10 +120,37 @@ def build_user_prompt(
     secondary_category: str = "",
 ) -> str:
     msg = (message_text or "")[:MAX_TEXT_CHARS].strip()
-    ctx = (rag_context or "")[:MAX_CONTEXT_CHARS].strip()
+    # contexte déjà packé sous budget de tokens par 07; garde-fou: blocs entiers seulement
+    ctx = truncate_context(rag_context, MAX_CONTEXT_CHARS)
     ctx_flag = "VIDE" if not ctx else "DISPONIBLE"
     sec = (secondary_category or "").strip()
 
+    if PROMPT_LAYOUT == "legacy":
+        return build_user_prompt_legacy(msg, urgency_level, category, ctx, ctx_flag, sec)
+
+    # du plus partagé au plus spécifique: consignes, champs classés (peu de valeurs),
+    # contexte (souvent commun à une catégorie / un niveau), message en dernier
+    return f"""
+{USER_PROMPT_STATIC}
+
+ENTRÉE CLASSIFIÉE (NE PAS MODIFIER):
+- urgency_level: {urgency_level}
+- category: {category}
+- secondary_category: {sec}
+
+CONTEXTE RAG [{ctx_flag}] (preuves):
+<<<RAG_CONTEXT
+{ctx}
+RAG_CONTEXT>>>
+
+MESSAGE UTILISATEUR:
+<<<USER_MESSAGE
+{msg}
+USER_MESSAGE>>>
+""".strip()
+
+
+def build_user_prompt_legacy(msg: str, urgency_level: str, category: str, ctx: str, ctx_flag: str, sec: str) -> str:
     return f"""
 ENTRÉE CLASSIFIÉE (NE PAS MODIFIER):
 - urgency_level: {urgency_level}
@@ -298,42 +365,164 @@ def parse_json_robust(text: str) -> Optional[Dict[str, Any]]:
 def validate_min_schema(obj: Dict[str, Any]) -> bool:
     return isinstance(obj, dict) and ("response_draft" in obj) and ("required_info" in obj)
 
+# schéma complet de la réponse attendue (cf. "JSON attendu" du prompt utilisateur)
+RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "response_draft": {"type": "string", "minLength": 1},
+        "required_info": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+        "secondary_category": {"type": "string"},
+    },
+    "required": ["response_draft", "required_info", "secondary_category"],
+}
+
+try:
+    import jsonschema
+
+    _SCHEMA_VALIDATOR = jsonschema.Draft7Validator(RESPONSE_SCHEMA)
+except ImportError:
+    _SCHEMA_VALIDATOR = None
+
+def validate_full_schema(obj: Dict[str, Any]) -> bool:
+    """Conformité stricte à RESPONSE_SCHEMA (mesure de qualité; les retries restent sur validate_min_schema)."""
+    if _SCHEMA_VALIDATOR is not None:
+        return _SCHEMA_VALIDATOR.is_valid(obj)
+    # repli sans jsonschema: mêmes contraintes, écrites à la main
+    if not isinstance(obj, dict) or any(k not in obj for k in RESPONSE_SCHEMA["required"]):
+        return False
+    req = obj["required_info"]
+    return (
+        isinstance(obj["response_draft"], str) and bool(obj["response_draft"])
+        and isinstance(req, list) and len(req) <= 3 and all(isinstance(x, str) for x in req)
+        and isinstance(obj["secondary_category"], str)
+    )
+
+class LLMOutputError(ValueError):
+    """Réponse reçue mais inexploitable; kind = invalid_json | schema_mismatch."""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+# compteurs du run par format réellement envoyé (boucle asyncio unique: pas de verrou)
+SCHEMA_STATS: Dict[str, Counter] = defaultdict(Counter)
+_format_mode = [LLM_FORMAT if LLM_FORMAT in FORMAT_MODES else "schema"]
+
+def response_format() -> Any:
+    mode = _format_mode[0]
+    return RESPONSE_SCHEMA if mode == "schema" else ("json" if mode == "json" else None)
+
+def downgrade_format(failed: str, reason: str) -> bool:
+    """
+    schema -> json -> none quand Ollama refuse le format `failed`; False si déjà sans format.
+    Les requêtes concurrentes refusées avec le même format ne descendent qu'une fois.
+    """
+    if _format_mode[0] != failed:
+        return True  # déjà descendu par une autre requête: réessayer avec le format courant
+    pos = FORMAT_MODES.index(_format_mode[0])
+    if pos + 1 >= len(FORMAT_MODES):
+        return False
+    _format_mode[0] = FORMAT_MODES[pos + 1]
+    SCHEMA_STATS[failed]["format_downgrades"] += 1
+    print(f"⚠️ format={FORMAT_MODES[pos]} refusé par Ollama ({reason}) -> format={_format_mode[0]}", flush=True)
+    return True
+
 # =========================
 # Ollama call
 # =========================
-def post_json(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    r = SESSION.post(url, json=payload, timeout=TIMEOUT_SEC)
-    r.raise_for_status()
-    return r.json()
-
-def call_ollama_chat(system_prompt: str, user_prompt: str) -> str:
-    # IMPORTANT: /api/chat + format="json" est souvent problématique => on le retire
+def sampling_options() -> Dict[str, Any]:
+    # aussi dans la clé du cache LLM: changer une option invalide les réponses en cache
+    return {"temperature": TEMPERATURE, "top_p": TOP_P, "num_predict": NUM_PREDICT}
+
+async def call_ollama_chat(engine: LLMEngine, system_prompt: str, user_prompt: str,
+                           used: Optional[List[str]] = None) -> str:
+    """used: rempli avec le(s) format(s) envoyé(s) pour la requête qui a répondu (ou échoué)."""
+    # format = JSON schema (sorties structurées Ollama): décodage contraint, plus de JSON cassé
     payload = {
         "model": OLLAMA_MODEL,
         "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
-        "options": {"temperature": TEMPERATURE, "top_p": TOP_P, "num_predict": NUM_PREDICT},
+        "options": sampling_options(),
     }
-    data = post_json(f"{OLLAMA_HOST}/api/chat", payload)
-    return ((data.get("message") or {}).get("content")) or ""
+    used = used if used is not None else []
 
-def call_llm(system_prompt: str, user_prompt: str) -> Tuple[Dict[str, Any], str]:
-    raw = call_ollama_chat(system_prompt, user_prompt)
+    def with_format(p: Dict[str, Any]) -> Dict[str, Any]:
+        # format lu au moment de l'envoi: une descente pendant l'attente d'une place s'applique
+        used.append(_format_mode[0])
+        fmt = response_format()
+        return {**p, "format": fmt} if fmt is not None else p
+
+    while True:
+        used.clear()
+        try:
+            if LLM_STREAM:
+                return await engine.stream_json_object(
+                    "/api/chat", payload, max_tokens=NUM_PREDICT, prepare=with_format
+                )
+            data = await engine.post_json("/api/chat", payload, prepare=with_format)
+            return ((data.get("message") or {}).get("content")) or ""
+        except aiohttp.ClientResponseError as e:
+            # format non supporté (Ollama ancien): on réessaie tout de suite avec le format suivant
+            if e.status == 400 and used and used[0] != "none" and downgrade_format(used[0], f"HTTP {e.status}"):
+                continue
+            raise
+
+async def warm_up(engine: LLMEngine, system_prompt: str) -> None:
+    """
+    Charge le modèle (keep_alive) et met en cache le préfixe commun: prompt système + consignes.
+    Un format refusé (HTTP 400) descend ici, avant la 1re clé du cache de réponses.
+    """
+    payload = {
+        "model": OLLAMA_MODEL,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": USER_PROMPT_STATIC},
+        ],
+        "options": {**sampling_options(), "num_predict": 1},
+    }
+    t0 = time.time()
+    while True:
+        mode = _format_mode[0]
+        fmt = response_format()
+        # un warm-up par hôte du pool (en parallèle)
+        results = await engine.warm_up("/api/chat", {**payload, "format": fmt} if fmt is not None else payload)
+        refused = any(isinstance(d, aiohttp.ClientResponseError) and d.status == 400 for _, d in results)
+        if not (refused and mode != "none" and downgrade_format(mode, "HTTP 400, warm-up")):
+            break
+    for url, data in results:
+        if isinstance(data, Exception):
+            print(f"⚠️ Warm-up {OLLAMA_MODEL} @ {url} échoué ({type(data).__name__}: {data})")
+            continue
+        print(
+            f"🔥 Warm-up {OLLAMA_MODEL} @ {url} (keep_alive={OLLAMA_KEEP_ALIVE}): {time.time() - t0:.1f}s | "
+            f"chargement {float(data.get('load_duration') or 0) / 1e9:.1f}s | "
+            f"prefill {data.get('prompt_eval_count', '?')} tokens en {float(data.get('prompt_eval_duration') or 0) / 1e9:.2f}s"
+        )
+
+async def warm_up_only() -> None:
+    async with LLMEngine(OLLAMA_HOSTS) as engine:
+        await warm_up(engine, build_system_prompt())
+
+async def call_llm(engine: LLMEngine, system_prompt: str, user_prompt: str,
+                   used: Optional[List[str]] = None) -> Tuple[Dict[str, Any], str]:
+    raw = await call_ollama_chat(engine, system_prompt, user_prompt, used)
     obj = parse_json_robust(raw)
     if not isinstance(obj, dict):
-        raise ValueError("LLM output is not valid JSON")
+        raise LLMOutputError("invalid_json", "LLM output is not valid JSON")
     if not validate_min_schema(obj):
-        raise ValueError("LLM JSON does not match minimal schema")
+        raise LLMOutputError("schema_mismatch", "LLM JSON does not match minimal schema")
     return obj, raw
 
 # =========================
 # CLI args
 # =========================
 def parse_args(argv: List[str]) -> Dict[str, Any]:
-    args = {"limit": None, "interactive": False}
+    args = {"limit": None, "interactive": False, "warmup": False, "no_warmup": False}
     if "--limit" in argv:
         try:
             i = argv.index("--limit")
@@ -342,66 +531,115 @@ def parse_args(argv: List[str]) -> Dict[str, Any]:
             args["limit"] = None
     if "--interactive" in argv:
         args["interactive"] = True
+    if "--warmup" in argv:
+        args["warmup"] = True
+    if "--no-warmup" in argv:
+        args["no_warmup"] = True
     return args
 
 # =========================
 # Interactive chat terminal
 # =========================
-def interactive_mode():
+async def interactive_mode():
     system_prompt = build_system_prompt()
-    print(f"🔌 Chat terminal | {OLLAMA_HOST} | model={OLLAMA_MODEL}")
+    print(f"🔌 Chat terminal | {', '.join(url for url, _ in OLLAMA_HOSTS)} | model={OLLAMA_MODEL}")
     print("Tape 'exit' pour quitter.\n")
 
-    while True:
-        text = input("Message: ").strip()
-        if not text or text.lower() in {"exit", "quit"}:
-            break
+    async with LLMEngine(OLLAMA_HOSTS) as engine:
+        while True:
+            text = input("Message: ").strip()
+            if not text or text.lower() in {"exit", "quit"}:
+                break
 
-        urg = coerce_level(input("Urgency (P0/P1/P2/P3) [P3]: ").strip().upper() or "P3")
-        cat = (input("Category [other]: ").strip() or "other").strip()
-        sec = (input("Secondary category (optionnel): ").strip() or "")
-        ctx = input("RAG context (optionnel): ").strip()
+            urg = coerce_level(input("Urgency (P0/P1/P2/P3) [P3]: ").strip().upper() or "P3")
+            cat = (input("Category [other]: ").strip() or "other").strip()
+            sec = (input("Secondary category (optionnel): ").strip() or "")
+            ctx = input("RAG context (optionnel): ").strip()
 
-        prompt = build_user_prompt(text, urg, cat, ctx, secondary_category=sec)
-        t0 = time.time()
-        try:
-            obj, _raw = call_llm(system_prompt, prompt)
-            norm = normalize_output_json(obj, urg, cat, ctx, secondary_category=sec)
-        except Exception as e:
-            print("❌", e)
-            norm = fallback_json(urg, cat, ctx, secondary_category=sec)
+            prompt = build_user_prompt(text, urg, cat, ctx, secondary_category=sec)
+            t0 = time.time()
+            try:
+                obj, _raw = await call_llm(engine, system_prompt, prompt)
+                norm = normalize_output_json(obj, urg, cat, ctx, secondary_category=sec)
+            except Exception as e:
+                print("❌", e)
+                norm = fallback_json(urg, cat, ctx, secondary_category=sec)
 
-        print(json.dumps(norm, ensure_ascii=False, indent=2))
-        print(f"⏱️ {time.time()-t0:.1f}s\n")
+            print(json.dumps(norm, ensure_ascii=False, indent=2))
+            print(f"⏱️ {time.time()-t0:.1f}s\n")
 
 # =========================
-# Worker per row (for threads)
+# Worker per row (coroutine, concurrence bornée par le moteur)
 # =========================
-def process_one(
+async def process_one(
+    engine: LLMEngine,
     i: int,
     row_dict: Dict[str, Any],
     system_prompt: str,
-) -> Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]:
+    cache: Optional[LLMResponseCache] = None,
+    lane: Optional[TemplateLane] = None,
+) -> Tuple[int, Dict[str, Any], Optional[Dict[str, Any]], str, float]:
+    """
+    -> (i, sortie normalisée, échec éventuel, voie: template / cache / llm / fallback, secondes)
+    secondes: temps propre au message, hors attente d'une place dans le limiteur LLM
+    """
+    t0 = time.perf_counter()
     text = str(row_dict.get("text_clean", "") or "")
     rag_ctx = str(row_dict.get("rag_context", "") or "")
     urg = coerce_level(str(row_dict.get("final_urgency_level", "") or row_dict.get("priority_rules", "P3")))
     cat = str(row_dict.get("final_category", "") or row_dict.get("category", "other") or "other").strip() or "other"
     sec = str(row_dict.get("secondary_category", "") or "").strip()
 
+    # cas routinier couvert par une règle template_lane: réponse déterministe, pas de LLM
+    if lane is not None:
+        fields = {**row_dict, "urgency": urg, "category": cat}
+        rule = lane.match(fields)
+        if rule is not None:
+            return i, lane.render(rule, fields, fallback_json), None, "template", time.perf_counter() - t0 - queue_wait()
+
     prompt = build_user_prompt(text, urg, cat, rag_ctx, secondary_category=sec)
 
+    # même prompt + même modèle + mêmes options + même format -> sortie normalisée en cache, pas d'appel LLM;
+    # lecture avec le format courant, écriture avec le format réellement envoyé (descente pendant le run)
+    def key_for(fmt: str) -> str:
+        return response_key(system_prompt, prompt, OLLAMA_MODEL, {**sampling_options(), "format": fmt})
+
+    if cache:
+        cached = cache.get(key_for(_format_mode[0]))
+        if cached is not None:
+            return i, cached, None, "cache", time.perf_counter() - t0 - queue_wait()
+
     last_raw = ""
     last_error = ""
+    sent: List[str] = []
     for attempt in range(MAX_RETRIES + 1):
+        sent.clear()
+        obj, error = None, None
         try:
-            obj, last_raw = call_llm(system_prompt, prompt)
-            norm = normalize_output_json(obj, urg, cat, rag_ctx, secondary_category=sec)
-            return i, norm, None
+            obj, last_raw = await call_llm(engine, system_prompt, prompt, sent)
         except Exception as e:
-            last_error = str(e)
-            if attempt < MAX_RETRIES:
-                time.sleep(SLEEP_BETWEEN_RETRIES)
-
+            error = e
+        # compteurs rangés sous le format réellement envoyé (après une descente éventuelle)
+        st = SCHEMA_STATS[sent[-1] if sent else _format_mode[0]]
+        if attempt:
+            st["retries"] += 1
+        else:
+            st["llm_messages"] += 1
+            if error is None:
+                st["first_try_valid"] += 1
+                st["first_try_schema_valid"] += int(validate_full_schema(obj))
+            else:
+                st[error.kind if isinstance(error, LLMOutputError) else "first_try_error"] += 1
+        if error is None:
+            norm = normalize_output_json(obj, urg, cat, rag_ctx, secondary_category=sec)
+            if cache:
+                cache.put(key_for(sent[-1] if sent else _format_mode[0]), norm)
+            return i, norm, None, "llm", time.perf_counter() - t0 - queue_wait()
+        last_error = str(error) or type(error).__name__
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(backoff_delay(attempt))
+
+    SCHEMA_STATS[sent[-1] if sent else _format_mode[0]]["fallbacks"] += 1
     norm = fallback_json(urg, cat, rag_ctx, secondary_category=sec)
     fail = {
         "row_index": i,
@@ -412,7 +650,112 @@ def process_one(
         "error": last_error[:1500],
         "raw_output": (last_raw or "")[:3000],
     }
-    return i, norm, fail
+    return i, norm, fail, "fallback", time.perf_counter() - t0 - queue_wait()
+
+def schema_stats_lines(stats_path: Path) -> List[str]:
+    """
+    Taux de JSON valide au 1er essai pour ce run, cumulé par modèle / format dans
+    cleanData/bench/llm_schema_stats.json (comparaison entre modèles et modes).
+    Une entrée par format réellement envoyé: un run descendu de schema à json
+    compte ses messages sous chacun des deux.
+    """
+    runs = {fmt: st for fmt, st in SCHEMA_STATS.items() if any(st.values())}
+    if not runs:
+        return []
+    try:
+        history = json.loads(stats_path.read_text(encoding="utf-8")) if stats_path.exists() else {}
+    except (OSError, json.JSONDecodeError) as e:
+        # historique tronqué / illisible (run interrompu): on repart d'un historique vide
+        print(f"⚠️ {stats_path} illisible ({e}) -> nouvel historique")
+        history = {}
+    if not isinstance(history, dict):
+        history = {}
+
+    pct = lambda a, b: 100.0 * a / b if b else 0.0
+    lines = []
+    for fmt, st in runs.items():
+        key = f"{OLLAMA_MODEL}|format={fmt}"
+        entry = history.get(key)
+        tot = Counter(entry.get("counts", {}) if isinstance(entry, dict) else {})
+        tot.update(st)
+        tot_answered = tot["first_try_valid"] + tot["invalid_json"] + tot["schema_mismatch"]
+        history[key] = {
+            "counts": dict(tot),
+            "first_try_valid_rate": round(tot["first_try_valid"] / tot_answered, 4) if tot_answered else None,
+            "first_try_schema_valid_rate": round(tot["first_try_schema_valid"] / tot_answered, 4) if tot_answered else None,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if not st["llm_messages"] and not st["retries"]:
+            lines.append(f"{key}: refusé par Ollama, aucune réponse dans ce format (descentes={st['format_downgrades']})")
+            continue
+        answered = st["first_try_valid"] + st["invalid_json"] + st["schema_mismatch"]
+        lines += [
+            f"JSON 1er essai ({key}): valide {st['first_try_valid']}/{answered} ({pct(st['first_try_valid'], answered):.1f}%) "
+            f"| schéma complet {pct(st['first_try_schema_valid'], answered):.1f}% | invalide={st['invalid_json']} "
+            f"incomplet={st['schema_mismatch']} erreurs={st['first_try_error']} | retries={st['retries']} "
+            f"fallbacks={st['fallbacks']}",
+            f"cumul {key}: valide au 1er essai {pct(tot['first_try_valid'], tot_answered):.1f}% "
+            f"sur {tot_answered} réponses -> {stats_path}",
+        ]
+    stats_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = stats_path.with_suffix(".json.tmp")  # écriture atomique: pas de fichier tronqué si le run s'arrête
+    tmp.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(stats_path)
+    return lines
+
+def lane_lines(lane_seconds: Dict[str, List[float]], n: int) -> List[str]:
+    """Messages et latence par voie; appels LLM évités = voies template + cache."""
+    lines = []
+    for name in ("template", "cache", "llm", "fallback"):
+        secs = sorted(lane_seconds.get(name, []))
+        if not secs:
+            continue
+        p50 = 1000.0 * secs[len(secs) // 2]
+        p95 = 1000.0 * secs[min(len(secs) - 1, int(0.95 * len(secs)))]
+        lines.append(f"voie {name}: {len(secs)} messages | latence p50={p50:.1f}ms p95={p95:.1f}ms")
+    avoided = len(lane_seconds.get("template", [])) + len(lane_seconds.get("cache", []))
+    pct = 100.0 * avoided / n if n else 0.0
+    lines.append(
+        f"appels LLM évités: {avoided}/{n} ({pct:.1f}%) dont template={len(lane_seconds.get('template', []))}"
+    )
+    return lines
+
+async def generate_all(
+    rows: List[Dict[str, Any]],
+    system_prompt: str,
+    cache: Optional[LLMResponseCache],
+    lane: Optional[TemplateLane] = None,
+    warmup: bool = LLM_WARMUP,
+) -> Tuple[Dict[int, Dict[str, Any]], List[Dict[str, Any]], LLMEngine, Dict[str, List[float]]]:
+    results: Dict[int, Dict[str, Any]] = {}
+    fails: List[Dict[str, Any]] = []
+    lane_seconds: Dict[str, List[float]] = {}
+    n = len(rows)
+
+    t_all0 = time.time()
+    done = 0
+
+    async with LLMEngine(OLLAMA_HOSTS) as engine:
+        engine.count_tokens = token_counter().count
+        if warmup:
+            await warm_up(engine, system_prompt)
+        tasks = [process_one(engine, i+1, rows[i], system_prompt, cache, lane) for i in range(n)]
+        for fut in asyncio.as_completed(tasks):
+            i, norm, fail, lane_name, seconds = await fut
+            results[i] = norm
+            lane_seconds.setdefault(lane_name, []).append(seconds)
+            if fail:
+                fails.append(fail)
+
+            done += 1
+            if (done % LOG_EVERY) == 0 or done == n:
+                elapsed = time.time() - t_all0
+                rate = elapsed / max(done, 1)
+                eta = rate * (n - done)
+                pct = int(done / n * 100) if n else 100
+                print(f"➡️ {done}/{n} | {pct}% | ETA {eta/60:.1f} min | en vol ≤ {engine.limiter.limit}", flush=True)
+
+    return results, fails, engine, lane_seconds
 
 # =========================
 # Main
@@ -420,7 +763,11 @@ def process_one(
 def main():
     args = parse_args(sys.argv[1:])
     if args["interactive"]:
-        interactive_mode()
+        asyncio.run(interactive_mode())
+        return
+    if args["warmup"]:
+        # lancé en début de pipeline (DAG / 00): modèle chargé quand 09 arrive
+        asyncio.run(warm_up_only())
         return
 
     base_dir = Path(__file__).resolve().parent.parent
@@ -441,33 +788,21 @@ def main():
     n = len(rows)
 
     print(f"Rows loaded: {n}")
-    print(f"Workers: {WORKERS}\n")
+    print(f"Hôtes Ollama: {', '.join(f'{url} (poids {w:g})' for url, w in OLLAMA_HOSTS)}")
+    print(f"Concurrence LLM: départ {LLM_CONCURRENCY}, max {LLM_MAX_CONCURRENCY} (AIMD)\n")
 
     system_prompt = build_system_prompt()
-    print("SYSTEM_PROMPT_HASH=", hash(system_prompt))
+    print("SYSTEM_PROMPT_HASH=", stable_hash(system_prompt))
     print(system_prompt[:300])
 
-    results: Dict[int, Dict[str, Any]] = {}
-    fails: List[Dict[str, Any]] = []
+    # les fallbacks ne sont jamais mis en cache: un échec sera retenté au prochain run
+    cache = LLMResponseCache(base_dir / LLM_CACHE_DIR / "responses.sqlite") if LLM_CACHE_ENABLED else None
 
-    t_all0 = time.time()
-    done = 0
-
-    with ThreadPoolExecutor(max_workers=WORKERS) as ex:
-        futures = [ex.submit(process_one, i+1, rows[i], system_prompt) for i in range(n)]
-        for fut in as_completed(futures):
-            i, norm, fail = fut.result()
-            results[i] = norm
-            if fail:
-                fails.append(fail)
-
-            done += 1
-            if (done % LOG_EVERY) == 0 or done == n:
-                elapsed = time.time() - t_all0
-                rate = elapsed / max(done, 1)
-                eta = rate * (n - done)
-                pct = int(done / n * 100) if n else 100
-                print(f"➡️ {done}/{n} | {pct}% | ETA {eta/60:.1f} min", flush=True)
+    # voie template (policy_config.json -> template_lane), désactivable: LLM_TEMPLATE_LANE=0
+    lane = TemplateLane.from_policy(base_dir / "policy" / "policy_config.json")
+    results, fails, engine, lane_seconds = asyncio.run(
+        generate_all(rows, system_prompt, cache, lane, warmup=LLM_WARMUP and not args["no_warmup"])
+    )
 
     gen_json_col, response_col, required_info_col = [], [], []
     assigned_to_col, status_col, sla_col, is_urgent_col, decision_source_col = [], [], [], [], []
@@ -498,6 +833,24 @@ def main():
     df.to_csv(out_path, index=False, encoding="utf-8")
     print("\n✅ DONE")
     print(f"Saved: {out_path}")
+    for line in lane_lines(lane_seconds, n) + engine.stats_lines():
+        print("⚡", line)
+    for line in schema_stats_lines(base_dir / "cleanData" / "bench" / "llm_schema_stats.json"):
+        print("📦", line)
+    if engine.stream_records or engine.prefill_records:
+        # TTFT / tokens économisés (streaming) et prefill par requête, pour chiffrer les gains
+        bench_path = base_dir / "cleanData" / "bench" / "llm_generation_stats.json"
+        bench_path.parent.mkdir(parents=True, exist_ok=True)
+        bench_path.write_text(json.dumps(
+            {"model": OLLAMA_MODEL, "num_predict": NUM_PREDICT, "prompt_layout": PROMPT_LAYOUT,
+             "stream": engine.stream_summary(), "prefill": engine.prefill_summary(),
+             "stream_requests": engine.stream_records, "prefill_requests": engine.prefill_records},
+            ensure_ascii=False, indent=2,
+        ), encoding="utf-8")
+        print(f"📦 Stats génération: {bench_path}")
+    if cache:
+        cache.close()
+        print("📦", cache.stats_line())
 
     if fails:
         pd.DataFrame(fails).to_csv(audit_fail, index=False, encoding="utf-8")
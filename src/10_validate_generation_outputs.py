@@ -88,8 +88,8 @@ def main():
     # response_draft non-empty
     df["check_response_nonempty"] = df["response_draft"].fillna("").str.strip().ne("")
 
-    # decision_source == RAG
-    df["check_decision_source"] = df["decision_source"].fillna("").str.strip().eq("RAG")
+    # decision_source == RAG (ou TEMPLATE: voie déterministe de 09, template_lane)
+    df["check_decision_source"] = df["decision_source"].fillna("").str.strip().isin(["RAG", "TEMPLATE"])
 
     # status exists
     df["check_status"] = df["status"].fillna("").str.strip().ne("")
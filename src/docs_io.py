@@ -0,0 +1,18 @@
+# src/docs_io.py
+"""
+Écriture des docs générés (06_make_docs_*) dans data/docs/.
+
+Un fichier n'est réécrit que si son contenu change: le hash du doc reste stable
+dans le manifest RAG et 06_build_rag_index ne ré-encode rien pour rien.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Écrit seulement si le contenu change; True si le fichier a été (ré)écrit."""
+    if path.exists() and path.read_text(encoding="utf-8") == content:
+        return False
+    path.write_text(content, encoding="utf-8")
+    return True
@@ -0,0 +1,550 @@
+# src/embeddings.py
+"""
+Encodeur E5 partagé (06_build_rag_index, 06_test_retrieval, 07) + cache disque.
+Backend torch ou ONNX int8 (EMB_BACKEND, cf. encoder_backends.py).
+
+Cache: une entrée par (modèle, préfixe E5 "query:"/"passage:", hash du texte normalisé).
+- vectors.f32 : vecteurs float32 (lus en memmap)
+- keys.u64    : clés 64 bits (index trié en mémoire -> lookup par searchsorted)
+- ticks.i64   : dernier usage (éviction LRU quand on dépasse max_entries)
+- meta.json   : dim, nb entrées, compteurs hit/miss cumulés
+
+Un hit ne charge même pas le modèle: SentenceTransformer est instancié au 1er miss.
+
+Le dossier est partagé entre process (06_build_rag_index, 07, 07_rag_server):
+chargement et flush se font sous un verrou fichier (cache.lock, flock); le flush
+relit l'état disque, fusionne les entrées des autres writers par clé puis ajoute
+les siennes à la suite.
+
+Profil d'embedding (EMB_PROFILE): modèle + projection (PCA / troncature) +
+stockage des vecteurs dans l'index (fp32 / fp16 / uint8). La projection et la
+quantization sont faites par FAISS et stockées avec l'index (cf. rag_store).
+
+encode_stream(): encodage par shards (triés par longueur -> peu de padding),
+éventuellement répartis sur un pool de process (1 modèle par worker), rendus
+au fil de l'eau pour que l'appelant les ajoute à l'index sans tout garder.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de flock, un seul writer à la fois
+    fcntl = None
+
+import encoder_backends
+
+EMB_CACHE_ENABLED = os.getenv("EMB_CACHE", "1").strip() not in {"0", "false", "no"}
+EMB_CACHE_MAX_ENTRIES = int(os.getenv("EMB_CACHE_MAX_ENTRIES", "200000"))
+EMB_SHARD_SIZE = int(os.getenv("EMB_SHARD_SIZE", "256"))
+
+E5_PREFIXES = ("query:", "passage:")
+
+E5_BASE = "intfloat/multilingual-e5-base"  # 768 dims
+E5_SMALL = "intfloat/multilingual-e5-small"  # 384 dims
+
+# proj: none | pca | trunc (dims gardées = proj_dim) ; storage: fp32 | fp16 | sq8
+EMB_PROFILES = {
+    "e5-base": {"model": E5_BASE, "proj": "none", "proj_dim": 0, "storage": "fp32"},
+    "e5-base-fp16": {"model": E5_BASE, "proj": "none", "proj_dim": 0, "storage": "fp16"},
+    "e5-base-pca256-fp16": {"model": E5_BASE, "proj": "pca", "proj_dim": 256, "storage": "fp16"},
+    "e5-base-pca128-sq8": {"model": E5_BASE, "proj": "pca", "proj_dim": 128, "storage": "sq8"},
+    "e5-small": {"model": E5_SMALL, "proj": "none", "proj_dim": 0, "storage": "fp32"},
+    "e5-small-fp16": {"model": E5_SMALL, "proj": "none", "proj_dim": 0, "storage": "fp16"},
+    "e5-small-pca128-sq8": {"model": E5_SMALL, "proj": "pca", "proj_dim": 128, "storage": "sq8"},
+}
+PROJECTIONS = ("none", "pca", "trunc")
+STORAGES = ("fp32", "fp16", "sq8")
+
+
+def embedding_profile(name: str | None = None) -> dict:
+    """
+    Profil EMB_PROFILE (e5-base par défaut), surchargeable champ par champ:
+    EMB_MODEL, RAG_PROJ, RAG_PROJ_DIM, RAG_STORAGE. name explicite -> pas de surcharge env.
+    """
+    if name is not None:
+        if name not in EMB_PROFILES:
+            raise SystemExit(f"Profil d'embedding inconnu: {name} (attendu: {', '.join(EMB_PROFILES)})")
+        return {"name": name, **EMB_PROFILES[name]}
+
+    name = os.getenv("EMB_PROFILE", "e5-base").strip()
+    profile = embedding_profile(name)
+    profile["model"] = os.getenv("EMB_MODEL", "").strip() or profile["model"]
+    profile["proj"] = os.getenv("RAG_PROJ", "").strip().lower() or profile["proj"]
+    profile["proj_dim"] = int(os.getenv("RAG_PROJ_DIM", "").strip() or profile["proj_dim"])
+    profile["storage"] = os.getenv("RAG_STORAGE", "").strip().lower() or profile["storage"]
+    if profile["proj"] not in PROJECTIONS:
+        raise SystemExit(f"RAG_PROJ invalide: {profile['proj']} (attendu: {', '.join(PROJECTIONS)})")
+    if profile["storage"] not in STORAGES:
+        raise SystemExit(f"RAG_STORAGE invalide: {profile['storage']} (attendu: {', '.join(STORAGES)})")
+    return profile
+
+
+def default_cache_dir(base_dir: Path) -> Path:
+    return Path(os.getenv("EMB_CACHE_DIR", str(Path(base_dir) / "cleanData" / "emb_cache")))
+
+
+def split_e5_prefix(text: str) -> tuple[str, str]:
+    """'query: xxx' -> ('query:', 'xxx'). Sans préfixe E5 -> ('', text)."""
+    t = text or ""
+    for p in E5_PREFIXES:
+        if t.startswith(p):
+            return p, t[len(p):]
+    return "", t
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def text_key(text: str) -> int:
+    """Clé 64 bits stable (préfixe E5 + texte normalisé). Le modèle est porté par le dossier du cache."""
+    prefix, body = split_e5_prefix(text)
+    h = hashlib.blake2b(f"{prefix}\x1f{normalize_text(body)}".encode("utf-8"), digest_size=8)
+    return int.from_bytes(h.digest(), "little")
+
+
+def physical_cores() -> int:
+    try:
+        import psutil
+
+        n = psutil.cpu_count(logical=False)
+    except ImportError:
+        n = None
+    return max(1, n or os.cpu_count() or 1)
+
+
+def _model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+
+def _lookup(order: np.ndarray, sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Ligne de chaque clé (-1 si absente), à partir de l'index trié (order, sorted_keys)."""
+    rows = np.full(len(keys), -1, dtype=np.int64)
+    if len(sorted_keys) == 0 or len(keys) == 0:
+        return rows
+    pos = np.searchsorted(sorted_keys, keys)
+    pos_ok = np.minimum(pos, len(sorted_keys) - 1)
+    found = sorted_keys[pos_ok] == keys
+    rows[found] = order[pos_ok[found]]
+    return rows
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: Path, model_name: str, max_entries: int = EMB_CACHE_MAX_ENTRIES):
+        self.dir = Path(cache_dir) / _model_slug(model_name)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.max_entries = int(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # hits/misses déjà reportés dans meta.json (flush incrémental, plusieurs writers)
+        self._hits_flushed = 0
+        self._misses_flushed = 0
+
+        with self._locked():
+            meta, keys, ticks = self._load_disk()
+        self.dim = meta.get("dim")
+        self.tick = int(meta.get("tick", 0))
+        self._set_view(keys, ticks)
+
+        # entrées ajoutées pendant ce run (écrites au flush)
+        self._pending: dict[int, np.ndarray] = {}
+
+    # ---------- persistence
+    @contextmanager
+    def _locked(self):
+        """Verrou exclusif inter-process sur le dossier du cache (chargement / flush)."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.dir / "cache.lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _load_disk(self) -> tuple[dict, np.ndarray, np.ndarray]:
+        """État disque cohérent (meta, keys, ticks); à appeler sous _locked()."""
+        meta = self._read_meta()
+        dim = meta.get("dim")
+        n = int(meta.get("count", 0)) if dim else 0
+        keys = self._read_array("keys.u64", np.uint64)
+        ticks = self._read_array("ticks.i64", np.int64)
+        vec_path = self.dir / "vectors.f32"
+        nb_rows = (vec_path.stat().st_size // (4 * dim)) if (dim and vec_path.exists()) else 0
+        n = min(n, len(keys), len(ticks), nb_rows)
+        if vec_path.exists() and vec_path.stat().st_size != n * 4 * (dim or 0):
+            # writer interrompu entre l'ajout des vecteurs et l'écriture de meta.json
+            os.truncate(vec_path, n * 4 * (dim or 0))
+        return meta, keys[:n].copy(), ticks[:n].copy()
+
+    def _set_view(self, keys: np.ndarray, ticks: np.ndarray) -> None:
+        self._keys, self._ticks = keys, ticks
+        n = len(keys)
+        self._vectors = (
+            np.memmap(self.dir / "vectors.f32", dtype=np.float32, mode="r", shape=(n, self.dim)) if n else None
+        )
+        self._reindex()
+
+    def _read_meta(self) -> dict:
+        path = self.dir / "meta.json"
+        if not path.exists():
+            return {}
+        try:
+            meta = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+        return meta if meta.get("model") == self.model_name else {}
+
+    def _read_array(self, name: str, dtype) -> np.ndarray:
+        path = self.dir / name
+        return np.fromfile(path, dtype=dtype) if path.exists() else np.zeros(0, dtype=dtype)
+
+    def _reindex(self) -> None:
+        self._order = np.argsort(self._keys, kind="stable")
+        self._sorted_keys = self._keys[self._order]
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._pending)
+
+    # ---------- lookup / insert
+    def _find_rows(self, keys: np.ndarray) -> np.ndarray:
+        """Position de chaque clé dans vectors.f32 (-1 si absente)."""
+        return _lookup(self._order, self._sorted_keys, keys)
+
+    def get(self, keys: list[int]) -> tuple[np.ndarray, np.ndarray | None]:
+        """Retourne (mask_hit, vecteurs[n, dim] ou None si le cache est vide)."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        mask = np.zeros(len(keys), dtype=bool)
+        if self.dim is None:
+            self.misses += len(keys)
+            return mask, None
+
+        out = np.zeros((len(keys), self.dim), dtype=np.float32)
+        rows = self._find_rows(keys)
+        on_disk = rows >= 0
+        if on_disk.any():
+            out[on_disk] = self._vectors[rows[on_disk]]
+            self.tick += 1
+            self._ticks[rows[on_disk]] = self.tick
+            mask |= on_disk
+
+        for j in np.flatnonzero(~on_disk):
+            vec = self._pending.get(int(keys[j]))
+            if vec is not None:
+                out[j] = vec
+                mask[j] = True
+
+        nb_hit = int(mask.sum())
+        self.hits += nb_hit
+        self.misses += len(keys) - nb_hit
+        return mask, out
+
+    def put(self, keys: list[int], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+        for k, v in zip(keys, vectors):
+            self._pending[int(k)] = v
+
+    def flush(self) -> None:
+        """
+        Sous verrou: relit l'état disque (entrées des autres writers comprises), y reporte
+        les usages de ce process, ajoute les nouvelles entrées, puis évince les moins
+        récemment utilisées.
+        """
+        if self.dim is None:
+            return
+
+        with self._locked():
+            meta, keys, ticks = self._load_disk()
+            if meta.get("dim") not in (None, self.dim):
+                raise ValueError(f"Cache embeddings {self.dir}: dim {meta.get('dim')} sur disque != {self.dim}")
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+
+            # usages (ticks) de ce process reportés sur les lignes disque, par clé
+            rows = _lookup(order, sorted_keys, self._keys)
+            ok = rows >= 0
+            ticks[rows[ok]] = np.maximum(ticks[rows[ok]], self._ticks[ok])
+            self.tick = max(self.tick, int(meta.get("tick", 0))) + 1
+
+            if self._pending:
+                new_keys = np.fromiter(self._pending.keys(), dtype=np.uint64, count=len(self._pending))
+                new_vecs = np.vstack(list(self._pending.values())).astype(np.float32)
+                # déjà ajoutées par un autre writer -> seulement le tick
+                rows = _lookup(order, sorted_keys, new_keys)
+                ticks[rows[rows >= 0]] = self.tick
+                fresh = rows < 0
+                # _load_disk a ramené vectors.f32 à len(keys) lignes: l'ajout tombe juste après
+                with open(self.dir / "vectors.f32", "ab") as f:
+                    f.write(new_vecs[fresh].tobytes())
+                keys = np.concatenate([keys, new_keys[fresh]])
+                ticks = np.concatenate([ticks, np.full(int(fresh.sum()), self.tick, dtype=np.int64)])
+                self._pending = {}
+
+            self._keys, self._ticks = keys, ticks
+            if len(self._keys) > self.max_entries:
+                self._evict()
+            self._set_view(self._keys, self._ticks)
+            self._keys.tofile(self.dir / "keys.u64")
+            self._ticks.tofile(self.dir / "ticks.i64")
+
+            meta = {
+                "model": self.model_name,
+                "dim": self.dim,
+                "count": len(self._keys),
+                "tick": self.tick,
+                "hits_total": int(meta.get("hits_total", 0)) + self.hits - self._hits_flushed,
+                "misses_total": int(meta.get("misses_total", 0)) + self.misses - self._misses_flushed,
+            }
+            tmp = self.dir / "meta.json.tmp"
+            tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+            tmp.replace(self.dir / "meta.json")
+            self._hits_flushed, self._misses_flushed = self.hits, self.misses
+
+    def _evict(self) -> None:
+        n = len(self._keys)
+        keep = np.sort(np.argsort(self._ticks, kind="stable")[n - self.max_entries:])
+        vecs = np.memmap(self.dir / "vectors.f32", dtype=np.float32, mode="r", shape=(n, self.dim))
+        tmp = self.dir / "vectors.f32.tmp"
+        np.ascontiguousarray(vecs[keep]).tofile(tmp)
+        del vecs
+        self._vectors = None
+        tmp.replace(self.dir / "vectors.f32")
+        self.evicted += n - len(keep)
+        self._keys = self._keys[keep]
+        self._ticks = self._ticks[keep]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evicted": self.evicted,
+        }
+
+    def stats_line(self) -> str:
+        s = self.stats()
+        return (
+            f"cache embeddings: hits={s['hits']} misses={s['misses']} "
+            f"hit_rate={100 * s['hit_rate']:.1f}% entries={s['entries']} evicted={s['evicted']}"
+        )
+
+
+class CachedEncoder:
+    """
+    Wrapper autour du backend d'encodage (normalize_embeddings=True).
+    Les textes arrivent déjà au format E5 ("query: ..." / "passage: ...").
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache: EmbeddingCache | None = None,
+        batch_size: int = 32,
+        backend: str = "torch",
+        base_dir: Path | None = None,
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.model_id = encoder_backends.model_id(model_name, backend)
+        self.base_dir = base_dir
+        self.cache = cache
+        self.batch_size = int(batch_size)
+        self._model = None
+        self.nb_encoded = 0
+        self.load_seconds = 0.0
+        self.encode_seconds = 0.0  # temps des forwards de encode_stream (passages/s)
+
+    @property
+    def model(self):
+        if self._model is None:
+            t0 = time.time()
+            self._model = encoder_backends.load_backend(self.backend, self.model_name, self.base_dir)
+            self.load_seconds = time.time() - t0
+        return self._model
+
+    def warm_up(self) -> float:
+        """
+        Charge le modèle et fait un forward hors cache (un hit du cache ne chargerait rien):
+        la 1re vraie requête ne paie plus le chargement. Retourne la durée (s).
+        """
+        t0 = time.time()
+        self.model.encode(["query: warm-up"], batch_size=1, normalize_embeddings=True)
+        return time.time() - t0
+
+    def _encode_model(self, texts: list[str], show_progress_bar: bool = False) -> np.ndarray:
+        emb = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            show_progress_bar=show_progress_bar,
+            normalize_embeddings=True,
+        )
+        self.nb_encoded += len(texts)
+        return np.asarray(emb, dtype=np.float32)
+
+    def encode(self, texts: list[str], show_progress_bar: bool = False) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            dim = (self.cache.dim if self.cache else None) or 0
+            return np.zeros((0, dim), dtype=np.float32)
+
+        if self.cache is None:
+            return self._encode_model(texts, show_progress_bar=show_progress_bar)
+
+        keys = [text_key(t) for t in texts]
+        mask, out = self.cache.get(keys)
+
+        # misses dédupliqués (messages répétés -> 1 seul forward)
+        first_by_key: dict[int, int] = {}
+        for j in np.flatnonzero(~mask):
+            first_by_key.setdefault(keys[j], int(j))
+
+        if first_by_key:
+            miss_keys = list(first_by_key)
+            emb = self._encode_model([texts[first_by_key[k]] for k in miss_keys], show_progress_bar)
+            self.cache.put(miss_keys, emb)
+            if out is None:
+                out = np.zeros((len(texts), emb.shape[1]), dtype=np.float32)
+            by_key = dict(zip(miss_keys, emb))
+            for j in np.flatnonzero(~mask):
+                out[j] = by_key[keys[j]]
+
+        return out
+
+    def encode_stream(
+        self,
+        texts: list[str],
+        workers: int = 1,
+        shard_size: int = EMB_SHARD_SIZE,
+        show_progress_bar: bool = False,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Rend des (positions dans texts, vecteurs) au fil de l'eau: hits du cache d'abord,
+        puis un shard par forward terminé (ordre de fin, pas d'entrée).
+        workers > 1 : pool de process, 1 modèle par worker, threads intra-op répartis
+        sur les coeurs physiques (pas de sur-souscription).
+        """
+        texts = list(texts)
+        keys = [text_key(t) for t in texts]
+        if self.cache is not None:
+            mask, out = self.cache.get(keys)
+            if mask.any():
+                hit_pos = np.flatnonzero(mask)
+                yield hit_pos, out[hit_pos]
+        else:
+            mask = np.zeros(len(texts), dtype=bool)
+
+        # misses dédupliqués: clé -> positions
+        positions_by_key: dict[int, list[int]] = {}
+        for j in np.flatnonzero(~mask):
+            positions_by_key.setdefault(keys[j], []).append(int(j))
+        if not positions_by_key:
+            return
+
+        miss_keys = sorted(positions_by_key, key=lambda k: len(texts[positions_by_key[k][0]]))
+        shards = [miss_keys[b:b + shard_size] for b in range(0, len(miss_keys), shard_size)]
+
+        def emit(shard_keys: list[int], emb: np.ndarray):
+            emb = np.asarray(emb, dtype=np.float32)
+            self.nb_encoded += len(shard_keys)
+            if self.cache is not None:
+                self.cache.put(shard_keys, emb)
+            pos = []
+            rows = []
+            for r, k in enumerate(shard_keys):
+                for j in positions_by_key[k]:
+                    pos.append(j)
+                    rows.append(r)
+            return np.asarray(pos, dtype=np.int64), emb[rows]
+
+        t0 = time.time()
+        done = 0
+
+        def progress():
+            if show_progress_bar:
+                rate = done / max(time.time() - t0, 1e-9)
+                print(f"\r  encode {done}/{len(miss_keys)} passages ({rate:.1f}/s)", end="", flush=True)
+
+        workers = max(1, min(int(workers), len(shards)))
+        if workers == 1:
+            for shard_keys in shards:
+                emb = self.model.encode(
+                    [texts[positions_by_key[k][0]] for k in shard_keys],
+                    batch_size=self.batch_size,
+                    normalize_embeddings=True,
+                )
+                done += len(shard_keys)
+                progress()
+                yield emit(shard_keys, emb)
+        else:
+            threads = max(1, physical_cores() // workers)
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.backend, self.model_name, self.base_dir, threads),
+            ) as pool:
+                futures = {
+                    pool.submit(_encode_shard, [texts[positions_by_key[k][0]] for k in sk], self.batch_size): sk
+                    for sk in shards
+                }
+                for fut in as_completed(futures):
+                    shard_keys = futures[fut]
+                    emb = fut.result()
+                    done += len(shard_keys)
+                    progress()
+                    yield emit(shard_keys, emb)
+
+        self.encode_seconds += time.time() - t0
+        if show_progress_bar:
+            print()
+
+    def flush(self) -> None:
+        if self.cache is not None:
+            self.cache.flush()
+
+    def stats_line(self) -> str:
+        line = f"encodés par le modèle ({self.backend}): {self.nb_encoded}"
+        return f"{line} | {self.cache.stats_line()}" if self.cache else line
+
+
+# ---------- workers du pool d'encodage (process "spawn": 1 modèle chacun)
+_worker_model = None
+
+
+def _init_worker(backend: str, model_name: str, base_dir: Path, threads: int) -> None:
+    global _worker_model
+    _worker_model = encoder_backends.load_backend(backend, model_name, base_dir, threads=threads)
+
+
+def _encode_shard(texts: list[str], batch_size: int) -> np.ndarray:
+    emb = _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False, normalize_embeddings=True)
+    return np.asarray(emb, dtype=np.float32)
+
+
+def load_encoder(model_name: str, base_dir: Path, batch_size: int = 32, backend: str | None = None) -> CachedEncoder:
+    """backend=None -> EMB_BACKEND (torch par défaut). Le cache est séparé par backend (model_id)."""
+    backend = backend or encoder_backends.backend_from_env()
+    mid = encoder_backends.model_id(model_name, backend)
+    cache = EmbeddingCache(default_cache_dir(base_dir), mid) if EMB_CACHE_ENABLED else None
+    return CachedEncoder(model_name, cache=cache, batch_size=batch_size, backend=backend, base_dir=base_dir)
@@ -0,0 +1,168 @@
+# src/encoder_backends.py
+"""
+Backends d'encodage E5 (CPU), choisis par EMB_BACKEND:
+- torch : SentenceTransformer (historique, ~1 Go de mémoire torch)
+- onnx  : export ONNX + quantization dynamique int8, exécuté par onnxruntime
+          (pas d'import de torch à l'exécution; tokenizer via `tokenizers`)
+
+Les deux exposent encode(texts, batch_size, show_progress_bar, normalize_embeddings)
+avec la même sémantique que SentenceTransformer.encode (mean pooling E5 + L2).
+L'export (torch + onnxruntime.quantization) n'est fait qu'une fois, dans
+cleanData/onnx/<modèle>/ (ou EMB_ONNX_DIR).
+"""
+from __future__ import annotations
+
+import os
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx")
+ONNX_MAX_LENGTH = 512  # = max_seq_length SentenceTransformer pour e5
+ONNX_THREADS = int(os.getenv("EMB_ONNX_THREADS", "0"))  # 0 = défaut onnxruntime
+
+FP32_NAME = "model.onnx"
+INT8_NAME = "model_int8.onnx"
+
+
+def backend_from_env() -> str:
+    backend = os.getenv("EMB_BACKEND", "torch").strip().lower()
+    if backend not in BACKENDS:
+        raise SystemExit(f"EMB_BACKEND invalide: {backend} (attendu: {', '.join(BACKENDS)})")
+    return backend
+
+
+def model_id(model_name: str, backend: str) -> str:
+    """Identifiant des vecteurs produits (cache d'embeddings, manifest de l'index)."""
+    return model_name if backend == "torch" else f"{model_name}@onnx-int8"
+
+
+def default_onnx_dir(base_dir: Path, model_name: str) -> Path:
+    root = Path(os.getenv("EMB_ONNX_DIR", str(Path(base_dir) / "cleanData" / "onnx")))
+    return root / re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model_name: str, threads: int = 0):
+        if threads > 0:
+            import torch
+
+            torch.set_num_threads(threads)
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, normalize_embeddings=True):
+        emb = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+            normalize_embeddings=normalize_embeddings,
+        )
+        return np.asarray(emb, dtype=np.float32)
+
+
+def export_onnx(model_name: str, out_dir: Path, quantize: bool = True) -> Path:
+    """Exporte le transformer en ONNX (axes dynamiques) puis quantize les poids en int8."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)  # tokenizer.json pour le runtime
+
+    dummy = tokenizer(["passage: export"], return_tensors="pt")
+    fp32_path = out_dir / FP32_NAME
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "last_hidden_state": {0: "batch", 1: "seq"},
+            },
+            opset_version=17,
+        )
+
+    if not quantize:
+        return fp32_path
+    int8_path = out_dir / INT8_NAME
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_name: str, onnx_dir: Path, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        onnx_dir = Path(onnx_dir)
+        model_path = onnx_dir / INT8_NAME
+        if not model_path.exists():
+            print(f"ℹ️ Export ONNX int8 de {model_name} -> {onnx_dir} (une seule fois)")
+            export_onnx(model_name, onnx_dir)
+
+        self.tokenizer = Tokenizer.from_file(str(onnx_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_LENGTH)
+        pad_id = self.tokenizer.token_to_id("<pad>")
+        self.tokenizer.enable_padding(pad_id=pad_id if pad_id is not None else 1, pad_token="<pad>")
+
+        opts = ort.SessionOptions()
+        threads = threads or ONNX_THREADS
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), opts, providers=["CPUExecutionProvider"])
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch(texts)
+        input_ids = np.asarray([e.ids for e in enc], dtype=np.int64)
+        mask = np.asarray([e.attention_mask for e in enc], dtype=np.int64)
+        (hidden,) = self.session.run(["last_hidden_state"], {"input_ids": input_ids, "attention_mask": mask})
+
+        # mean pooling (config Pooling de multilingual-e5)
+        m = mask[..., None].astype(np.float32)
+        return (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, normalize_embeddings=True):
+        texts = list(texts)
+        out = []
+        # tri par longueur -> moins de padding par batch
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        t0 = time.time()
+        for b in range(0, len(texts), batch_size):
+            idx = order[b:b + batch_size]
+            out.append((idx, self._encode_batch([texts[i] for i in idx])))
+            if show_progress_bar:
+                done = min(b + batch_size, len(texts))
+                print(f"\r  onnx encode {done}/{len(texts)} ({done / max(time.time() - t0, 1e-9):.1f}/s)", end="")
+        if show_progress_bar and texts:
+            print()
+
+        emb = np.zeros((len(texts), out[0][1].shape[1]) if out else (0, 0), dtype=np.float32)
+        for idx, vecs in out:
+            emb[idx] = vecs
+        if normalize_embeddings and len(emb):
+            emb /= np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12
+        return emb
+
+
+def load_backend(backend: str, model_name: str, base_dir: Path, threads: int = 0):
+    """threads > 0 : nb de threads intra-op (workers d'encodage parallèle), 0 = défaut du backend."""
+    if backend == "onnx":
+        return OnnxBackend(model_name, default_onnx_dir(base_dir, model_name), threads=threads)
+    return TorchBackend(model_name, threads=threads)
@@ -0,0 +1,139 @@
+# src/llm_cache.py
+"""
+Cache persistant des réponses LLM de 09 (sqlite, cleanData/llm_cache/).
+
+- clé: hash stable (blake2b) du prompt système, du prompt utilisateur construit,
+  du modèle Ollama et des options d'échantillonnage -> toute modification de l'un
+  d'eux invalide naturellement l'entrée
+- valeur: sortie déjà normalisée (normalize_output_json), rendue sans appel LLM
+- expiration: entrées plus vieilles que LLM_CACHE_TTL_DAYS ignorées puis purgées
+- taille: au-delà de LLM_CACHE_MAX_ENTRIES / LLM_CACHE_MAX_MB, les entrées les
+  moins récemment utilisées sont évincées à la fermeture
+- partagé entre les threads de 09 (un verrou, une connexion)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").strip() == "1"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "cleanData/llm_cache").strip()
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200000"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+
+
+def stable_hash(*parts: Any, digest_size: int = 16) -> str:
+    """Hash identique d'un process à l'autre (contrairement à hash(), salé par process)."""
+    blob = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=digest_size).hexdigest()
+
+
+def response_key(system_prompt: str, user_prompt: str, model: str, options: Dict[str, Any]) -> str:
+    return stable_hash(system_prompt, user_prompt, model, options)
+
+
+class LLMResponseCache:
+    def __init__(
+        self,
+        path: Path,
+        ttl_days: float = LLM_CACHE_TTL_DAYS,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_mb: float = LLM_CACHE_MAX_MB,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = max(0.0, ttl_days) * 86400.0
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, "
+            "last_used REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.expired = 0
+        self.evicted = 0
+        self.nb_entries = 0
+        self.nb_bytes = 0
+
+    def _is_expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._is_expired(row[1], now):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        blob = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_used, size) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, now, now, len(blob.encode("utf-8"))),
+            )
+            self.stored += 1
+            if self.stored % 200 == 0:
+                self._db.commit()
+
+    def evict(self) -> None:
+        """Purge TTL puis LRU jusqu'à respecter max_entries et max_bytes."""
+        with self._lock:
+            if self.ttl_seconds > 0:
+                cur = self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+                self.expired += cur.rowcount
+            nb, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if nb > self.max_entries or size > self.max_bytes:
+                drop, freed = 0, 0
+                for (sz,) in self._db.execute("SELECT size FROM responses ORDER BY last_used"):
+                    if nb - drop <= self.max_entries and size - freed <= self.max_bytes:
+                        break
+                    drop += 1
+                    freed += sz
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (drop,),
+                )
+                self.evicted += drop
+                nb, size = nb - drop, size - freed
+            self._db.commit()
+            self.nb_entries, self.nb_bytes = int(nb), int(size)
+
+    def stats_line(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (
+            f"cache LLM: hits={self.hits} misses={self.misses} ({rate:.1f}% hit) | stockées={self.stored} "
+            f"| expirées={self.expired} évincées={self.evicted} | {self.nb_entries} entrées, {self.nb_bytes / 1e6:.1f} MB"
+        )
+
+    def close(self) -> None:
+        """Purge + commit; stats_line() reste utilisable après."""
+        self.evict()
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,623 @@
+# src/llm_engine.py
+"""
+Moteur de génération asynchrone de 09 (aiohttp).
+
+- une ClientSession partagée: pool de connexions keep-alive vers Ollama,
+  timeout par requête (TIMEOUT_SEC)
+- plusieurs hôtes Ollama pondérés (BackendPool): hôte le moins chargé (en vol,
+  latence observée), health checks, éjection / réintégration, bascule d'une
+  requête en échec vers un autre hôte
+- concurrence adaptative AIMD: la limite de requêtes en vol monte de +1 tant
+  que le débit d'une fenêtre ne baisse pas, redescend de 1 s'il baisse, et est
+  divisée par 2 sur erreur ou pic de latence (> LLM_LATENCY_FACTOR x meilleure
+  latence moyenne observée)
+- retries avec backoff exponentiel à jitter complet (remplace la pause fixe
+  SLEEP_BETWEEN_RETRIES, toujours lue comme base du backoff)
+- streaming /api/chat (stream_json_object): la requête est fermée dès qu'un
+  objet JSON de niveau 0 est complet (accolades / chaînes suivies au fil des
+  tokens) -> plus de texte parasite après le JSON ni de tokens générés pour rien
+- prefill: prompt_eval_count / prompt_eval_duration renvoyés par Ollama (réponses
+  complètes et flux allant jusqu'à done), comparés aux tokens estimés du prompt
+  -> tokens servis par le cache de préfixe et temps de prefill économisé
+- stats: requêtes/s obtenues, erreurs, concurrence choisie au fil du run,
+  time-to-first-token et tokens économisés en streaming
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+TIMEOUT_SEC = int(os.getenv("TIMEOUT_SEC", "90"))
+# concurrence de départ = WORKERS (ancien nombre de threads de 09)
+LLM_CONCURRENCY = int(os.getenv("WORKERS", "2"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# requêtes terminées par fenêtre d'ajustement (au moins la limite courante)
+LLM_AIMD_WINDOW = int(os.getenv("LLM_AIMD_WINDOW", "8"))
+LLM_LATENCY_FACTOR = float(os.getenv("LLM_LATENCY_FACTOR", "2.0"))
+LLM_RETRY_BASE_SEC = float(os.getenv("LLM_RETRY_BASE_SEC", os.getenv("SLEEP_BETWEEN_RETRIES", "0.6")))
+LLM_RETRY_MAX_SEC = float(os.getenv("LLM_RETRY_MAX_SEC", "10"))
+# pool d'hôtes: éjection après N échecs consécutifs, health check périodique
+LLM_EJECT_AFTER = int(os.getenv("LLM_EJECT_AFTER", "2"))
+LLM_EJECT_SEC = float(os.getenv("LLM_EJECT_SEC", "30"))
+LLM_HEALTH_SEC = float(os.getenv("LLM_HEALTH_SEC", "5"))
+LLM_HEALTH_TIMEOUT_SEC = float(os.getenv("LLM_HEALTH_TIMEOUT_SEC", "2"))
+
+# attente cumulée dans le limiteur pour la tâche asyncio courante (chaque message = une tâche)
+_QUEUE_WAIT: contextvars.ContextVar[float] = contextvars.ContextVar("llm_queue_wait", default=0.0)
+
+
+def queue_wait() -> float:
+    """Secondes passées par la tâche courante à attendre une place dans le limiteur."""
+    return _QUEUE_WAIT.get()
+
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_SEC, cap: float = LLM_RETRY_MAX_SEC) -> float:
+    """Backoff exponentiel à jitter complet: uniforme dans [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0.0, min(cap, base * (2 ** attempt)))
+
+
+class JsonObjectTracker:
+    """
+    Suit le texte généré token par token: profondeur d'accolades hors chaînes,
+    état chaîne / échappement. complete dès que le premier objet de niveau 0 est fermé;
+    le texte avant la première accolade (```json, phrase d'intro) est ignoré.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.start = -1
+        self.end = -1
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end >= 0
+
+    @property
+    def raw(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, chunk: str) -> bool:
+        if self.complete or not chunk:
+            return self.complete
+        self.parts.append(chunk)
+        for ch in chunk:
+            pos = self._pos
+            self._pos += 1
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                if self._depth > 0:
+                    self._in_str = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self.start = pos
+                self._depth += 1
+            elif ch == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = pos + 1
+                    return True
+        return False
+
+    def text(self) -> str:
+        """Objet complet si trouvé, sinon tout le texte reçu (parse_json_robust tranchera)."""
+        raw = self.raw
+        return raw[self.start:self.end] if self.complete else raw
+
+
+class AIMDLimiter:
+    def __init__(
+        self,
+        initial: int = LLM_CONCURRENCY,
+        min_limit: int = LLM_MIN_CONCURRENCY,
+        max_limit: int = LLM_MAX_CONCURRENCY,
+        window: int = LLM_AIMD_WINDOW,
+        latency_factor: float = LLM_LATENCY_FACTOR,
+    ):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = min(self.max_limit, max(self.min_limit, int(initial)))
+        self.window = max(1, int(window))
+        self.latency_factor = float(latency_factor)
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+        self._t_start = time.perf_counter()
+        self._reset_window(self._t_start)
+        self._prev_throughput: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        # (secondes depuis le début, limite) à chaque changement
+        self.history: List[Tuple[float, int]] = [(0.0, self.limit)]
+        self.increases = 0
+        self.decreases = 0
+
+    def _reset_window(self, now: float) -> None:
+        self._w_t0 = now
+        self._w_n = 0
+        self._w_errors = 0
+        self._w_latency = 0.0
+
+    async def acquire(self) -> None:
+        t0 = time.perf_counter()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        _QUEUE_WAIT.set(_QUEUE_WAIT.get() + time.perf_counter() - t0)
+
+    async def release(self, latency: float, ok: bool) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._observe(latency, ok)
+            self._cond.notify_all()
+
+    def _set_limit(self, limit: int, now: float) -> None:
+        limit = min(self.max_limit, max(self.min_limit, int(limit)))
+        if limit != self.limit:
+            if limit > self.limit:
+                self.increases += 1
+            else:
+                self.decreases += 1
+            self.limit = limit
+            self.history.append((now - self._t_start, limit))
+
+    def _observe(self, latency: float, ok: bool) -> None:
+        now = time.perf_counter()
+        self._w_n += 1
+        self._w_errors += 0 if ok else 1
+        self._w_latency += latency
+        if self._w_n < max(self.window, self.limit):
+            return
+
+        throughput = self._w_n / max(now - self._w_t0, 1e-9)
+        mean_latency = self._w_latency / self._w_n
+        if self._w_errors == 0 and (self.best_latency is None or mean_latency < self.best_latency):
+            self.best_latency = mean_latency
+
+        if self._w_errors or (self.best_latency and mean_latency > self.latency_factor * self.best_latency):
+            self._set_limit(self.limit // 2, now)  # décroissance multiplicative
+        elif self._prev_throughput is None or throughput >= 0.95 * self._prev_throughput:
+            self._set_limit(self.limit + 1, now)  # croissance additive
+        else:
+            self._set_limit(self.limit - 1, now)  # débit en baisse: on revient d'un cran
+        self._prev_throughput = throughput
+        self._reset_window(now)
+
+    def summary(self) -> Dict[str, Any]:
+        """Limite moyenne pondérée par le temps, min / max / finale."""
+        end = time.perf_counter() - self._t_start
+        points = self.history + [(end, self.limit)]
+        weighted = sum((t1 - t0) * lim for (t0, lim), (t1, _) in zip(points, points[1:]))
+        limits = [lim for _, lim in self.history]
+        return {
+            "final": self.limit,
+            "mean": weighted / end if end > 0 else float(self.limit),
+            "min": min(limits),
+            "max": max(limits),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+def parse_hosts(spec: str) -> List[Tuple[str, float]]:
+    """"http://a:11434=2,http://b:11434" -> [(url, poids)], poids 1 par défaut."""
+    hosts = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, weight = item, 1.0
+        head, sep, tail = item.rpartition("=")
+        if sep:
+            try:
+                url, weight = head, float(tail)
+            except ValueError:
+                pass
+        hosts.append((url.strip().rstrip("/"), max(weight, 1e-3)))
+    return hosts
+
+
+class Backend:
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = weight
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.nb_ok = 0
+        self.nb_failed = 0
+        self.ejections = 0
+        self.seconds = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class BackendPool:
+    """
+    Hôtes Ollama pondérés. Choix: le plus petit (en vol + 1) x latence EWMA / poids
+    parmi les hôtes non éjectés. Un hôte est éjecté après LLM_EJECT_AFTER échecs
+    consécutifs (connexion, timeout, 5xx) pour LLM_EJECT_SEC, ou dès qu'un health
+    check (GET /api/tags) échoue; un health check réussi le réintègre.
+    """
+
+    def __init__(self, hosts: List[Tuple[str, float]], eject_after: int = LLM_EJECT_AFTER,
+                 eject_sec: float = LLM_EJECT_SEC):
+        if not hosts:
+            raise ValueError("Aucun hôte Ollama configuré (OLLAMA_HOST / OLLAMA_HOSTS)")
+        self.backends = [Backend(url, weight) for url, weight in hosts]
+        self.eject_after = max(1, int(eject_after))
+        self.eject_sec = float(eject_sec)
+
+    def _default_latency(self) -> float:
+        known = [b.latency_ewma for b in self.backends if b.latency_ewma is not None]
+        return sum(known) / len(known) if known else 1.0
+
+    def pick(self, exclude: List[Backend]) -> Backend:
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+        if not candidates:
+            # tous éjectés: on tente celui dont l'éjection finit le plus tôt
+            rest = [b for b in self.backends if b not in exclude]
+            return min(rest, key=lambda b: b.ejected_until)
+        default = self._default_latency()
+        return min(
+            candidates,
+            key=lambda b: (b.in_flight + 1) * (b.latency_ewma if b.latency_ewma is not None else default) / b.weight,
+        )
+
+    def success(self, b: Backend, latency: float) -> None:
+        b.nb_ok += 1
+        b.seconds += latency
+        b.consecutive_failures = 0
+        b.latency_ewma = latency if b.latency_ewma is None else 0.8 * b.latency_ewma + 0.2 * latency
+
+    def failure(self, b: Backend, reason: str) -> None:
+        b.nb_failed += 1
+        b.consecutive_failures += 1
+        if b.consecutive_failures >= self.eject_after:
+            self.eject(b, reason)
+
+    def eject(self, b: Backend, reason: str) -> None:
+        if b.available(time.monotonic()):
+            b.ejections += 1
+            print(f"⚠️ Ollama {b.url} éjecté {self.eject_sec:.0f}s ({reason})", flush=True)
+        b.ejected_until = time.monotonic() + self.eject_sec
+
+    async def check(self, session: aiohttp.ClientSession, b: Backend) -> bool:
+        try:
+            async with session.get(f"{b.url}/api/tags", timeout=aiohttp.ClientTimeout(total=LLM_HEALTH_TIMEOUT_SEC)) as r:
+                r.raise_for_status()
+        except Exception as e:
+            self.eject(b, f"health check: {type(e).__name__}")
+            return False
+        if not b.available(time.monotonic()):
+            print(f"✅ Ollama {b.url} réintégré (health check OK)", flush=True)
+        b.ejected_until = 0.0
+        b.consecutive_failures = 0
+        return True
+
+    async def check_all(self, session: aiohttp.ClientSession) -> None:
+        await asyncio.gather(*(self.check(session, b) for b in self.backends))
+
+    async def health_loop(self, session: aiohttp.ClientSession, period: float = LLM_HEALTH_SEC) -> None:
+        while True:
+            await asyncio.sleep(period)
+            await self.check_all(session)
+
+
+# erreurs propres à un hôte: la requête repart sur un autre hôte (aucune sortie partielle gardée)
+class OllamaStreamError(RuntimeError):
+    """Ligne {"error": ...} dans le flux (modèle absent, contexte trop long...): propre à la requête, hôte sain."""
+
+
+def _is_host_failure(e: BaseException) -> bool:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500 or e.status == 429
+    return isinstance(e, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+
+class LLMEngine:
+    """async with LLMEngine(hosts) as engine: data = await engine.post_json("/api/chat", payload)"""
+
+    def __init__(self, hosts: List[Tuple[str, float]], timeout_sec: float = TIMEOUT_SEC,
+                 limiter: Optional[AIMDLimiter] = None):
+        self.pool = BackendPool(hosts)
+        self.timeout_sec = timeout_sec
+        self._limiter = limiter
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self.nb_requests = 0
+        self.nb_errors = 0
+        self.nb_failovers = 0
+        self.request_seconds = 0.0
+        self._t0 = 0.0
+        self.wall_seconds = 0.0
+        # streaming: une entrée par requête {ttft_ms, tokens, saved, early_stop, total_ms}
+        self.stream_records: List[Dict[str, Any]] = []
+        # prefill Ollama: {prompt_tokens_est, prompt_eval_count, prompt_eval_ms, load_ms}
+        self.prefill_records: List[Dict[str, Any]] = []
+        # texte -> nb de tokens (tokenizer du générateur), pour estimer la part du prompt en cache
+        self.count_tokens: Optional[Callable[[str], int]] = None
+
+    @property
+    def limiter(self) -> AIMDLimiter:
+        if self._limiter is None:
+            self._limiter = AIMDLimiter()  # créé dans la boucle asyncio
+        return self._limiter
+
+    async def __aenter__(self) -> "LLMEngine":
+        connector = aiohttp.TCPConnector(limit=self.limiter.max_limit * len(self.pool.backends), keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout_sec)
+        )
+        # hôtes morts écartés avant le premier message, puis surveillés pendant le run
+        await self.pool.check_all(self.session)
+        self._health_task = asyncio.create_task(self.pool.health_loop(self.session))
+        self._t0 = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.wall_seconds = time.perf_counter() - self._t0
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _prompt_tokens(self, payload: Dict[str, Any]) -> Optional[int]:
+        if self.count_tokens is None:
+            return None
+        return sum(self.count_tokens(m.get("content") or "") for m in payload.get("messages") or [])
+
+    def _record_prefill(self, payload: Dict[str, Any], data: Dict[str, Any]) -> None:
+        if data.get("prompt_eval_count") is None:
+            return
+        self.prefill_records.append({
+            "prompt_tokens_est": self._prompt_tokens(payload),
+            "prompt_eval_count": int(data["prompt_eval_count"]),
+            "prompt_eval_ms": round(float(data.get("prompt_eval_duration") or 0) / 1e6, 1),
+            "load_ms": round(float(data.get("load_duration") or 0) / 1e6, 1),
+        })
+
+    async def warm_up(self, path: str, payload: Dict[str, Any]) -> List[Tuple[str, Any]]:
+        """
+        Une requête par hôte disponible, hors limiteur et hors stats (modèle chargé, préfixe
+        en cache). -> [(url, réponse ou exception)]; un hôte en échec est éjecté.
+        """
+        async def one(b: Backend):
+            try:
+                async with self.session.post(f"{b.url}{path}", json={**payload, "stream": False}) as r:
+                    r.raise_for_status()
+                    return b.url, await r.json(content_type=None)
+            except Exception as e:
+                if _is_host_failure(e):
+                    self.pool.eject(b, f"warm-up: {type(e).__name__}")
+                return b.url, e
+
+        now = time.monotonic()
+        return list(await asyncio.gather(*(one(b) for b in self.pool.backends if b.available(now))))
+
+    async def _request(self, path: str, payload: Dict[str, Any], send,
+                       prepare: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]):
+        """
+        Une place dans le limiteur, puis un hôte choisi par le pool. Sur échec propre à l'hôte,
+        la même requête repart sur un autre hôte; seule la réponse de l'hôte qui réussit est
+        rendue (pas de requêtes doublées en parallèle -> pas de sortie en double).
+        """
+        await self.limiter.acquire()
+        if prepare is not None:
+            payload = prepare(payload)
+        t0 = time.perf_counter()
+        ok = False
+        tried: List[Backend] = []
+        try:
+            while True:
+                backend = self.pool.pick(tried)
+                backend.in_flight += 1
+                bt0 = time.perf_counter()
+                try:
+                    result = await send(f"{backend.url}{path}", payload)
+                except Exception as e:
+                    if not _is_host_failure(e):
+                        raise
+                    self.pool.failure(backend, f"{type(e).__name__}")
+                    tried.append(backend)
+                    if len(tried) >= len(self.pool.backends):
+                        raise
+                    self.nb_failovers += 1
+                    continue
+                finally:
+                    backend.in_flight -= 1
+                self.pool.success(backend, time.perf_counter() - bt0)
+                ok = True
+                return result
+        finally:
+            latency = time.perf_counter() - t0
+            self.nb_requests += 1
+            self.nb_errors += 0 if ok else 1
+            self.request_seconds += latency
+            await self.limiter.release(latency, ok)
+
+    async def post_json(self, path: str, payload: Dict[str, Any],
+                        prepare: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """prepare: appliqué au payload une fois la place obtenue (réglages qui ont pu changer pendant l'attente)."""
+        async def send(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+            async with self.session.post(url, json=payload) as r:
+                r.raise_for_status()
+                data = await r.json(content_type=None)
+            self._record_prefill(payload, data)
+            return data
+
+        return await self._request(path, payload, send, prepare)
+
+    async def stream_json_object(self, path: str, payload: Dict[str, Any], max_tokens: int,
+                                 prepare: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> str:
+        """
+        POST stream=True (NDJSON Ollama), coupe dès que l'objet JSON est complet.
+        tokens économisés: max_tokens - tokens reçus quand on coupe (borne haute, le modèle
+        aurait pu s'arrêter plus tôt), 0 si le flux va jusqu'à done.
+        Un flux interrompu (hôte en panne) est jeté en entier avant de repartir ailleurs.
+        """
+        async def send(url: str, payload: Dict[str, Any]) -> str:
+            t0 = time.perf_counter()
+            ttft = None
+            tokens = 0
+            done = False
+            tracker = JsonObjectTracker()
+            async with self.session.post(url, json={**payload, "stream": True}) as r:
+                r.raise_for_status()
+                async for line in r.content:
+                    if not line.strip():
+                        continue
+                    msg = json.loads(line)
+                    if msg.get("error"):
+                        # erreur renvoyée par Ollama en cours de flux: pas une panne d'hôte (pas d'éjection)
+                        raise OllamaStreamError(str(msg["error"]))
+                    piece = (msg.get("message") or {}).get("content") or ""
+                    if piece:
+                        tokens += 1
+                        if ttft is None:
+                            ttft = time.perf_counter() - t0
+                    if msg.get("done"):
+                        tokens = int(msg.get("eval_count") or tokens)
+                        done = True
+                        self._record_prefill(payload, msg)
+                    if tracker.feed(piece) or done:
+                        break
+                if not done and not tracker.complete:
+                    # flux fermé sans done ni objet complet: hôte tombé en cours de génération
+                    raise aiohttp.ClientPayloadError("flux Ollama interrompu avant la fin")
+                if not done:
+                    r.close()  # connexion coupée: Ollama arrête la génération
+            latency = time.perf_counter() - t0
+            self.stream_records.append({
+                "ttft_ms": round(1000.0 * (ttft if ttft is not None else latency), 1),
+                "total_ms": round(1000.0 * latency, 1),
+                "tokens": tokens,
+                "saved": 0 if done else max(0, int(max_tokens) - tokens),
+                "early_stop": not done,
+            })
+            return tracker.text()
+
+        return await self._request(path, payload, send, prepare)
+
+    def stream_summary(self) -> Dict[str, Any]:
+        recs = self.stream_records
+        if not recs:
+            return {}
+        ttft = sorted(r["ttft_ms"] for r in recs)
+        total = sorted(r["total_ms"] for r in recs)
+        pct = lambda xs, q: xs[min(len(xs) - 1, int(q * len(xs)))]
+        return {
+            "requests": len(recs),
+            "early_stops": sum(r["early_stop"] for r in recs),
+            "ttft_ms_p50": pct(ttft, 0.50),
+            "ttft_ms_p95": pct(ttft, 0.95),
+            "total_ms_p50": pct(total, 0.50),
+            "total_ms_p95": pct(total, 0.95),
+            "tokens": sum(r["tokens"] for r in recs),
+            "tokens_saved_max": sum(r["saved"] for r in recs),
+        }
+
+    def prefill_summary(self) -> Dict[str, Any]:
+        recs = self.prefill_records
+        if not recs:
+            return {}
+        evaluated = sum(r["prompt_eval_count"] for r in recs)
+        prefill_ms = sum(r["prompt_eval_ms"] for r in recs)
+        ms_per_token = prefill_ms / evaluated if evaluated else 0.0
+        out = {
+            "requests": len(recs),
+            "prompt_eval_count": evaluated,
+            "prompt_eval_ms": round(prefill_ms, 1),
+            "prompt_eval_ms_mean": round(prefill_ms / len(recs), 1),
+            "ms_per_prompt_token": round(ms_per_token, 3),
+        }
+        est = [r for r in recs if r["prompt_tokens_est"] is not None]
+        if est:
+            total = sum(r["prompt_tokens_est"] for r in est)
+            reused = sum(max(0, r["prompt_tokens_est"] - r["prompt_eval_count"]) for r in est)
+            out.update({
+                "prompt_tokens_est": total,
+                "prefix_cached_tokens_est": reused,
+                "prefix_cached_pct": round(100.0 * reused / total, 1) if total else 0.0,
+                "prefill_ms_saved_est": round(reused * ms_per_token, 1),
+            })
+        return out
+
+    def stats_lines(self) -> List[str]:
+        wall = self.wall_seconds or (time.perf_counter() - self._t0)
+        rps = self.nb_requests / wall if wall > 0 else 0.0
+        mean = 1000.0 * self.request_seconds / self.nb_requests if self.nb_requests else 0.0
+        c = self.limiter.summary()
+        return [
+            f"LLM: {self.nb_requests} requêtes ({self.nb_errors} erreurs) en {wall:.1f}s "
+            f"| {rps:.2f} requêtes/s | latence moyenne {mean:.0f}ms",
+            f"concurrence AIMD: finale={c['final']} moyenne={c['mean']:.1f} min={c['min']} max={c['max']} "
+            f"(+{c['increases']} / -{c['decreases']} ajustements)",
+        ] + self._backend_lines(wall) + self._stream_lines() + self._prefill_lines()
+
+    def _backend_lines(self, wall: float) -> List[str]:
+        if len(self.pool.backends) == 1 and not self.nb_failovers:
+            return []
+        lines = []
+        for b in self.pool.backends:
+            mean = 1000.0 * b.seconds / b.nb_ok if b.nb_ok else 0.0
+            lines.append(
+                f"hôte {b.url} (poids {b.weight:g}): {b.nb_ok} réponses, {b.nb_failed} échecs, "
+                f"{b.ejections} éjections | {b.nb_ok / wall if wall > 0 else 0.0:.2f} requêtes/s "
+                f"| latence moyenne {mean:.0f}ms"
+            )
+        lines.append(f"bascules vers un autre hôte: {self.nb_failovers}")
+        return lines
+
+    def _prefill_lines(self) -> List[str]:
+        st = self.prefill_summary()
+        if not st:
+            if self.stream_records:
+                # flux coupés avant done: Ollama n'envoie pas prompt_eval_*, le TTFT reste la mesure
+                return ["prefill: pas de prompt_eval_* (flux coupés avant done) -> voir TTFT"]
+            return []
+        line = (
+            f"prefill: {st['requests']} réponses | {st['prompt_eval_count']} tokens évalués en "
+            f"{st['prompt_eval_ms'] / 1000:.1f}s ({st['prompt_eval_ms_mean']:.0f}ms/requête, "
+            f"{st['ms_per_prompt_token']:.2f}ms/token)"
+        )
+        if "prompt_tokens_est" in st:
+            line += (
+                f" | préfixe en cache ≈{st['prefix_cached_pct']:.0f}% des {st['prompt_tokens_est']} tokens "
+                f"-> ≈{st['prefill_ms_saved_est'] / 1000:.1f}s économisées"
+            )
+        return [line]
+
+    def _stream_lines(self) -> List[str]:
+        st = self.stream_summary()
+        if not st:
+            return []
+        return [
+            f"streaming: arrêt anticipé {st['early_stops']}/{st['requests']} | TTFT p50={st['ttft_ms_p50']:.0f}ms "
+            f"p95={st['ttft_ms_p95']:.0f}ms | total p50={st['total_ms_p50']:.0f}ms | tokens reçus={st['tokens']} "
+            f"économisés≤{st['tokens_saved_max']}"
+        ]
@@ -0,0 +1,200 @@
+# src/rag_context.py
+"""
+Assemblage du contexte RAG sous budget de tokens (tokenizer du générateur).
+
+Historique: 5 chunks complets concaténés (en-têtes SOURCE/SECTION répétés, 120
+caractères de recouvrement entre chunks voisins), puis 09 coupait à MAX_CONTEXT_CHARS
+-> la procédure forcée, placée en dernier, disparaissait.
+
+pack_context:
+- docs de procédures (forcés par niveau / catégorie) toujours gardés, en premier
+- autres chunks par score décroissant, ignorés sous CTX_MIN_REL_SCORE x meilleur score
+  (scores cosinus seulement: RRF / BM25 n'ont pas la même échelle)
+- un seul en-tête court par (doc, section), chunks d'une même section regroupés dans
+  l'ordre du document, recouvrement avec le chunk précédent retiré
+- blocs ajoutés tant que le budget CTX_TOKEN_BUDGET (tokens du générateur) tient
+"""
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import Callable
+
+from rag_dedup import chunk_body
+
+# "packed" = budget de tokens (défaut), "concat" = concaténation historique des chunks
+CONTEXT_MODE = os.getenv("RAG_CONTEXT_MODE", "packed").strip().lower()
+CTX_TOKEN_BUDGET = int(os.getenv("RAG_CTX_TOKENS", "350"))
+CTX_MIN_REL_SCORE = float(os.getenv("RAG_CTX_MIN_REL_SCORE", "0.8"))
+# tokenizer HF du modèle Ollama de 09 (qwen2.5); repli ~4 caractères / token s'il est indisponible
+CTX_TOKENIZER = os.getenv("RAG_CTX_TOKENIZER", "Qwen/Qwen2.5-7B-Instruct").strip()
+
+CONTEXT_SEP = "\n\n---\n\n"
+MIN_OVERLAP = 20
+MAX_OVERLAP = 400
+
+
+class TokenCounter:
+    def __init__(self, name: str = CTX_TOKENIZER):
+        self.name = name
+        self._tokenizer = None
+        try:
+            from transformers import AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(name)
+        except Exception as e:
+            print(f"⚠️ Tokenizer {name} indisponible ({type(e).__name__}) -> estimation 4 caractères/token")
+            self.name = "chars/4"
+        self.count = lru_cache(maxsize=65536)(self._count)
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is None:
+            return (len(text) + 3) // 4
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+
+_COUNTER: TokenCounter | None = None
+
+
+def token_counter() -> TokenCounter:
+    """Tokenizer chargé une fois par process (07, serveur, benchmarks)."""
+    global _COUNTER
+    if _COUNTER is None:
+        _COUNTER = TokenCounter()
+    return _COUNTER
+
+
+def strip_overlap(prev: str, body: str) -> str:
+    """Retire le début de `body` déjà présent à la fin de `prev` (recouvrement du chunking)."""
+    for k in range(min(len(prev), len(body), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if prev.endswith(body[:k]):
+            return body[k:].lstrip()
+    return body
+
+
+def _strip_title(body: str, section: str) -> str:
+    """Le corps d'un chunk commence par le titre de sa section, déjà dans l'en-tête."""
+    first, _, rest = body.partition("\n")
+    return rest.strip() if section and first.strip() == section.strip() else body
+
+
+def _header(doc: str, section: str) -> str:
+    name = doc.rsplit("/", 1)[-1]
+    section = section.lstrip("#").strip()
+    return f"[{name} > {section}]" if section else f"[{name}]"
+
+
+def _fit(text: str, budget: int, counter: TokenCounter) -> str:
+    """Plus long préfixe (coupé sur un espace) qui tient dans `budget` tokens."""
+    if counter.count(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if counter.count(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    return cut[:cut.rfind(" ")].rstrip() if " " in cut else cut
+
+
+def pack_context(
+    picked_ids: list[int],
+    picked_scores: list[float],
+    store,
+    keep_docs: list[str],
+    budget: int = CTX_TOKEN_BUDGET,
+    min_rel_score: float = CTX_MIN_REL_SCORE,
+    counter: TokenCounter | None = None,
+    doc_chunks: Callable[[str], object] | None = None,
+    score_kind: str = "cosine",
+) -> str:
+    """
+    (ids, scores) du retrieval -> contexte compact sous `budget` tokens.
+    keep_docs: docs toujours gardés, par priorité (procédure du niveau avant doc de catégorie).
+    doc_chunks: doc -> ids de ses chunks dans l'ordre; un doc gardé dont le chunk se réduit
+    au titre (1er chunk forcé) est complété par le chunk suivant du doc.
+    score_kind: échelle des scores; min_rel_score ne s'applique qu'aux cosinus.
+    """
+    counter = counter or token_counter()
+    picked_ids = [int(i) for i in picked_ids]
+    records = {i: store.record(i) for i in picked_ids}
+
+    if doc_chunks is not None:
+        for p, i in enumerate(picked_ids):
+            r = records[i]
+            if r.doc not in keep_docs or _strip_title(chunk_body(r.text).strip(), r.section):
+                continue
+            chunks = doc_chunks(r.doc)
+            ids = [] if chunks is None else [int(c) for c in chunks]
+            pos = ids.index(i) + 1 if i in ids else len(ids)
+            if pos < len(ids) and ids[pos] not in records:
+                picked_ids[p] = ids[pos]
+                records[ids[pos]] = store.record(ids[pos])
+
+    kept = sorted((i for i in picked_ids if records[i].doc in keep_docs),
+                  key=lambda i: keep_docs.index(records[i].doc))
+    others = sorted(
+        ((i, float(s)) for i, s in zip(picked_ids, picked_scores) if records[i].doc not in keep_docs),
+        key=lambda x: -x[1],
+    )
+    if others and score_kind == "cosine":
+        floor = others[0][1] * min_rel_score if others[0][1] > 0 else float("-inf")
+        others = [(i, s) for i, s in others if s >= floor]
+
+    # groupes (doc, section) dans l'ordre de pertinence, chunks dans l'ordre du document
+    groups: dict[tuple[str, str], list[int]] = {}
+    for i in [*kept, *(i for i, _ in others)]:
+        r = records[i]
+        group = groups.setdefault((r.doc, r.section), [])
+        if i not in group:
+            group.append(i)
+
+    blocks = []
+    used = 0
+    for (doc, section), ids in groups.items():
+        header = _header(doc, section)
+        parts, prev_body, prev_no = [], "", None
+        for i in sorted(ids, key=lambda i: records[i].chunk_no):
+            raw = _strip_title(chunk_body(records[i].text).strip(), section)
+            follows = prev_no is not None and records[i].chunk_no == prev_no + 1
+            part = strip_overlap(prev_body, raw) if follows else raw
+            if part:
+                parts.append(part)
+            prev_body, prev_no = raw, records[i].chunk_no
+        body = "\n".join(parts)
+        if not body:
+            continue  # chunk réduit au titre de section
+
+        sep_cost = counter.count(CONTEXT_SEP) if blocks else 0
+        block = f"{header}\n{body}"
+        cost = counter.count(block) + sep_cost
+        if used + cost <= budget:
+            blocks.append(block)
+            used += cost
+        elif doc in keep_docs:
+            # procédure: tronquée au budget restant plutôt que perdue
+            room = budget - used - sep_cost - counter.count(header + "\n")
+            cut = _fit(body, room, counter) if room > 0 else ""
+            if cut:
+                blocks.append(f"{header}\n{cut}")
+                used = budget
+    return CONTEXT_SEP.join(blocks).strip()
+
+
+def truncate_context(context: str, max_chars: int) -> str:
+    """Coupe à max_chars en gardant des blocs entiers (séparateur ---) quand c'est possible."""
+    ctx = (context or "").strip()
+    if max_chars <= 0 or len(ctx) <= max_chars:
+        return ctx
+    blocks = ctx.split(CONTEXT_SEP)
+    out = blocks[0][:max_chars]
+    for block in blocks[1:]:
+        candidate = out + CONTEXT_SEP + block
+        if len(candidate) > max_chars:
+            break
+        out = candidate
+    return out.strip()
@@ -0,0 +1,116 @@
+# src/rag_dedup.py
+"""
+Dédup des chunks quasi-identiques (MinHash + LSH) au build de l'index.
+
+Les docs générés (policy, P2/P3, cas spécifiques) se recopient beaucoup et le
+chunking ajoute 120 caractères de recouvrement -> des chunks presque identiques
+occupent plusieurs places du top-k et gonflent l'index.
+
+- shingles : 5-grammes de mots du corps du chunk (sans l'en-tête SOURCE/SECTION)
+- MinHash  : DEDUP_NUM_PERM permutations, LSH en DEDUP_BANDS bandes
+- candidats LSH vérifiés par Jaccard exact sur les shingles (>= DEDUP_THRESHOLD)
+- glouton par id croissant: le chunk le plus ancien reste canonique, les
+  suivants lui sont rattachés (pas de chaînage A~B~C)
+
+Le résultat {id doublon: id canonique} est stocké dans manifest["dedup"]:
+seuls les chunks canoniques sont dans l'index FAISS, tous restent dans le
+chunk store (textes des docs forcés, provenance des sources fusionnées).
+"""
+from __future__ import annotations
+
+import os
+import unicodedata
+import zlib
+
+import numpy as np
+
+DEDUP_ENABLED = os.getenv("RAG_DEDUP", "1").strip() not in {"0", "false", "no"}
+DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.85"))
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16  # 16 bandes x 4 lignes -> candidat quasi certain dès Jaccard ~0.7
+SHINGLE_SIZE = 5
+
+_PRIME = (1 << 31) - 1
+
+
+def dedup_config() -> dict:
+    return {
+        "enabled": DEDUP_ENABLED,
+        "threshold": DEDUP_THRESHOLD,
+        "num_perm": DEDUP_NUM_PERM,
+        "bands": DEDUP_BANDS,
+        "shingle_size": SHINGLE_SIZE,
+    }
+
+
+def chunk_body(text: str) -> str:
+    """Retire l'en-tête 'SOURCE: ...\\nSECTION: ...' ajouté par chunk_document."""
+    if text.startswith("SOURCE:") and "\n\n" in text:
+        return text.split("\n\n", 1)[1]
+    return text
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> set[int]:
+    words = unicodedata.normalize("NFC", text).lower().split()
+    if len(words) <= k:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + k]).encode("utf-8")) for i in range(len(words) - k + 1)}
+
+
+def _permutations(num_perm: int, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(sh: set[int], a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if not sh:
+        return np.full(len(a), _PRIME, dtype=np.uint64)
+    x = np.fromiter(sh, dtype=np.uint64, count=len(sh)) % _PRIME
+    return ((np.outer(x, a) + b) % _PRIME).min(axis=0)
+
+
+def jaccard(x: set[int], y: set[int]) -> float:
+    if not x or not y:
+        return 0.0
+    return len(x & y) / len(x | y)
+
+
+def find_near_duplicates(
+    chunks: list[tuple[int, str]],
+    threshold: float = DEDUP_THRESHOLD,
+    num_perm: int = DEDUP_NUM_PERM,
+    bands: int = DEDUP_BANDS,
+) -> dict[int, int]:
+    """chunks = [(id, texte)] -> {id doublon: id canonique} (canonique = plus petit id du groupe)."""
+    a, b = _permutations(num_perm)
+    rows = num_perm // bands
+    buckets: dict[tuple, list[int]] = {}
+    sh_by_id: dict[int, set[int]] = {}
+    duplicate_of: dict[int, int] = {}
+
+    for cid, text in sorted(chunks):
+        sh = shingles(chunk_body(text))
+        sig = minhash(sh, a, b)
+        band_keys = [(band, sig[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+        canon = None
+        if sh:
+            seen = set()
+            for key in band_keys:
+                for other in buckets.get(key, ()):
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    if jaccard(sh, sh_by_id[other]) >= threshold:
+                        canon = other if canon is None else min(canon, other)
+        if canon is not None:
+            duplicate_of[cid] = canon
+            continue
+
+        # canonique: seul à entrer dans les buckets
+        sh_by_id[cid] = sh
+        for key in band_keys:
+            buckets.setdefault(key, []).append(cid)
+    return duplicate_of
@@ -0,0 +1,105 @@
+# src/rag_lexical.py
+"""
+Index lexical BM25 en mémoire sur les chunks du store (mêmes ids que l'index FAISS).
+
+- tokens : minuscules, sans accents, mots >= 2 caractères hors mots vides
+- BM25   : k1=1.5, b=0.75; poids précalculés par posting -> une requête = somme
+           de quelques tableaux numpy, pas de transformer
+- rrf_fuse : fusion de classements (Reciprocal Rank Fusion, k=60) dense + lexical
+"""
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+_TOKEN_RX = re.compile(r"[a-z0-9]{2,}")
+STOPWORDS = {
+    "au", "aux", "avec", "ce", "ces", "cette", "dans", "de", "des", "du", "elle", "en", "est", "et",
+    "il", "ils", "je", "la", "le", "les", "leur", "mais", "me", "mon", "ne", "nous", "on", "ou",
+    "par", "pas", "pour", "qu", "que", "qui", "sa", "se", "ses", "son", "sur", "ta", "te", "tu",
+    "un", "une", "vos", "votre", "vous",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    return [w for w in _TOKEN_RX.findall(t) if w not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, chunks: list[tuple[int, str]], k1: float = BM25_K1, b: float = BM25_B):
+        """chunks = [(chunk_id, texte)] (ids indexés: canoniques après dédup)."""
+        self.ids = np.asarray([cid for cid, _ in chunks], dtype=np.int64)
+        self._pos = {int(cid): p for p, cid in enumerate(self.ids.tolist())}
+        counts = [Counter(tokenize(text)) for _, text in chunks]
+        lengths = np.asarray([sum(c.values()) for c in counts], dtype=np.float32)
+        avgdl = float(lengths.mean()) if len(lengths) else 0.0
+        norm = k1 * (1.0 - b + b * lengths / max(avgdl, 1e-9))
+
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for p, c in enumerate(counts):
+            for term, tf in c.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(p)
+                tfs.append(tf)
+
+        n = len(chunks)
+        self.postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for term, (docs, tfs) in postings.items():
+            docs_a = np.asarray(docs, dtype=np.int64)
+            tf_a = np.asarray(tfs, dtype=np.float32)
+            idf = math.log(1.0 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[term] = (docs_a, (idf * tf_a * (k1 + 1.0) / (tf_a + norm[docs_a])).astype(np.float32))
+        self._masks: OrderedDict[bytes, np.ndarray] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _mask(self, candidates: np.ndarray) -> np.ndarray:
+        key = np.asarray(candidates, dtype=np.int64).tobytes()
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.isin(self.ids, candidates)
+            self._masks[key] = mask
+            if len(self._masks) > 256:
+                self._masks.popitem(last=False)
+        return mask
+
+    def search(self, text: str, top_k: int, candidates: np.ndarray | None = None) -> tuple[list[int], list[float]]:
+        """Top-k (ids de chunks, scores BM25), limité aux ids `candidates` si fourni. Score 0 = exclu."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(text)):
+            hit = self.postings.get(term)
+            if hit is not None:
+                scores[hit[0]] += hit[1]
+        if candidates is not None:
+            scores[~self._mask(candidates)] = 0.0
+
+        k = min(int(top_k), len(scores))
+        if k <= 0:
+            return [], []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[scores[top] > 0]
+        return self.ids[top].tolist(), scores[top].tolist()
+
+
+def rrf_fuse(rankings: list[list[int]], top_k: int, k: int = RRF_K) -> tuple[list[int], list[float]]:
+    """Reciprocal Rank Fusion: score(id) = somme 1 / (k + rang). Ex-aequo: 1er classement d'abord."""
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            if cid < 0:
+                continue
+            fused[int(cid)] = fused.get(int(cid), 0.0) + 1.0 / (k + rank + 1)
+    best = sorted(fused.items(), key=lambda x: -x[1])[:top_k]
+    return [cid for cid, _ in best], [round(s, 6) for _, s in best]
@@ -0,0 +1,146 @@
+# src/rag_rerank.py
+"""
+Rerank cross-encoder conditionnel (RAG_RERANK=1).
+
+Un cross-encoder sur chaque message coûte ~k forwards par message: on ne le lance
+que si le top-k dense est ambigu:
+- écart top1 - top2 < RERANK_GAP, ou
+- top1 < RERANK_MIN_SCORE
+Les messages non ambigus gardent le top-k dense tel quel. Le rerank ne change
+que l'ordre: rag_retrieval garde les scores cosinus du dense (logits non bornés).
+
+- candidats : RERANK_CANDIDATES plus proches voisins denses (recherche élargie)
+- paires (message, chunk) de tout le batch scorées en un seul predict()
+- cache des scores par (hash de la requête, id de chunk), vidé quand la version
+  de l'index change (bind), comme le cache de résultats
+- stats: taux de déclenchement, paires scorées / en cache, latence ajoutée
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from rag_dedup import chunk_body
+
+RERANK_ENABLED = os.getenv("RAG_RERANK", "0").strip() == "1"
+# cross-encoder multilingue (fr / darija translittérée), ~120M paramètres
+RERANK_MODEL = os.getenv("RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1").strip()
+RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+RERANK_GAP = float(os.getenv("RAG_RERANK_GAP", "0.02"))
+RERANK_MIN_SCORE = float(os.getenv("RAG_RERANK_MIN_SCORE", "0.80"))
+RERANK_BATCH_SIZE = int(os.getenv("RAG_RERANK_BATCH", "32"))
+RERANK_CACHE_ENTRIES = int(os.getenv("RAG_RERANK_CACHE_ENTRIES", "200000"))
+
+
+def rerank_config() -> dict:
+    return {
+        "model": RERANK_MODEL,
+        "candidates": RERANK_CANDIDATES,
+        "gap": RERANK_GAP,
+        "min_score": RERANK_MIN_SCORE,
+    }
+
+
+def is_ambiguous(scores, idxs, gap: float = RERANK_GAP, min_score: float = RERANK_MIN_SCORE) -> bool:
+    """Top-k dense ambigu: top1 faible ou top1 / top2 trop proches."""
+    valid = [float(s) for s, i in zip(scores, idxs) if i >= 0]
+    if not valid:
+        return False
+    if valid[0] < min_score:
+        return True
+    return len(valid) > 1 and valid[0] - valid[1] < gap
+
+
+class Reranker:
+    def __init__(self, model_name: str = RERANK_MODEL, max_entries: int = RERANK_CACHE_ENTRIES,
+                 batch_size: int = RERANK_BATCH_SIZE, always: bool = False):
+        self.model_name = model_name
+        self.always = always  # benchmark: rerank de tous les messages, ambigus ou non
+        self.max_entries = int(max_entries)
+        self.batch_size = int(batch_size)
+        self._model = None
+        self._scores: OrderedDict[tuple[str, int], float] = OrderedDict()
+        self.namespace: str | None = None
+        self.load_seconds = 0.0
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.nb_seen = 0
+        self.nb_fired = 0
+        self.nb_pairs = 0
+        self.nb_pair_hits = 0
+        self.seconds = 0.0
+
+    def _load(self):
+        if self._model is None:
+            t0 = time.perf_counter()
+            from sentence_transformers import CrossEncoder
+
+            self._model = CrossEncoder(self.model_name, device="cpu")
+            self.load_seconds = time.perf_counter() - t0
+        return self._model
+
+    def bind(self, namespace: str) -> None:
+        """Ids de chunks valables pour une version de l'index seulement."""
+        if namespace != self.namespace:
+            self._scores.clear()
+            self.namespace = namespace
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        return hashlib.blake2b(query.encode("utf-8"), digest_size=12).hexdigest()
+
+    def rerank(self, queries: list[str], candidates: list[list[int]], store, top_k: int,
+               nb_seen: int = 0) -> list[tuple[list[int], list[float]]]:
+        """
+        queries[j] + ids candidats[j] -> (top_k ids, scores cross-encoder) par requête.
+        nb_seen: messages examinés (déclenchés ou non) pour le taux de déclenchement.
+        """
+        self.nb_seen += nb_seen
+        if not queries:
+            return []
+        t0 = time.perf_counter()
+        self.nb_fired += len(queries)
+
+        qkeys = [self.query_key(q) for q in queries]
+        scores: dict[tuple[str, int], float] = {}
+        todo: dict[tuple[str, int], tuple[str, str]] = {}
+        for q, qk, ids in zip(queries, qkeys, candidates):
+            for i in ids:
+                key = (qk, int(i))
+                if key in self._scores:
+                    self.nb_pair_hits += 1
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+                elif key not in todo:
+                    todo[key] = (q, chunk_body(store.text(int(i))))
+        if todo:
+            # toutes les paires du batch en un seul predict (mini-batches du modèle)
+            pred = self._load().predict(list(todo.values()), batch_size=self.batch_size, show_progress_bar=False)
+            for key, score in zip(todo, np.asarray(pred, dtype=np.float32).reshape(-1).tolist()):
+                scores[key] = self._scores[key] = score
+            self.nb_pairs += len(todo)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+        out = []
+        for qk, ids in zip(qkeys, candidates):
+            ranked = sorted(((int(i), scores[(qk, int(i))]) for i in ids), key=lambda x: -x[1])[:top_k]
+            out.append(([i for i, _ in ranked], [round(s, 6) for _, s in ranked]))
+        self.seconds += time.perf_counter() - t0
+        return out
+
+    def stats_line(self) -> str:
+        rate = 100.0 * self.nb_fired / self.nb_seen if self.nb_seen else 0.0
+        per_fired = 1000.0 * self.seconds / self.nb_fired if self.nb_fired else 0.0
+        per_seen = 1000.0 * self.seconds / self.nb_seen if self.nb_seen else 0.0
+        total = self.nb_pairs + self.nb_pair_hits
+        hit = 100.0 * self.nb_pair_hits / total if total else 0.0
+        return (
+            f"rerank: déclenché {self.nb_fired}/{self.nb_seen} ({rate:.1f}%) | paires scorées={self.nb_pairs} "
+            f"cache={hit:.1f}% | +{per_fired:.1f}ms/message reranké, +{per_seen:.2f}ms/message en moyenne"
+        )
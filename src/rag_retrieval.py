@@ -0,0 +1,595 @@
+# src/rag_retrieval.py
+"""
+Logique de retrieval partagée (07, benchmarks).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import faiss
+import numpy as np
+
+import rag_store
+from rag_context import CONTEXT_MODE, pack_context
+from rag_lexical import BM25Index, rrf_fuse
+from rag_rerank import RERANK_CANDIDATES, Reranker, is_ambiguous
+
+
+def safe_top_k(requested_k: int, nb_chunks: int) -> int:
+    """Empêche k > nb_chunks (sinon FAISS renvoie des résultats invalides)."""
+    if nb_chunks <= 0:
+        return 0
+    return max(1, min(int(requested_k), int(nb_chunks)))
+
+
+def rewrite_query_from_row(text: str, urgency_level: str, category: str) -> str:
+    """
+    Query rewrite simple:
+    - préfixe par niveau + catégorie pour guider l'embedding
+    - format E5 recommandé: "query: ..."
+    """
+    q = (text or "").strip()
+    if not q:
+        return q
+
+    prefix = []
+    if urgency_level == "P0":
+        prefix.append("urgence critique P0")
+    elif urgency_level == "P1":
+        prefix.append("urgence P1")
+    elif urgency_level == "P2":
+        prefix.append("non urgent P2")
+    else:
+        prefix.append("administratif P3")
+
+    if category:
+        prefix.append(f"procedure {category}")
+
+    return "query: " + " ".join(prefix + [q])
+
+
+def row_fields(row) -> tuple[str, str, str]:
+    """(text, urgency, category) d'une ligne messages_rules (fallback priority_rules si urgency_level absent)."""
+    text = str(row.get("text_clean", "") or "").strip()
+
+    urgency = str(row.get("urgency_level", "") or "").strip()
+    if not urgency:
+        urgency = str(row.get("priority_rules", "") or "P3").strip()
+
+    category = str(row.get("category", "") or "").strip()
+    return text, urgency, category
+
+
+# =========================
+# Docs forcés + métadonnées
+# =========================
+# Docs "procédures" à forcer selon niveau
+FORCED_DOC_BY_LEVEL = {
+    "P0": "data/docs/procedures_p0.md",
+    "P1": "data/docs/procedures_p1.md",
+    "P2": "data/docs/procedures_p2.md",
+    "P3": "data/docs/procedures_p3.md",
+}
+FORCED_DOC_BY_CATEGORY = {
+    "admin": "data/docs/charges_et_quittances.md",
+    "reservation": "data/docs/reservation_salle_polyvalente.md",
+    "electricity": "data/docs/electricite_etincelles.md",
+    "elevator": "data/docs/ascenseur_panne.md",
+}
+
+# Docs propres à une résidence: data/docs/residences/<residence_id>/...
+RESIDENCE_DOCS_DIR = "data/docs/residences/"
+
+
+def doc_residence(doc: str) -> str | None:
+    if not doc.startswith(RESIDENCE_DOCS_DIR):
+        return None
+    rest = doc[len(RESIDENCE_DOCS_DIR):]
+    return rest.split("/", 1)[0] if "/" in rest else None
+
+
+class RagMetadata:
+    """
+    Mappings précalculés depuis le manifest (coût O(nb docs) au chargement):
+    doc -> ids de chunks, tags par doc (level / category / residence),
+    et IDSelector FAISS mis en cache par filtre -> aucun scan des sources par message.
+    """
+
+    def __init__(self, manifest: dict):
+        self.doc_chunk_ids: dict[str, np.ndarray] = {
+            doc: np.asarray(info["chunk_ids"], dtype=np.int64)
+            for doc, info in manifest.get("docs", {}).items()
+        }
+        level_by_doc = {d: lvl for lvl, d in FORCED_DOC_BY_LEVEL.items()}
+        category_by_doc = {d: cat for cat, d in FORCED_DOC_BY_CATEGORY.items()}
+        self.doc_tags = {
+            doc: {
+                "level": level_by_doc.get(doc),
+                "category": category_by_doc.get(doc),
+                "residence": doc_residence(doc),
+            }
+            for doc in self.doc_chunk_ids
+        }
+        # dédup: doublon -> canonique (seul présent dans l'index), canonique -> chunks fusionnés
+        self.duplicate_of = rag_store.duplicate_map(manifest)
+        self.merged: dict[int, list[int]] = {}
+        for dup, canon in self.duplicate_of.items():
+            self.merged.setdefault(canon, []).append(dup)
+        self._selectors: dict[tuple, faiss.IDSelector] = {}
+
+    def canonical(self, chunk_id: int) -> int:
+        return self.duplicate_of.get(int(chunk_id), int(chunk_id))
+
+    def provenance(self, chunk_id: int, store) -> list[str]:
+        """Sources représentées par un chunk de l'index: lui-même + quasi-doublons fusionnés."""
+        return [store.source(i) for i in [int(chunk_id), *sorted(self.merged.get(int(chunk_id), []))]]
+
+    def first_chunk(self, doc: str) -> int | None:
+        ids = self.doc_chunk_ids.get(doc)
+        return int(ids[0]) if ids is not None and len(ids) else None
+
+    def docs_for(self, docs=(), levels=(), categories=(), residences=()) -> list[str]:
+        """Union dans chaque dimension, intersection entre dimensions (dimension vide = pas de filtre)."""
+        out = []
+        for doc, tags in self.doc_tags.items():
+            if docs and doc not in docs:
+                continue
+            if levels and tags["level"] not in levels:
+                continue
+            if categories and tags["category"] not in categories:
+                continue
+            if residences and tags["residence"] not in residences:
+                continue
+            out.append(doc)
+        return out
+
+    def ids_for(self, **filters) -> np.ndarray:
+        """Ids indexés des docs filtrés (un doublon est remplacé par son canonique)."""
+        docs = self.docs_for(**filters)
+        if not docs:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.concatenate([self.doc_chunk_ids[d] for d in docs])
+        if self.duplicate_of:
+            ids = np.unique([self.canonical(i) for i in ids.tolist()]).astype(np.int64)
+        return ids
+
+    def selector(self, docs=(), levels=(), categories=(), residences=()) -> faiss.IDSelector:
+        key = (tuple(sorted(docs)), tuple(sorted(levels, key=str)),
+               tuple(sorted(categories, key=str)), tuple(sorted(residences, key=str)))
+        sel = self._selectors.get(key)
+        if sel is None:
+            ids = self.ids_for(docs=docs, levels=levels, categories=categories, residences=residences)
+            sel = faiss.IDSelectorBatch(ids)
+            self._selectors[key] = sel
+        return sel
+
+
+def force_docs_in_results(
+    picked_ids: list[int],
+    picked_scores: list[float],
+    forced: list[tuple[str | None, float]],
+    store,
+    pick_chunk: Callable[[str], int | None],
+) -> tuple[list[int], list[float]]:
+    """
+    Force des documents à apparaître dans les résultats, dans l'ordre de `forced`
+    [(doc, boost_score), ...]. Un doc déjà présent est gardé tel quel, sinon son
+    chunk (pick_chunk: 1er chunk ou meilleur chunk filtré) remplace le dernier résultat
+    qui n'est pas lui-même forcé (ajouté en fin si tous le sont, ex. top_k=1).
+    Coût: k lookups dans le chunk store, indépendant de la taille du corpus.
+    """
+    picked_ids = list(picked_ids)
+    picked_scores = list(picked_scores)
+    forced_pos: set[int] = set()
+    for target_doc, boost_score in forced:
+        if not target_doc:
+            continue
+
+        # Déjà présent ?
+        present = [p for p, i in enumerate(picked_ids) if store.doc(i) == target_doc]
+        if present:
+            forced_pos.add(present[0])
+            continue
+
+        forced_id = pick_chunk(target_doc)
+        if forced_id is None:
+            continue
+
+        # Remplacer le dernier résultat (le moins bon) non forcé par le doc forcé:
+        # le doc de catégorie n'écrase pas la procédure du niveau
+        free = [p for p in range(len(picked_ids)) if p not in forced_pos]
+        if not free:
+            picked_ids.append(forced_id)
+            picked_scores.append(boost_score)
+            forced_pos.add(len(picked_ids) - 1)
+            continue
+        picked_ids[free[-1]] = forced_id
+        picked_scores[free[-1]] = boost_score
+        forced_pos.add(free[-1])
+    return picked_ids, picked_scores
+
+
+def forced_docs(urgency: str, category: str) -> list[tuple[str | None, float]]:
+    """✅ Doc de procédures du niveau (P0/P1/P2/P3) puis doc de la CATÉGORIE, avec leur score forcé."""
+    return [
+        (FORCED_DOC_BY_LEVEL.get(urgency), 1.2),
+        (FORCED_DOC_BY_CATEGORY.get(category), 1.3),
+    ]
+
+
+def build_context_text(picked_ids: list[int], store, sep: str = "\n\n---\n\n") -> str:
+    parts = []
+    for i in picked_ids:
+        chunk = store.text(i)
+        if chunk:
+            parts.append(chunk)
+    return sep.join(parts).strip()
+
+
+# =========================
+# Retrieval de messages (07, serveur, benchmarks)
+# =========================
+def search_batch(index, q_emb: np.ndarray, top_k: int, residences: list[str], meta: RagMetadata,
+                 residence_filter: bool = False):
+    """
+    Top-k de toutes les requêtes du batch: 1 index.search(Q, k) (chemin BLAS multi-requêtes),
+    ou 1 recherche filtrée par résidence (docs communs + docs de la résidence).
+    """
+    if not residence_filter:
+        return index.search(q_emb, top_k)
+
+    scores = np.zeros((len(q_emb), top_k), dtype=np.float32)
+    idxs = np.full((len(q_emb), top_k), -1, dtype=np.int64)
+    by_residence: dict[str, list[int]] = {}
+    for j, residence in enumerate(residences):
+        by_residence.setdefault(residence, []).append(j)
+    for residence, pos in by_residence.items():
+        if residence:
+            sel = meta.selector(residences=(None, residence))
+            scores[pos], idxs[pos] = rag_store.filtered_search(index, q_emb[pos], top_k, sel)
+        else:
+            scores[pos], idxs[pos] = index.search(q_emb[pos], top_k)
+    return scores, idxs
+
+
+# =========================
+# Routage hybride (RAG_ROUTING=hybrid)
+# =========================
+# Voie "rules" (docs forcés + BM25, sans encodeur): allowlist explicite des décisions sûres,
+# category_match -> (catégorie dont le doc est forcé, rule_match admis). DEFAULT / *_KEYWORD
+# génériques, catégories sans doc forcé et tout le reste -> dense.
+RULES_LANE_ALLOWLIST = {
+    "CAT_ELEVATOR": ("elevator", {"P0_ELEVATOR_TRAPPED"}),
+    "CAT_ELECTRICITY": ("electricity", {"P1_ELECTRIC_SPARKS"}),
+    "CAT_ADMIN": ("admin", {"P3_KEYWORD"}),  # niveau P3 et catégorie admin décidés par deux règles
+}
+
+
+def _cell(row, col: str) -> str:
+    v = row.get(col, "")
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return ""
+    return str(v).strip()
+
+
+def route_row(row) -> str:
+    """
+    "rules": (category_match, rule_match) dans RULES_LANE_ALLOWLIST, catégorie avec doc forcé
+    et pas de 2e sujet -> docs forcés (métadonnées) + BM25, sans encodeur.
+    "dense": tout le reste -> recherche dense fusionnée (RRF) avec BM25.
+    """
+    allowed = RULES_LANE_ALLOWLIST.get(_cell(row, "category_match"))
+    if (
+        allowed is None
+        or _cell(row, "secondary_category")
+        or _cell(row, "rule_match") not in allowed[1]
+        or _cell(row, "category") != allowed[0]
+        or allowed[0] not in FORCED_DOC_BY_CATEGORY
+    ):
+        return "dense"
+    return "rules"
+
+
+def score_kind(route: str, hybrid: bool) -> str:
+    """
+    Échelle de rag_scores (colonne rag_score_kind): "cosine" (dense, reranké ou non),
+    "rrf" (dense + BM25 fusionnés), "bm25" (chemin "rules", normalisé par le 1er).
+    Docs forcés: 1.2 / 1.3 quelle que soit l'échelle.
+    """
+    if route == "rules":
+        return "bm25"
+    return "rrf" if hybrid else "cosine"
+
+
+def lexical_index(manifest: dict, store) -> BM25Index:
+    """BM25 sur les chunks indexés (canoniques après dédup), comme l'index FAISS."""
+    return BM25Index([(i, store.text(i)) for i in rag_store.indexed_chunk_ids(manifest)])
+
+
+def _lexical_candidates(meta: RagMetadata, residence: str, residence_filter: bool):
+    return meta.ids_for(residences=(None, residence)) if residence_filter and residence else None
+
+
+def lexical_ranking(text: str, candidates, lexical: BM25Index, top_k: int) -> tuple[list[int], list[float]]:
+    """Top-k BM25, scores normalisés par le 1er."""
+    ids, scores = lexical.search(text, top_k, candidates)
+    if scores:
+        scores = [round(sc / scores[0], 6) for sc in scores]
+    return ids, scores
+
+
+def pick_row_lexical(text: str, urgency: str, category: str, candidates, lexical: BM25Index, store,
+                     meta: RagMetadata, top_k: int, forced_chunk: str = "first",
+                     ranking: tuple[list[int], list[float]] | None = None) -> tuple[list[int], list[float]]:
+    """Chemin "rules": top-k BM25 (ranking si déjà calculé) + docs forcés, sans encodeur."""
+    ids, scores = ranking if ranking is not None else lexical_ranking(text, candidates, lexical, top_k)
+
+    if forced_chunk == "best":
+        def pick_chunk(doc: str):
+            best, _ = lexical.search(text, 1, meta.ids_for(docs=(doc,)))
+            return best[0] if best else meta.first_chunk(doc)
+    else:
+        pick_chunk = meta.first_chunk
+
+    return force_docs_in_results(ids, scores, forced=forced_docs(urgency, category), store=store,
+                                 pick_chunk=pick_chunk)
+
+
+class QueryResultCache:
+    """
+    Cache LRU des résultats de retrieval: (requête réécrite, niveau, catégorie, résidence)
+    -> (ids de chunks, scores) après docs forcés. Les sources / le contexte sont relus
+    dans le chunk store, donc les ids ne valent que pour une version de l'index:
+    bind(namespace) avec namespace = version + réglages de recherche; tout changement
+    de namespace vide le cache. Persistance optionnelle (JSON) entre deux runs.
+    """
+
+    def __init__(self, max_entries: int = 50000, path: Path | None = None):
+        self.max_entries = int(max_entries)
+        self.path = Path(path) if path else None
+        self.namespace: str | None = None
+        self._entries: OrderedDict[str, tuple[list[int], list[float]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._load()
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        self.namespace = data.get("namespace")
+        for key, ids, scores in data.get("entries", [])[-self.max_entries:]:
+            self._entries[key] = (ids, scores)
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        data = {"namespace": self.namespace, "entries": [[k, ids, sc] for k, (ids, sc) in self._entries.items()]}
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+
+    def bind(self, namespace: str) -> None:
+        """Nouvelle version d'index / autres réglages -> résultats en cache invalides."""
+        if namespace != self.namespace:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.namespace = namespace
+
+    @staticmethod
+    def key(query: str, urgency: str, category: str, residence: str, route: str = "") -> str:
+        raw = "\x1f".join((query, urgency, category, residence, route))
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> tuple[list[int], list[float]] | None:
+        hit = self._entries.get(key)
+        if hit is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return hit
+
+    def put(self, key: str, ids: list[int], scores: list[float]) -> None:
+        self._entries[key] = (list(ids), list(scores))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats_line(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (
+            f"cache résultats: hits={self.hits} misses={self.misses} hit_rate={rate:.1f}% "
+            f"entries={len(self._entries)} invalidations={self.invalidations}"
+        )
+
+
+def retrieve_batch(rows: list, encoder, index, store, meta: RagMetadata, top_k: int,
+                   forced_chunk: str = "first", residence_filter: bool = False,
+                   cache: QueryResultCache | None = None, lexical: BM25Index | None = None,
+                   route_counts: Counter | None = None,
+                   reranker: Reranker | None = None,
+                   trace: dict | None = None) -> list[tuple[str, str, str, str]]:
+    """
+    Retrieval de messages (lignes messages_rules) -> [(rag_sources, rag_scores, rag_context, rag_score_kind)]
+    sérialisés pour le CSV. Requêtes réécrites encodées en une fois (mini-batches du
+    backend, triés par longueur) + recherche groupée, puis docs forcés / contexte par message.
+    cache: les messages déjà vus (même requête réécrite) ne sont ni encodés ni recherchés.
+    lexical: routage hybride (route_row): chemin "rules" sans encodeur, sinon dense + BM25 fusionnés (RRF).
+    route_counts: compteur des messages par chemin (stats).
+    reranker: recherche élargie à RERANK_CANDIDATES, cross-encoder sur les seuls top-k ambigus
+    (tous si reranker.always); il réordonne, les scores restent les cosinus du dense.
+    trace: benchmarks (06_test_retrieval) -> "ranked" {position: ids classés avant docs forcés,
+    absents pour les hits du cache} et "seconds" {étape: durée cumulée}.
+    """
+    if not rows:
+        return []
+    ranked: dict[int, list[int]] = {}
+    seconds: Counter = Counter()
+    if trace is not None:
+        trace.update(ranked=ranked, seconds=seconds)
+    fields = [row_fields(row) for row in rows]  # ✅ fallback: priority_rules si urgency_level absent
+    queries = [rewrite_query_from_row(text, urgency_level=u, category=c) for text, u, c in fields]
+    residences = [str(row.get("residence_id", "") or "").strip() for row in rows]
+    routes = [route_row(row) if lexical is not None else "dense" for row in rows]
+    if route_counts is not None:
+        route_counts.update(routes)
+
+    picked: list[tuple[list[int], list[float]] | None] = [None] * len(rows)
+    keys = [
+        QueryResultCache.key(q, u, c, r if residence_filter else "", route if lexical is not None else "")
+        for q, (_, u, c), r, route in zip(queries, fields, residences, routes)
+    ]
+    if cache is not None:
+        picked = [cache.get(k) for k in keys]
+
+    # misses dédupliqués dans le batch: 1 encode + 1 search par requête distincte
+    first_by_key: dict[str, int] = {}
+    for j, hit in enumerate(picked):
+        if hit is None:
+            first_by_key.setdefault(keys[j], j)
+    if first_by_key:
+        by_key = {}
+        todo = [j for j in first_by_key.values() if routes[j] == "dense"]
+        t0 = time.perf_counter()
+        for j in first_by_key.values():
+            if routes[j] == "rules":
+                text, urgency, category = fields[j]
+                cand = _lexical_candidates(meta, residences[j], residence_filter)
+                ranking = lexical_ranking(text, cand, lexical, top_k)
+                ranked[j] = ranking[0]
+                by_key[keys[j]] = pick_row_lexical(text, urgency, category, cand, lexical, store, meta, top_k,
+                                                   forced_chunk, ranking=ranking)
+        seconds["lexical"] += time.perf_counter() - t0
+        if todo:
+            t0 = time.perf_counter()
+            q_emb = encoder.encode([queries[j] for j in todo])
+            t1 = time.perf_counter()
+            nb_search = max(top_k, min(RERANK_CANDIDATES, index.ntotal)) if reranker is not None else top_k
+            scores, idxs = search_batch(index, q_emb, nb_search, [residences[j] for j in todo], meta, residence_filter)
+            t2 = time.perf_counter()
+            seconds["encode"] += t1 - t0
+            seconds["search"] += t2 - t1
+            reranked = {}
+            if reranker is not None:
+                fire = [n for n in range(len(todo))
+                        if reranker.always or is_ambiguous(scores[n][:top_k], idxs[n][:top_k])]
+                reranked = dict(zip(fire, reranker.rerank(
+                    [fields[todo[n]][0] for n in fire], [[int(i) for i in idxs[n] if i >= 0] for n in fire],
+                    store, top_k, nb_seen=len(todo),
+                )))
+                seconds["rerank"] += time.perf_counter() - t2
+            for n, j in enumerate(todo):
+                text, urgency, category = fields[j]
+                if n in reranked:
+                    # le cross-encoder ne fait que l'ordre: scores cosinus du dense gardés
+                    # (logits non bornés, hors échelle de rag_scores / du seuil de pack_context)
+                    cosine = {int(i): float(sc) for sc, i in zip(scores[n], idxs[n])}
+                    row_idxs = reranked[n][0]
+                    row_scores = [cosine[i] for i in row_idxs]
+                    dense_ranking = row_idxs
+                else:
+                    row_scores, row_idxs = scores[n][:top_k], idxs[n][:top_k]
+                    dense_ranking = [int(i) for i in idxs[n]]
+                if lexical is not None:
+                    # RRF sur le classement dense final (reranké s'il y a eu rerank) + BM25
+                    t0 = time.perf_counter()
+                    lex_ids, _ = lexical.search(text, top_k, _lexical_candidates(meta, residences[j], residence_filter))
+                    row_idxs, row_scores = rrf_fuse([dense_ranking, lex_ids], top_k)
+                    seconds["lexical"] += time.perf_counter() - t0
+                ranked[j] = [int(i) for i in row_idxs]
+                by_key[keys[j]] = pick_row(q_emb[n:n + 1], row_scores, row_idxs, urgency, category,
+                                           index, store, meta, forced_chunk)
+        if cache is not None:
+            for key, hit in by_key.items():
+                cache.put(key, *hit)
+        picked = [hit if hit is not None else by_key[keys[j]] for j, hit in enumerate(picked)]
+
+    return [
+        serialize_row(ids, sc, store, meta, keep_docs=[d for d, _ in forced_docs(u, c) if d],
+                      score_kind=score_kind(route, lexical is not None))
+        for (ids, sc), (_, u, c), route in zip(picked, fields, routes)
+    ]
+
+
+def retrieve_row(row, encoder, index, store, meta: RagMetadata, top_k: int,
+                 forced_chunk: str = "first", residence_filter: bool = False) -> tuple[str, str, str, str]:
+    """Retrieval d'un seul message (1 encode + 1 search): chemin historique, référence de 07_bench_retrieval."""
+    # ✅ fallback: priority_rules si urgency_level absent
+    text, urgency, category = row_fields(row)
+
+    query = rewrite_query_from_row(text, urgency_level=urgency, category=category)
+    q_emb = encoder.encode([query])
+
+    residence = str(row.get("residence_id", "") or "").strip()
+    if residence_filter and residence:
+        sel = meta.selector(residences=(None, residence))
+        scores, idxs = rag_store.filtered_search(index, q_emb, top_k, sel)
+    else:
+        scores, idxs = index.search(q_emb, top_k)
+    ids, sc = pick_row(q_emb, scores[0], idxs[0], urgency, category, index, store, meta, forced_chunk)
+    return serialize_row(ids, sc, store, meta, keep_docs=[d for d, _ in forced_docs(urgency, category) if d])
+
+
+def pick_row(q_emb, scores, idxs, urgency: str, category: str, index, store, meta: RagMetadata,
+             forced_chunk: str = "first") -> tuple[list[int], list[float]]:
+    """Résultats FAISS d'un message -> (ids, scores) après docs forcés."""
+    picked_ids = []
+    picked_scores = []
+
+    for score, i in zip(scores, idxs):
+        if i < 0 or i not in store:
+            continue
+        picked_ids.append(int(i))
+        picked_scores.append(float(score))
+
+    if forced_chunk == "best":
+        def pick_chunk(doc: str):
+            _, ids = rag_store.filtered_search(index, q_emb, 1, meta.selector(docs=(doc,)))
+            return int(ids[0][0]) if ids[0][0] >= 0 else None
+    else:
+        pick_chunk = meta.first_chunk
+
+    return force_docs_in_results(
+        picked_ids,
+        picked_scores,
+        forced=forced_docs(urgency, category),
+        store=store,
+        pick_chunk=pick_chunk,
+    )
+
+
+def serialize_row(picked_ids: list[int], picked_scores: list[float], store, meta: RagMetadata | None = None,
+                  keep_docs: list[str] = (), score_kind: str = "cosine") -> tuple[str, str, str, str]:
+    """
+    (ids, scores) -> (rag_sources, rag_scores, rag_context, rag_score_kind) pour le CSV.
+    keep_docs: docs forcés du message; score_kind: échelle des scores (voir score_kind()).
+    """
+    picked_sources = [store.source(i) for i in picked_ids]
+    if CONTEXT_MODE == "packed":
+        # budget de tokens du générateur, procédures forcées gardées en tête (rag_context)
+        context = pack_context(picked_ids, picked_scores, store, keep_docs=list(keep_docs),
+                               doc_chunks=meta.doc_chunk_ids.get if meta is not None else None,
+                               score_kind=score_kind)
+    else:
+        context = build_context_text(picked_ids, store)
+
+    return (
+        json.dumps(picked_sources, ensure_ascii=False),
+        json.dumps(picked_scores, ensure_ascii=False),
+        context,
+        score_kind,
+    )
@@ -0,0 +1,319 @@
+# src/rag_service.py
+"""
+Service de retrieval "chaud": encodeur + index (mmap) + chunk store chargés une fois.
+
+- RetrievalService : retrieval de lignes messages (text_clean, urgency_level /
+  priority_rules, category, residence_id) -> (rag_sources, rag_scores, rag_context, rag_score_kind),
+  même sortie que 07. Bascule sur une nouvelle version d'index avant chaque batch.
+  RAG_ROUTING=hybrid: routage règles / dense (rag_retrieval.route_row) + BM25 (rag_lexical).
+- Coalescer        : regroupe les requêtes concurrentes en un seul batch
+  (1 encodage + 1 index.search) dans un thread unique (encodeur / index non partagés).
+- RetrievalClient  : client HTTP du serveur 07_rag_server.py.
+- connect()        : client si le serveur répond, sinon service local (même résultat).
+"""
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+import rag_store
+from embeddings import embedding_profile, load_encoder
+from rag_rerank import RERANK_ENABLED, Reranker, rerank_config
+from rag_retrieval import QueryResultCache, RagMetadata, lexical_index, retrieve_batch, safe_top_k
+
+MODEL_NAME = embedding_profile()["model"]
+REQUESTED_TOP_K = 5
+
+# Chunk injecté pour un doc forcé: "first" = 1er chunk du doc (historique),
+# "best" = meilleur chunk du doc pour la requête (recherche filtrée IDSelector)
+FORCED_CHUNK_MODE = os.getenv("RAG_FORCED_CHUNK", "first").strip().lower()
+# 1 = ne chercher que dans les docs communs + docs de la résidence du message
+RESIDENCE_FILTER = os.getenv("RAG_RESIDENCE_FILTER", "0").strip() == "1"
+# messages par batch: encodage groupé + 1 index.search, version de l'index vérifiée entre deux batches
+BATCH_ROWS = int(os.getenv("RAG_BATCH_ROWS", "256"))
+# taille des mini-batches du modèle (triés par longueur par le backend -> peu de padding)
+QUERY_BATCH_SIZE = int(os.getenv("RAG_QUERY_BATCH", "64"))
+# cache des résultats (messages répétés -> ni encodage ni recherche), persistance disque optionnelle
+QCACHE_ENABLED = os.getenv("RAG_QCACHE", "1").strip() not in {"0", "false", "no"}
+QCACHE_MAX_ENTRIES = int(os.getenv("RAG_QCACHE_MAX_ENTRIES", "50000"))
+QCACHE_PERSIST = os.getenv("RAG_QCACHE_PERSIST", "0").strip() == "1"
+
+# "dense" = recherche dense pour tous les messages (historique);
+# "hybrid" = règles sûres -> docs forcés + BM25 sans encodeur, messages ambigus -> dense + BM25 (RRF)
+ROUTING = os.getenv("RAG_ROUTING", "dense").strip().lower()
+
+# serveur: URL du client (vide = service local) et fenêtre de regroupement des requêtes
+SERVER_URL = os.getenv("RAG_SERVER_URL", "http://127.0.0.1:8765").strip()
+COALESCE_MS = float(os.getenv("RAG_COALESCE_MS", "5"))
+# cache d'embeddings écrit sur disque tous les N batches ou toutes les N secondes (serveur longue durée)
+FLUSH_BATCHES = int(os.getenv("RAG_FLUSH_BATCHES", "50"))
+FLUSH_SEC = float(os.getenv("RAG_FLUSH_SEC", "60"))
+
+# colonnes utilisées par le retrieval (envoyées par le client)
+ROW_FIELDS = ("text_clean", "urgency_level", "priority_rules", "category", "residence_id",
+              "category_match", "rule_match", "secondary_category")
+
+
+class RetrievalService:
+    def __init__(self, base_dir: Path):
+        base_dir = Path(base_dir)
+        # --- embedding model (+ cache disque partagé avec 06_*), backend via EMB_BACKEND
+        self.encoder = load_encoder(MODEL_NAME, base_dir, batch_size=QUERY_BATCH_SIZE)
+
+        # --- rag store: version courante (CURRENT), index en mmap; search renvoie des ids de chunks
+        # RAG_EF_SEARCH / RAG_NPROBE surchargent les paramètres stockés avec l'index (HNSW / IVF)
+        self.knobs = rag_store.search_knobs_from_env()
+        self.reader = rag_store.StoreReader(
+            base_dir / "cleanData" / "rag", model_id=self.encoder.model_id, **self.knobs
+        )
+
+        self.cache = None
+        if QCACHE_ENABLED:
+            cache_path = base_dir / "cleanData" / "query_cache" / "results.json" if QCACHE_PERSIST else None
+            self.cache = QueryResultCache(QCACHE_MAX_ENTRIES, path=cache_path)
+
+        self.version = None
+        self.meta: RagMetadata | None = None
+        self.top_k = 0
+        self.lexical = None
+        # rerank cross-encoder conditionnel (RAG_RERANK=1): seulement les top-k denses ambigus
+        self.reranker = Reranker() if RERANK_ENABLED else None
+        self.route_counts: Counter = Counter()
+        self.retrieve_seconds = 0.0
+        self.nb_rows = 0
+        self.nb_flushes = 0
+        self._batches_since_flush = 0
+        self._last_flush = time.perf_counter()
+        self._sync_version()
+
+    def _sync_version(self) -> None:
+        """Nouveau build publié par 06 -> bascule avant le batch, sans redémarrer."""
+        self.reader.refresh()
+        if self.reader.version == self.version and self.meta is not None:
+            return
+        self.version = self.reader.version
+        # doc -> chunk ids + selectors FAISS (pas de scan des sources par message)
+        self.meta = RagMetadata(self.reader.manifest)
+        self.top_k = safe_top_k(REQUESTED_TOP_K, self.reader.index.ntotal)
+        if ROUTING == "hybrid":
+            self.lexical = lexical_index(self.reader.manifest, self.reader.store)
+        if self.reranker is not None:
+            self.reranker.bind(self.version)
+        if self.cache is not None:
+            # résultats valables pour cette version + ces réglages seulement
+            self.cache.bind(
+                f"{self.version}|{self.encoder.model_id}|k={self.top_k}|ef={self.knobs['ef_search']}"
+                f"|nprobe={self.knobs['nprobe']}|forced={FORCED_CHUNK_MODE}|residence={int(RESIDENCE_FILTER)}"
+                f"|routing={ROUTING}|rerank={rerank_config() if RERANK_ENABLED else 0}"
+            )
+
+    def retrieve(self, rows: list) -> list[tuple[str, str, str, str]]:
+        out = []
+        t0 = time.perf_counter()
+        for b in range(0, len(rows), BATCH_ROWS):
+            self._sync_version()
+            out.extend(retrieve_batch(
+                rows[b:b + BATCH_ROWS], self.encoder, self.reader.index, self.reader.store, self.meta, self.top_k,
+                forced_chunk=FORCED_CHUNK_MODE, residence_filter=RESIDENCE_FILTER, cache=self.cache,
+                lexical=self.lexical, route_counts=self.route_counts, reranker=self.reranker,
+            ))
+            self._batches_since_flush += 1
+        self.retrieve_seconds += time.perf_counter() - t0
+        self.nb_rows += len(rows)
+        self.maybe_flush()
+        return out
+
+    def maybe_flush(self, force: bool = False) -> bool:
+        """
+        Écrit le cache d'embeddings (nouvelles entrées + éviction) tous les FLUSH_BATCHES
+        batches ou FLUSH_SEC secondes: mémoire bornée et rien de perdu si le process meurt.
+        À appeler depuis le thread qui fait les retrieve (encodeur non partagé).
+        """
+        if not self._batches_since_flush:
+            return False
+        due = (
+            self._batches_since_flush >= FLUSH_BATCHES
+            or time.perf_counter() - self._last_flush >= FLUSH_SEC
+        )
+        if not (force or due):
+            return False
+        self.encoder.flush()
+        self.nb_flushes += 1
+        self._batches_since_flush = 0
+        self._last_flush = time.perf_counter()
+        return True
+
+    def info(self) -> dict:
+        return {
+            "version": self.reader.version,
+            "ntotal": int(self.reader.index.ntotal),
+            "top_k": self.top_k,
+            "reloads": self.reader.nb_reloads,
+            "model": self.encoder.model_id,
+            "rows": self.nb_rows,
+            "routing": ROUTING,
+            "routes": dict(self.route_counts),
+            "cache_flushes": self.nb_flushes,
+        }
+
+    def routing_line(self) -> str:
+        total = sum(self.route_counts.values())
+        parts = " ".join(
+            f"{route}={n} ({100.0 * n / total:.1f}%)" for route, n in sorted(self.route_counts.items())
+        ) if total else "-"
+        rate = self.nb_rows / max(self.retrieve_seconds, 1e-9)
+        return f"routage {ROUTING}: {parts} | {rate:.1f} messages/s"
+
+    def stats_lines(self) -> list[str]:
+        lines = [self.encoder.stats_line(), self.routing_line()]
+        if self.reranker is not None:
+            lines.append(self.reranker.stats_line())
+        if self.cache is not None:
+            lines.append(self.cache.stats_line())
+        return lines
+
+    def close(self) -> None:
+        self.encoder.flush()
+        if self.cache is not None:
+            self.cache.save()
+        self.reader.close()
+
+
+class Coalescer:
+    """
+    File de requêtes traitée par un seul thread: les requêtes arrivées pendant
+    max_wait_ms (ou jusqu'à max_rows lignes) sont fusionnées en un batch.
+    idle_fn: appelé dans ce même thread après idle_sec sans requête (flush du cache).
+    """
+
+    def __init__(self, fn, max_rows: int = BATCH_ROWS, max_wait_ms: float = COALESCE_MS,
+                 idle_fn=None, idle_sec: float = FLUSH_SEC):
+        self.fn = fn
+        self.idle_fn = idle_fn
+        self.idle_sec = max(0.1, float(idle_sec))
+        self.max_rows = int(max_rows)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: queue.Queue = queue.Queue()
+        self.nb_requests = 0
+        self.nb_batches = 0
+        self.nb_rows = 0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, rows: list) -> list:
+        job = {"rows": rows, "done": threading.Event(), "result": None, "error": None}
+        self._queue.put(job)
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                jobs = [self._queue.get(timeout=self.idle_sec if self.idle_fn else None)]
+            except queue.Empty:
+                try:
+                    self.idle_fn()
+                except Exception as e:
+                    print(f"⚠️ Coalescer: tâche de fond en échec ({e})")
+                continue
+            nb = len(jobs[0]["rows"])
+            deadline = time.perf_counter() + self.max_wait
+            while nb < self.max_rows:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                nb += len(job["rows"])
+
+            rows = [r for job in jobs for r in job["rows"]]
+            try:
+                results = self.fn(rows)
+                pos = 0
+                for job in jobs:
+                    job["result"] = results[pos:pos + len(job["rows"])]
+                    pos += len(job["rows"])
+            except Exception as e:  # l'erreur est renvoyée à chaque appelant du batch
+                for job in jobs:
+                    job["error"] = e
+            self.nb_requests += len(jobs)
+            self.nb_batches += 1
+            self.nb_rows += len(rows)
+            for job in jobs:
+                job["done"].set()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.nb_requests,
+            "batches": self.nb_batches,
+            "rows": self.nb_rows,
+            "avg_rows_per_batch": round(self.nb_rows / self.nb_batches, 2) if self.nb_batches else 0.0,
+        }
+
+
+def row_payload(row) -> dict:
+    """Colonnes utiles d'une ligne (scalaires numpy -> Python, NaN conservés: même fallback qu'en local)."""
+    out = {}
+    for f in ROW_FIELDS:
+        v = row.get(f, "")
+        out[f] = v.item() if hasattr(v, "item") else v
+    return out
+
+
+class RetrievalClient:
+    def __init__(self, url: str = SERVER_URL, timeout: float = 120.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._info: dict = {}
+
+    def _post(self, path: str, payload: dict) -> dict:
+        req = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def health(self, timeout: float = 2.0) -> dict:
+        req = urllib.request.Request(self.url + "/health")
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            self._info = json.loads(resp.read().decode("utf-8"))
+        return self._info
+
+    def retrieve(self, rows: list) -> list[tuple[str, str, str, str]]:
+        out = self._post("/retrieve", {"rows": [row_payload(r) for r in rows]})
+        self._info = out.get("info", self._info)
+        return [tuple(r) for r in out["results"]]
+
+    def info(self) -> dict:
+        return self._info
+
+    def stats_lines(self) -> list[str]:
+        return [f"serveur {self.url}: " + json.dumps(self._info.get("stats", {}), ensure_ascii=False)]
+
+    def close(self) -> None:
+        pass
+
+
+def connect(base_dir: Path, url: str = SERVER_URL):
+    """Client du serveur chaud s'il répond, sinon service local (chargement complet)."""
+    if url:
+        client = RetrievalClient(url)
+        try:
+            client.health()
+            return client
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+    return RetrievalService(base_dir)
@@ -0,0 +1,652 @@
+# src/rag_store.py
+"""
+Store RAG partagé (index FAISS + chunk store + manifest).
+
+- Le manifest garde, pour chaque document, le hash du contenu et les ids FAISS
+  de ses chunks -> 06_build_rag_index ne ré-encode que les docs ajoutés/modifiés.
+- L'index est un IndexIDMap2 : les résultats de `index.search` sont des ids de
+  chunks (pas des positions).
+- Chunk store binaire (remplace chunks.txt/sources.txt, fragile sur "---"):
+    chunks.idx : header + table d'offsets indexée directement par id FAISS
+    chunks.bin : payload UTF-8 (textes, chemins doc, titres de section)
+  Les deux sont ouverts en mmap -> lookup O(1) par id, aucun parse au démarrage.
+- `build_id` (manifest + header du chunk store) garantit que index et chunks
+  viennent du même build.
+- Projection (PCA / troncature + renormalisation) et stockage fp16 / uint8
+  du profil d'embedding (embeddings.EMB_PROFILE) portés par l'index lui-même
+  (IndexPreTransform + ScalarQuantizer) -> 07 n'a rien à appliquer.
+- Type d'index configurable (RAG_INDEX_TYPE = flat | hnsw | ivf_flat | ivf_pq):
+  les paramètres résolus (nlist, M, PQ...) sont stockés dans manifest["index"],
+  efSearch/nprobe peuvent être surchargés au moment de la requête.
+- Dédup (rag_dedup.py): manifest["dedup"]["duplicate_of"] = {doublon: canonique};
+  les doublons restent dans le chunk store mais pas dans l'index.
+- Versions: chaque build écrit versions/<build_id>/ (index + chunk store + manifest),
+  puis publie la version en remplaçant atomiquement le pointeur CURRENT.
+  Un lecteur ne voit jamais un build à moitié écrit; l'index est ouvert en mmap
+  (pages partagées entre process) et StoreReader.refresh() bascule sur la
+  nouvelle version sans redémarrer.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import uuid
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+import faiss
+import numpy as np
+
+from embeddings import embedding_profile
+
+INDEX_NAME = "faiss.index"
+CHUNKS_IDX_NAME = "chunks.idx"
+CHUNKS_BIN_NAME = "chunks.bin"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+VERSIONS_DIR = "versions"
+CURRENT_NAME = "CURRENT"
+KEEP_VERSIONS = int(os.getenv("RAG_KEEP_VERSIONS", "3"))  # versions gardées (lecteurs encore ouverts)
+
+# anciens fichiers (texte, puis layout à plat avant les versions), supprimés au build suivant
+LEGACY_NAMES = ("chunks.txt", "sources.txt")
+FLAT_NAMES = (INDEX_NAME, CHUNKS_IDX_NAME, CHUNKS_BIN_NAME, MANIFEST_NAME)
+
+# lecture seule en mmap, flags selon le type d'index (cf. mmap_flags): listes inversées
+# IVF (MMAP) ou codes Flat/HNSW (MMAP_IFC); les deux ensemble font échouer read_index sur IVF
+MMAP_IFC = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+# header: magic, format, nb_slots, nb_chunks, build_id (32 hex)
+_HEADER = struct.Struct("<8sIQQ32s")
+_MAGIC = b"SYNDCHK1"
+_FORMAT = 1
+_RECORD = np.dtype([
+    ("text_off", "<u8"), ("text_len", "<u4"),
+    ("doc_off", "<u8"), ("doc_len", "<u4"),
+    ("sec_off", "<u8"), ("sec_len", "<u4"),
+    ("chunk_no", "<i4"),  # -1 = slot vide (id supprimé)
+])
+
+
+class ChunkRecord(NamedTuple):
+    text: str
+    doc: str
+    section: str
+    chunk_no: int
+
+
+def format_source(doc: str, section: str, chunk_no: int) -> str:
+    """Format historique des sources ("data/docs/x.md | ## Titre | chunk=0")."""
+    return f"{doc} | {section} | chunk={chunk_no}"
+
+
+def new_build_id() -> str:
+    return uuid.uuid4().hex
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def manifest_hash(manifest: dict) -> str:
+    """Hash du contenu du manifest hors build_id (deux builds du même corpus -> même hash)."""
+    body = {k: v for k, v in manifest.items() if k != "build_id"}
+    return sha256_text(json.dumps(body, ensure_ascii=False, sort_keys=True))
+
+
+# =========================
+# Versions (pointeur CURRENT)
+# =========================
+def current_version(rag_dir: Path) -> str | None:
+    path = Path(rag_dir) / CURRENT_NAME
+    try:
+        return path.read_text(encoding="ascii").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(rag_dir: Path, version: str | None = None) -> Path:
+    """
+    Dossier du build à lire: versions/<version> (courante par défaut).
+    Sans CURRENT (dossier de version explicite ou ancien layout à plat) -> rag_dir.
+    """
+    rag_dir = Path(rag_dir)
+    version = version or current_version(rag_dir)
+    return rag_dir / VERSIONS_DIR / version if version else rag_dir
+
+
+def publish_version(rag_dir: Path, version: str) -> None:
+    """Bascule atomique du pointeur (écriture .tmp + fsync + rename)."""
+    rag_dir = Path(rag_dir)
+    tmp = rag_dir / (CURRENT_NAME + ".tmp")
+    with open(tmp, "w", encoding="ascii") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    tmp.replace(rag_dir / CURRENT_NAME)
+
+
+def prune_versions(rag_dir: Path, keep: int = KEEP_VERSIONS) -> list[str]:
+    """Supprime les plus anciennes versions (jamais la courante). Un lecteur en mmap garde ses pages."""
+    root = Path(rag_dir) / VERSIONS_DIR
+    if not root.exists():
+        return []
+    current = current_version(rag_dir)
+    versions = sorted((p for p in root.iterdir() if p.is_dir()), key=lambda p: p.stat().st_mtime, reverse=True)
+    removed = []
+    for p in versions[max(1, keep):]:
+        if p.name != current:
+            shutil.rmtree(p, ignore_errors=True)
+            removed.append(p.name)
+    return removed
+
+
+# =========================
+# Manifest
+# =========================
+def empty_manifest(model_name: str, chunk_size: int, overlap: int) -> dict:
+    return {
+        "manifest_version": MANIFEST_VERSION,
+        "build_id": "",
+        "model": model_name,
+        "chunk_size": int(chunk_size),
+        "overlap": int(overlap),
+        "next_id": 0,
+        "index": {},
+        "dedup": {},
+        "docs": {},
+    }
+
+
+def load_manifest(rag_dir: Path) -> dict | None:
+    path = version_dir(rag_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    try:
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if manifest.get("manifest_version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(rag_dir: Path, manifest: dict) -> None:
+    path = Path(rag_dir) / MANIFEST_NAME
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+def manifest_chunk_ids(manifest: dict) -> list[int]:
+    """Ids des chunks, docs triés puis ordre des chunks dans le doc."""
+    ids = []
+    for rel in sorted(manifest.get("docs", {})):
+        ids.extend(int(i) for i in manifest["docs"][rel]["chunk_ids"])
+    return ids
+
+
+def duplicate_map(manifest: dict) -> dict[int, int]:
+    """{id doublon: id canonique} (vide si pas de dédup)."""
+    dup = manifest.get("dedup", {}).get("duplicate_of", {})
+    return {int(k): int(v) for k, v in dup.items()}
+
+
+def indexed_chunk_ids(manifest: dict) -> list[int]:
+    """Ids présents dans l'index FAISS (chunks canoniques)."""
+    dup = duplicate_map(manifest)
+    return [i for i in manifest_chunk_ids(manifest) if i not in dup]
+
+
+# =========================
+# Chunk store binaire
+# =========================
+class ChunkStore:
+    def __init__(self, rag_dir: Path):
+        rag_dir = version_dir(rag_dir)
+        idx_path = rag_dir / CHUNKS_IDX_NAME
+        bin_path = rag_dir / CHUNKS_BIN_NAME
+
+        with open(idx_path, "rb") as f:
+            magic, fmt, nb_slots, nb_chunks, build_id = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or fmt != _FORMAT:
+            raise ValueError(f"{idx_path.name}: format de chunk store inconnu")
+
+        self.build_id = build_id.decode("ascii")
+        self.nb_chunks = int(nb_chunks)
+        self._records = (
+            np.memmap(idx_path, dtype=_RECORD, mode="r", offset=_HEADER.size, shape=(nb_slots,))
+            if nb_slots else np.zeros(0, dtype=_RECORD)
+        )
+        self._bin_file = open(bin_path, "rb")
+        size = bin_path.stat().st_size
+        self._payload = mmap.mmap(self._bin_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return self.nb_chunks
+
+    def __contains__(self, chunk_id) -> bool:
+        i = int(chunk_id)
+        return 0 <= i < len(self._records) and int(self._records[i]["chunk_no"]) >= 0
+
+    def _str(self, off, length) -> str:
+        off, length = int(off), int(length)
+        return self._payload[off:off + length].decode("utf-8")
+
+    def text(self, chunk_id: int) -> str:
+        r = self._records[int(chunk_id)]
+        return self._str(r["text_off"], r["text_len"])
+
+    def doc(self, chunk_id: int) -> str:
+        r = self._records[int(chunk_id)]
+        return self._str(r["doc_off"], r["doc_len"])
+
+    def record(self, chunk_id: int) -> ChunkRecord:
+        r = self._records[int(chunk_id)]
+        return ChunkRecord(
+            text=self._str(r["text_off"], r["text_len"]),
+            doc=self._str(r["doc_off"], r["doc_len"]),
+            section=self._str(r["sec_off"], r["sec_len"]),
+            chunk_no=int(r["chunk_no"]),
+        )
+
+    def source(self, chunk_id: int) -> str:
+        r = self.record(chunk_id)
+        return format_source(r.doc, r.section, r.chunk_no)
+
+    def ids(self) -> np.ndarray:
+        return np.flatnonzero(self._records["chunk_no"] >= 0)
+
+    def close(self) -> None:
+        if isinstance(self._payload, mmap.mmap):
+            self._payload.close()
+        self._bin_file.close()
+
+
+def write_chunk_store(rag_dir: Path, build_id: str, records: Iterable[tuple[int, ChunkRecord]]) -> None:
+    """Écrit chunks.idx/chunks.bin (fichiers .tmp puis rename). Les chaînes répétées sont stockées une fois."""
+    rag_dir = Path(rag_dir)
+    payload = bytearray()
+    interned: dict[str, tuple[int, int]] = {}
+
+    def put(s: str) -> tuple[int, int]:
+        if s not in interned:
+            b = s.encode("utf-8")
+            interned[s] = (len(payload), len(b))
+            payload.extend(b)
+        return interned[s]
+
+    rows = {}
+    for chunk_id, rec in records:
+        rows[int(chunk_id)] = (put(rec.text), put(rec.doc), put(rec.section), int(rec.chunk_no))
+
+    nb_slots = (max(rows) + 1) if rows else 0
+    table = np.zeros(nb_slots, dtype=_RECORD)
+    table["chunk_no"] = -1
+    for i, ((t_off, t_len), (d_off, d_len), (s_off, s_len), no) in rows.items():
+        table[i] = (t_off, t_len, d_off, d_len, s_off, s_len, no)
+
+    tmp_bin = rag_dir / (CHUNKS_BIN_NAME + ".tmp")
+    tmp_idx = rag_dir / (CHUNKS_IDX_NAME + ".tmp")
+    tmp_bin.write_bytes(bytes(payload))
+    with open(tmp_idx, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT, nb_slots, len(rows), build_id.encode("ascii")))
+        f.write(table.tobytes())
+    tmp_bin.replace(rag_dir / CHUNKS_BIN_NAME)
+    tmp_idx.replace(rag_dir / CHUNKS_IDX_NAME)
+
+
+# =========================
+# Types d'index FAISS
+# =========================
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+def index_config_from_env(profile: dict | None = None) -> dict:
+    """Config demandée (comparée au manifest pour décider d'un rebuild)."""
+    profile = profile or embedding_profile()
+    cfg = {
+        "type": os.getenv("RAG_INDEX_TYPE", "flat").strip().lower(),
+        "hnsw_m": int(os.getenv("RAG_HNSW_M", "32")),
+        "ef_construction": int(os.getenv("RAG_EF_CONSTRUCTION", "80")),
+        "ef_search": int(os.getenv("RAG_EF_SEARCH", "64")),
+        "nlist": int(os.getenv("RAG_IVF_NLIST", "0")),  # 0 = auto (~4*sqrt(n))
+        "nprobe": int(os.getenv("RAG_NPROBE", "8")),
+        "pq_m": int(os.getenv("RAG_PQ_M", "48")),
+        "pq_nbits": int(os.getenv("RAG_PQ_NBITS", "8")),
+        "proj": profile["proj"],
+        "proj_dim": int(profile["proj_dim"]),
+        "storage": profile["storage"],
+    }
+    if cfg["type"] not in INDEX_TYPES:
+        raise SystemExit(f"RAG_INDEX_TYPE invalide: {cfg['type']} (attendu: {', '.join(INDEX_TYPES)})")
+    return cfg
+
+
+SEARCH_KNOBS = ("ef_search", "nprobe")
+
+
+def build_config(cfg: dict) -> dict:
+    """Partie de la config qui impose de reconstruire l'index (sans efSearch/nprobe)."""
+    return {k: v for k, v in cfg.items() if k not in SEARCH_KNOBS}
+
+
+def search_knobs_from_env() -> dict:
+    """Surcharges efSearch/nprobe au moment de la requête (07, 06_test_retrieval)."""
+    ef_search = os.getenv("RAG_EF_SEARCH", "").strip()
+    nprobe = os.getenv("RAG_NPROBE", "").strip()
+    return {"ef_search": int(ef_search) if ef_search else None, "nprobe": int(nprobe) if nprobe else None}
+
+
+def resolve_index_params(cfg: dict, nb_vectors: int, dim: int) -> dict:
+    """
+    Adapte la config à la taille du corpus (nlist, bits PQ, dims PCA) et à la dimension
+    (sous-vecteurs PQ). index_dim = dimension après projection.
+    """
+    p = dict(cfg)
+    p["dim"] = int(dim)
+    p["trained_on"] = int(nb_vectors)
+    n = max(1, int(nb_vectors))
+
+    p["proj"] = p.get("proj", "none")
+    p["storage"] = p.get("storage", "fp32")
+    if p["proj"] != "none":
+        proj_dim = min(int(p.get("proj_dim") or dim), dim)
+        if p["proj"] == "pca":
+            proj_dim = max(1, min(proj_dim, n - 1))  # PCA: au plus n-1 composantes utiles
+        p["proj_dim"] = proj_dim
+    else:
+        p["proj_dim"] = 0
+    d = p["index_dim"] = p["proj_dim"] or int(dim)
+
+    if p["type"] in {"ivf_flat", "ivf_pq"}:
+        nlist = p["nlist"] or int(4 * math.sqrt(n))
+        p["nlist"] = max(1, min(nlist, n // 39 or 1))  # FAISS veut ~39 points par centroïde
+        p["nprobe"] = max(1, min(p["nprobe"], p["nlist"]))
+
+    if p["type"] == "ivf_pq":
+        m = max(1, min(p["pq_m"], d))
+        while d % m:
+            m -= 1
+        p["pq_m"] = m
+        p["pq_nbits"] = max(1, min(p["pq_nbits"], int(math.log2(n))))
+
+    return p
+
+
+_STORAGE_CODES = {"fp16": "SQfp16", "sq8": "SQ8"}
+
+
+def _inner_spec(params: dict) -> str:
+    """Spec index_factory de l'index ID-mappé (après projection)."""
+    t = params["type"]
+    sq = _STORAGE_CODES.get(params.get("storage", "fp32"))
+    if t == "hnsw":
+        return f"IDMap2,HNSW{params['hnsw_m']}" + (f",{sq}" if sq else "")
+    if t == "ivf_flat":
+        return f"IDMap2,IVF{params['nlist']},{sq or 'Flat'}"
+    if t == "ivf_pq":
+        return f"IDMap2,IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    return f"IDMap2,{sq or 'Flat'}"
+
+
+def index_spec(params: dict) -> str:
+    proj = params.get("proj", "none")
+    prefix = {"pca": f"PCA{params.get('proj_dim')},", "trunc": f"Trunc{params.get('proj_dim')},"}.get(proj, "")
+    return prefix + _inner_spec(params)
+
+
+def supports_remove(params: dict) -> bool:
+    """HNSW ne supporte pas remove_ids -> reconstruction depuis le cache d'embeddings."""
+    return params.get("type", "flat") != "hnsw"
+
+
+def needs_training(params: dict) -> bool:
+    """Composants entraînés sur le corpus du build (IVF, PCA, SQ8): à refaire si le corpus grossit beaucoup."""
+    return (
+        params.get("type", "").startswith("ivf")
+        or params.get("proj") == "pca"
+        or params.get("storage") == "sq8"
+    )
+
+
+def new_index(params: dict) -> faiss.Index:
+    d = params.get("index_dim", params["dim"])
+    index = faiss.index_factory(d, _inner_spec(params), faiss.METRIC_INNER_PRODUCT)
+    if params["type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = params["ef_construction"]
+
+    proj = params.get("proj", "none")
+    if proj == "none":
+        return index
+    # projection puis renormalisation L2 (produit scalaire = cosinus dans l'espace réduit)
+    wrapped = faiss.IndexPreTransform(index)
+    wrapped.prepend_transform(faiss.NormalizationTransform(d, 2.0))
+    if proj == "pca":
+        wrapped.prepend_transform(faiss.PCAMatrix(params["dim"], d))
+    else:
+        wrapped.prepend_transform(faiss.RemapDimensionsTransform(params["dim"], d, False))
+    return wrapped
+
+
+def id_map(index: faiss.Index) -> faiss.IndexIDMap | None:
+    """Couche IDMap2 de l'index (sous une éventuelle projection)."""
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index if isinstance(index, faiss.IndexIDMap) else None
+
+
+def build_index(params: dict, vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    index = new_index(params)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    apply_search_params(index, params)
+    return index
+
+
+class StreamingIndexBuilder:
+    """
+    Construit l'index au fil des shards d'embeddings (ordre quelconque, ids explicites).
+    Flat / HNSW : chaque shard est ajouté dès réception (pas de matrice globale).
+    IVF / PCA / SQ8 : l'entraînement demande tout le corpus -> shards gardés
+    jusqu'à finish() (l'échantillon n'est pas représentatif si les shards arrivent triés).
+    """
+
+    def __init__(self, cfg: dict, nb_vectors: int):
+        self.cfg = cfg
+        self.nb_vectors = int(nb_vectors)
+        self.params: dict | None = None
+        self.index: faiss.Index | None = None
+        self._pending: list[tuple[np.ndarray, np.ndarray]] = []
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if len(ids) == 0:
+            return
+        if self.index is None:
+            self.params = resolve_index_params(self.cfg, self.nb_vectors, vectors.shape[1])
+            self.index = new_index(self.params)
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+        else:
+            self._pending.append((ids, vectors))
+
+    def finish(self) -> tuple[faiss.Index, dict]:
+        if self.index is None:
+            raise ValueError("Aucun vecteur ajouté à l'index")
+        if self._pending:
+            ids = np.concatenate([i for i, _ in self._pending])
+            vectors = np.vstack([v for _, v in self._pending])
+            self._pending = []
+            self.index.train(vectors)
+            self.index.add_with_ids(vectors, ids)
+        apply_search_params(self.index, self.params)
+        return self.index, self.params
+
+
+def apply_search_params(index: faiss.Index, params: dict, ef_search: int | None = None, nprobe: int | None = None):
+    """Paramètres de recherche: valeurs du manifest, surchargées par ef_search/nprobe si fournis."""
+    ps = faiss.ParameterSpace()
+    t = params.get("type", "flat")
+    if t == "hnsw":
+        ps.set_index_parameter(index, "efSearch", int(ef_search or params["ef_search"]))
+    elif t in {"ivf_flat", "ivf_pq"}:
+        ps.set_index_parameter(index, "nprobe", int(nprobe or params["nprobe"]))
+
+
+def filtered_search(index: faiss.Index, queries: np.ndarray, k: int, selector: faiss.IDSelector):
+    """Recherche restreinte aux ids du selector (efSearch/nprobe courants de l'index conservés)."""
+    mapped = id_map(index)
+    inner = faiss.downcast_index(mapped.index) if mapped is not None else index
+    if isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    elif isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+# =========================
+# Chargement / écriture du store complet
+# =========================
+def mmap_flags(params: dict) -> int:
+    """Flags de lecture mmap adaptés au type d'index (params du manifest)."""
+    if params.get("type", "flat").startswith("ivf"):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return (MMAP_IFC or faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def load_index(rag_dir: Path, mmap: bool = False, params: dict | None = None) -> faiss.Index:
+    """
+    mmap=True: lecture seule, pages partagées entre process (lecteurs); False: copie modifiable (build).
+    params: manifest["index"]["params"] (relu depuis le manifest de la version si absent).
+    """
+    path = str(version_dir(rag_dir) / INDEX_NAME)
+    if not mmap:
+        return faiss.read_index(path)
+    if params is None:
+        params = (load_manifest(rag_dir) or {}).get("index", {}).get("params", {})
+    try:
+        return faiss.read_index(path, mmap_flags(params))
+    except RuntimeError as e:
+        print(f"⚠️ Index {path}: lecture mmap impossible ({str(e).strip().splitlines()[-1]}) -> lecture classique")
+        return faiss.read_index(path)
+
+
+def load_store(
+    rag_dir: Path,
+    ef_search: int | None = None,
+    nprobe: int | None = None,
+    model_id: str | None = None,
+) -> tuple[faiss.Index, ChunkStore]:
+    """
+    Index (mmap) + chunk store de la version courante, avec contrôle d'alignement
+    (build_id + nb de chunks).
+    model_id: vérifie que les requêtes seront encodées comme les passages (modèle + backend).
+    """
+    index, store, _ = _open_version(version_dir(rag_dir), ef_search, nprobe, model_id)
+    return index, store
+
+
+def _open_version(vdir: Path, ef_search, nprobe, model_id) -> tuple[faiss.Index, ChunkStore, dict]:
+    manifest = load_manifest(vdir)
+    if manifest is None:
+        raise SystemExit(f"Store RAG absent ou ancien format dans {vdir}. Relance 06_build_rag_index.py")
+    if model_id and manifest.get("model") != model_id:
+        raise SystemExit(
+            f"Index construit avec '{manifest.get('model')}' mais encodeur '{model_id}'. "
+            "Aligne EMB_BACKEND ou relance 06_build_rag_index.py"
+        )
+
+    store = ChunkStore(vdir)
+    index = load_index(vdir, mmap=True, params=manifest.get("index", {}).get("params", {}))
+    nb_indexed = len(store) - len(duplicate_map(manifest))
+    if store.build_id != manifest.get("build_id") or index.ntotal != nb_indexed:
+        raise SystemExit("Index FAISS et chunk store désalignés. Relance 06_build_rag_index.py --full")
+    apply_search_params(index, manifest.get("index", {}).get("params", {}), ef_search=ef_search, nprobe=nprobe)
+    return index, store, manifest
+
+
+class StoreReader:
+    """
+    Lecteur longue durée de la version courante. refresh() (à appeler entre deux
+    batches) relit CURRENT et, si un nouveau build a été publié, ouvre la nouvelle
+    version; l'ancienne est fermée (ses pages mmap sont libérées par l'OS).
+    """
+
+    def __init__(self, rag_dir: Path, ef_search: int | None = None, nprobe: int | None = None,
+                 model_id: str | None = None):
+        self.rag_dir = Path(rag_dir)
+        self._opts = (ef_search, nprobe, model_id)
+        self.version: str | None = None
+        self.index: faiss.Index | None = None
+        self.store: ChunkStore | None = None
+        self.manifest: dict = {}
+        self.nb_reloads = 0
+        self._open(current_version(self.rag_dir))
+
+    def _open(self, version: str | None) -> None:
+        index, store, manifest = _open_version(version_dir(self.rag_dir, version), *self._opts)
+        old = self.store
+        self.version, self.index, self.store, self.manifest = version, index, store, manifest
+        if old is not None:
+            old.close()
+
+    def refresh(self) -> bool:
+        """True si une nouvelle version a été chargée."""
+        version = current_version(self.rag_dir)
+        if version == self.version:
+            return False
+        self._open(version)
+        self.nb_reloads += 1
+        return True
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
+
+
+def write_store(
+    rag_dir: Path,
+    index: faiss.Index,
+    manifest: dict,
+    records: Iterable[tuple[int, ChunkRecord]],
+) -> Path:
+    """
+    Écrit index + chunk store + manifest dans versions/<build_id>/, publie la version
+    (CURRENT) puis supprime les anciennes. Retourne le dossier de la version.
+    Manifest identique à celui de CURRENT -> rien n'est écrit ni publié: la version
+    courante est gardée (et son build_id reporté dans manifest).
+    """
+    rag_dir = Path(rag_dir)
+    current = load_manifest(rag_dir) if current_version(rag_dir) else None
+    if current is not None and manifest_hash(current) == manifest_hash(manifest):
+        manifest["build_id"] = current["build_id"]
+        return version_dir(rag_dir)
+
+    build_id = new_build_id()
+    vdir = rag_dir / VERSIONS_DIR / build_id
+    vdir.mkdir(parents=True, exist_ok=False)
+
+    faiss.write_index(index, str(vdir / INDEX_NAME))
+    write_chunk_store(vdir, build_id, records)
+    manifest["build_id"] = build_id
+    save_manifest(vdir, manifest)
+
+    publish_version(rag_dir, build_id)
+    prune_versions(rag_dir)
+    for name in LEGACY_NAMES + FLAT_NAMES:
+        (rag_dir / name).unlink(missing_ok=True)
+    return vdir
@@ -0,0 +1,89 @@
+# src/template_lane.py
+"""
+Voie "template" de 09: réponses déterministes pour les cas routiniers, sans LLM.
+
+Règles dans policy/policy_config.json -> "template_lane":
+- critères (listes de valeurs admises, critère absent = tout accepté):
+  urgency, category, rule_match, category_match, language
+- allow_secondary=false: un message avec secondary_category part au LLM
+- template: texte paramétré, placeholders
+    {fallback}          réponse de fallback_json pour (niveau, catégorie)
+    {level_template}    response_template du niveau dans la policy
+    {urgency_level} {category} {secondary_category} {residence_id}
+
+La sortie garde le schéma de fallback_json (SLA, assigned_to, required_info)
+avec decision_source = DECISION_SOURCE.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+TEMPLATE_LANE_ENABLED = os.getenv("LLM_TEMPLATE_LANE", "1").strip() == "1"
+DECISION_SOURCE = "TEMPLATE"
+
+CRITERIA = ("urgency", "category", "rule_match", "category_match", "language")
+
+
+class _Defaults(dict):
+    def __missing__(self, key: str) -> str:
+        return ""
+
+
+def _cell(value: Any) -> str:
+    """Cellule CSV -> texte ('' pour NaN / None)."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return str(value).strip()
+
+
+class TemplateLane:
+    def __init__(self, rules: List[Dict[str, Any]], level_templates: Dict[str, str], enabled: bool = True):
+        self.rules = rules
+        self.level_templates = level_templates
+        self.enabled = enabled and bool(rules)
+
+    @classmethod
+    def from_policy(cls, policy_path: Path, enabled: bool = TEMPLATE_LANE_ENABLED) -> "TemplateLane":
+        policy = json.loads(Path(policy_path).read_text(encoding="utf-8"))
+        lane = policy.get("template_lane", {})
+        levels = {lvl: str(cfg.get("response_template", "")) for lvl, cfg in policy.get("levels", {}).items()}
+        return cls(lane.get("rules", []), levels, enabled=enabled and bool(lane.get("enabled", True)))
+
+    def match(self, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Première règle dont tous les critères correspondent, sinon None (-> LLM)."""
+        if not self.enabled:
+            return None
+        for rule in self.rules:
+            if not rule.get("allow_secondary", False) and _cell(fields.get("secondary_category")):
+                continue
+            if all(
+                _cell(fields.get(c)) in rule[c]
+                for c in CRITERIA if rule.get(c) is not None
+            ):
+                return rule
+        return None
+
+    def render(
+        self,
+        rule: Dict[str, Any],
+        fields: Dict[str, Any],
+        fallback: Callable[..., Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """fallback: fallback_json(urgency, category, rag_context, secondary_category=...)."""
+        urgency, category = _cell(fields.get("urgency")), _cell(fields.get("category"))
+        sec = _cell(fields.get("secondary_category"))
+        out = fallback(urgency, category, _cell(fields.get("rag_context")), secondary_category=sec)
+        values = _Defaults(
+            fallback=out["response_draft"],
+            level_template=self.level_templates.get(out["urgency_level"], ""),
+            urgency_level=out["urgency_level"],
+            category=out["category"],
+            secondary_category=sec,
+            residence_id=_cell(fields.get("residence_id")),
+        )
+        out["response_draft"] = " ".join(rule.get("template", "{fallback}").format_map(values).split())
+        out["decision_source"] = DECISION_SOURCE
+        return out